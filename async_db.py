@@ -0,0 +1,124 @@
+"""
+Асинхронный фасад над database.py для хендлеров aiogram.
+
+Каждая функция повторяет сигнатуру синхронной версии, но выполняется
+в отдельном пуле потоков, поэтому ожидание блокировки SQLite или fsync
+не останавливает event loop и остальных пользователей. Чтения и записи
+идут в разные пулы: записи, ждущие _write_lock (или долгий VACUUM),
+не занимают потоки, на которых работают читатели:
+
+    import async_db as db
+    user = await db.get_user(user_id)
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+from services import entitlement_service
+
+# По потоку на читающее соединение пула: читатели работают параллельно
+_read_executor = ThreadPoolExecutor(
+    max_workers=database._SQLITE_READERS,
+    thread_name_prefix="db-read",
+)
+# Пишущее соединение одно, и записи всё равно идут по одной под _write_lock
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+
+
+async def run_sync(func, *args, **kwargs):
+    """Выполнить синхронное чтение из БД в потоке читателей."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _read_executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+async def run_write(func, *args, **kwargs):
+    """Выполнить синхронную запись в БД в потоке писателя."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _write_executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+def _make_async(func, write: bool = False):
+    run = run_write if write else run_sync
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+
+    return wrapper
+
+
+def shutdown():
+    """Дождаться текущих операций и остановить пулы потоков."""
+    _write_executor.shutdown(wait=True)
+    _read_executor.shutdown(wait=True)
+
+
+# Чистые функции без обращения к БД (колонки кешируются) — оставляем синхронными
+user_get = database.user_get
+is_vip_username = database.is_vip_username
+
+init_db = _make_async(database.init_db, write=True)
+get_schema_version = _make_async(database.get_schema_version)
+close_db = _make_async(database.close_db, write=True)
+get_users_columns = _make_async(database.get_users_columns)
+
+create_user = _make_async(database.create_user, write=True)
+get_user = _make_async(database.get_user)
+get_user_id_by_username = _make_async(database.get_user_id_by_username)
+set_user_level = _make_async(database.set_user_level, write=True)
+mark_onboarding_completed = _make_async(database.mark_onboarding_completed, write=True)
+is_onboarding_completed = _make_async(database.is_onboarding_completed)
+increment_message_count = _make_async(database.increment_message_count, write=True)
+update_user_streak = _make_async(database.update_user_streak, write=True)
+set_referral_code = _make_async(database.set_referral_code, write=True)
+get_user_by_referral_code = _make_async(database.get_user_by_referral_code)
+get_user_id_by_referral_code = _make_async(database.get_user_id_by_referral_code)
+add_referral = _make_async(database.add_referral, write=True)
+add_messages = _make_async(database.add_messages, write=True)
+get_streak_reward_level = _make_async(database.get_streak_reward_level)
+set_streak_reward_level = _make_async(database.set_streak_reward_level, write=True)
+
+activate_subscription = _make_async(database.activate_subscription, write=True)
+get_subscription = _make_async(database.get_subscription)
+get_subscription_expiry = _make_async(database.get_subscription_expiry)
+has_active_subscription = _make_async(database.has_active_subscription)
+add_subscription = _make_async(database.add_subscription, write=True)
+add_premium_days = _make_async(database.add_premium_days, write=True)
+can_send_message = _make_async(database.can_send_message)
+check_entitlement = _make_async(entitlement_service.check_entitlement)
+
+save_payment = _make_async(database.save_payment, write=True)
+is_transaction_processed = _make_async(database.is_transaction_processed)
+mark_transaction_processed = _make_async(database.mark_transaction_processed, write=True)
+
+save_message = _make_async(database.save_message, write=True)
+flush_history = _make_async(database.flush_history, write=True)
+get_conversation_history = _make_async(database.get_conversation_history)
+record_turn = _make_async(database.record_turn, write=True)
+reset_conversation = _make_async(database.reset_conversation, write=True)
+get_conversation_summary = _make_async(database.get_conversation_summary)
+get_messages_after = _make_async(database.get_messages_after)
+save_conversation_summary = _make_async(database.save_conversation_summary, write=True)
+get_users_with_history_over = _make_async(database.get_users_with_history_over)
+archive_conversation_batch = _make_async(database.archive_conversation_batch, write=True)
+checkpoint_wal = _make_async(database.checkpoint_wal, write=True)
+vacuum_db = _make_async(database.vacuum_db, write=True)
+
+get_dictionary_entry = _make_async(database.get_dictionary_entry)
+save_dictionary_entry = _make_async(database.save_dictionary_entry, write=True)
+purge_dictionary_cache = _make_async(database.purge_dictionary_cache, write=True)
+
+get_stats = _make_async(database.get_stats)
+reconcile_stats = _make_async(database.reconcile_stats, write=True)
+get_total_users = _make_async(database.get_total_users)
+get_all_user_ids = _make_async(database.get_all_user_ids)
+get_inactive_users = _make_async(database.get_inactive_users)
+set_reminder_sent = _make_async(database.set_reminder_sent, write=True)
+get_active_subscriptions = _make_async(database.get_active_subscriptions)
+get_users_by_level = _make_async(database.get_users_by_level)
+get_average_messages = _make_async(database.get_average_messages)
@@ -0,0 +1,74 @@
+"""
+Накладные расходы БД на одно текстовое сообщение: те ~10 обращений,
+которые делал обработчик диалога (лимиты, история, пользователь, запись
+реплик, счётчики, streak), на временной базе.
+
+    python bench/db_per_message.py
+    python bench/db_per_message.py --users 200 --messages 5000
+
+Для сравнения с соединением на каждый вызов — тот же скрипт на
+database.py до пула соединений:
+
+    git checkout baa247c^ -- database.py && python bench/db_per_message.py
+    git checkout HEAD -- database.py
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+def one_message(user_id: int, text: str):
+    """Вызовы БД одного текстового сообщения, в порядке обработчика."""
+    database.can_send_message(user_id, f"user{user_id}")
+    database.is_onboarding_completed(user_id)
+    database.get_conversation_history(user_id)
+    database.get_user(user_id)
+    database.save_message(user_id, "user", text)
+    database.save_message(user_id, "assistant", f"Reply to: {text}")
+    database.increment_message_count(user_id, f"user{user_id}")
+    database.get_user(user_id)
+    database.update_user_streak(user_id, 1, date.today().isoformat())
+    database.get_streak_reward_level(user_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время БД на одно сообщение")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        database.init_db()
+        for user_id in range(1, args.users + 1):
+            database.create_user(user_id, f"user{user_id}")
+
+        rnd = random.Random(args.seed)
+        user_ids = [rnd.randint(1, args.users) for _ in range(args.messages)]
+        # Прогрев: соединения, кеши колонок и выражений
+        for user_id in user_ids[:50]:
+            one_message(user_id, "warm up")
+
+        started = time.perf_counter()
+        for i, user_id in enumerate(user_ids):
+            one_message(user_id, f"message {i}")
+        elapsed = time.perf_counter() - started
+
+        if hasattr(database, "close_db"):
+            database.close_db()
+
+    print(f"{args.messages} сообщений, {args.users} пользователей")
+    print(f"{elapsed / args.messages * 1000:.2f} ms на сообщение")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Задержка get_conversation_history на большой истории: база засевается
+N строками conversation_history (реплики пользователей вперемешку, как
+в живом боте), затем p50/p99 выборки последних сообщений случайных
+пользователей.
+
+    python bench/history_fetch.py                       # 5M строк, 10k пользователей
+    python bench/history_fetch.py --rows 500000 --fetches 1000
+
+Для сравнения с выборкой без индекса (user_id, id) — тот же скрипт
+на database.py до него:
+
+    git checkout 6e4009e^ -- database.py && python bench/history_fetch.py
+    git checkout HEAD -- database.py
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+SEED_BATCH = 100_000
+
+
+def seed(rows: int, users: int, rnd: random.Random):
+    started = datetime(2024, 1, 1)
+    with database._connect_locked() as conn:
+        for offset in range(0, rows, SEED_BATCH):
+            batch = []
+            for i in range(offset, min(offset + SEED_BATCH, rows)):
+                batch.append(
+                    (
+                        rnd.randint(1, users),
+                        "user" if i % 2 == 0 else "assistant",
+                        f"message {i} about something the student said",
+                        (started + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S"),
+                    )
+                )
+            conn.executemany(
+                "INSERT INTO conversation_history (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                batch,
+            )
+
+
+def percentile(values: list[float], q: float) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="p50/p99 get_conversation_history")
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--fetches", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        database.init_db()
+
+        t0 = time.perf_counter()
+        seed(args.rows, args.users, rnd)
+        print(f"Засеяно {args.rows} строк для {args.users} пользователей за {time.perf_counter() - t0:.1f} с")
+
+        timings = []
+        for _ in range(args.fetches):
+            user_id = rnd.randint(1, args.users)
+            started = time.perf_counter()
+            database.get_conversation_history(user_id)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        if hasattr(database, "close_db"):
+            database.close_db()
+
+    print(
+        f"{args.fetches} выборок: p50 {percentile(timings, 50):.2f} ms, "
+        f"p99 {percentile(timings, 99):.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
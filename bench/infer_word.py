@@ -0,0 +1,81 @@
+"""
+Время infer_word_from_recent_context на длинной и короткой истории:
+шесть сообщений ассистента по 400 слов и пара коротких реплик.
+
+    python bench/infer_word.py
+    python bench/infer_word.py --calls 200
+
+Для сравнения с версией до отсечения кандидатов:
+
+    git checkout 671a854^ -- services/ollama_service.py && python bench/infer_word.py
+    git checkout HEAD -- services/ollama_service.py
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.ollama_service import infer_word_from_recent_context
+
+VOCABULARY = (
+    "comedies adventure breakfast environment necessary beautiful weather library "
+    "committee rainbow strawberry vegetables tomorrow interesting circle occupation "
+    "travel friend summer winter holiday museum ticket station mountain river "
+    "village kitchen garden teacher student homework language grammar sentence"
+).split()
+QUERIES = [
+    "what does come it is mean",
+    "what does brekfast mean",
+    "meaning of enviroment",
+    "translate the word nessesary",
+    "what does xyzzy mean",
+]
+
+
+def _random_word(rnd: random.Random) -> str:
+    return "".join(rnd.choice("abcdefghijklmnoprstuvwy") for _ in range(rnd.randint(3, 10)))
+
+
+def long_history(rnd: random.Random, messages: int = 6, words: int = 400) -> list:
+    """Половина слов — из словаря, половина случайные: уникальных слов как в живом тексте."""
+    return [
+        (
+            "assistant",
+            " ".join(
+                rnd.choice(VOCABULARY) if rnd.random() < 0.5 else _random_word(rnd)
+                for _ in range(words)
+            ),
+        )
+        for _ in range(messages)
+    ]
+
+
+SHORT_HISTORY = [
+    ("user", "I watch films"),
+    ("assistant", "Great! Do you prefer comedies, thrillers or dramas?"),
+]
+
+
+def ms_per_call(history: list, calls: int) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        infer_word_from_recent_context(QUERIES[i % len(QUERIES)], history)
+    return (time.perf_counter() - started) / calls * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время infer_word_from_recent_context, мс")
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    history = long_history(random.Random(args.seed))
+    print(f"6 x 400 слов: {ms_per_call(history, args.calls):.2f} ms/call")
+    print(f"короткая история: {ms_per_call(SHORT_HISTORY, args.calls * 20):.3f} ms/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Пропускная способность записи истории: save_message синхронно
+и с буфером write-behind (HISTORY_WRITE_BEHIND), 1k и 10k вставок
+на временной базе.
+
+    python bench/insert_throughput.py
+    python bench/insert_throughput.py --counts 1000 10000 100000 --dir /dev/shm
+
+"с flush" — включая запись остатка буфера в конце, то есть до момента,
+когда все строки закоммичены.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+def run(count: int, users: int, write_behind: bool, directory: str | None) -> tuple[float, float]:
+    """Вставок в секунду: (для вызывающего, с учётом финального flush)."""
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        database.init_db()
+        database._history_buffer = (
+            database._HistoryBuffer(database._HISTORY_FLUSH_SIZE, database._HISTORY_FLUSH_INTERVAL)
+            if write_behind
+            else None
+        )
+
+        started = time.perf_counter()
+        for i in range(count):
+            database.save_message(i % users + 1, "user", f"message {i}")
+        enqueued = time.perf_counter() - started
+        database.flush_history()
+        total = time.perf_counter() - started
+
+        database._history_buffer = None
+        database.close_db()
+    return count / enqueued, count / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Вставки в conversation_history в секунду")
+    parser.add_argument("--counts", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--dir", default=None, help="каталог для временной базы (например, tmpfs)")
+    args = parser.parse_args()
+
+    print(f"HISTORY_FLUSH_SIZE={database._HISTORY_FLUSH_SIZE}")
+    for count in args.counts:
+        sync_rate, _ = run(count, args.users, False, args.dir)
+        buffered_rate, flushed_rate = run(count, args.users, True, args.dir)
+        print(
+            f"{count:>7} вставок: синхронно {sync_rate / 1000:.1f}k/s, "
+            f"write-behind {buffered_rate / 1000:.1f}k/s (с flush {flushed_rate / 1000:.1f}k/s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Микробенчмарк разбора сообщения до вызова LLM: какой режим (слово,
+перевод текста, разговор) и подсказка check_word_and_suggest для разговора.
+
+    python bench/intent_routing.py
+    python bench/intent_routing.py --rounds 2000
+
+"последовательно" — как get_ollama_response разбирал сообщение до
+intent_router: extract_word_from_query, дважды is_word_translation_request
+и регулярки префикса translate. Эти функции есть и в старом, и в новом
+ollama_service, поэтому для сравнения достаточно запустить скрипт на
+версии до intent_router:
+
+    git checkout 0d5fcf9^ -- services/ollama_service.py && python bench/intent_routing.py
+    git checkout HEAD -- services/ollama_service.py
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import ollama_service
+
+try:
+    from services import intent_router
+except ImportError:  # версия до intent_router
+    intent_router = None
+
+MESSAGES = [
+    "Hi! How are you today?",
+    "I went to the cinema yesterday with my friends",
+    "what does serendipity mean?",
+    "What is the meaning of the word 'cozy'?",
+    "translate apple please",
+    "translate: I would like a cup of coffee",
+    "переведи слово собака",
+    "Переведи: мне нравится изучать английский",
+    "что значит awkward",
+    "как переводится 'to give up'?",
+    "Can you explain the difference between say and tell?",
+    "I am agree with you",
+    "My favourite food is pizza and pasta",
+    "What does it mean?",
+    "meaning of ubiquitous",
+    "how do you say кошка in English",
+    "I want to travel to London next summer",
+    "Tell me a joke",
+    "define resilience",
+    "What's the translation of 'butterfly'?",
+    "I has two brothers and one sister",
+    "Yesterday I goed to the park",
+    "what is mean by come it is",
+    "Please help me with my homework",
+    "perevedi slovo table",
+    "translate",
+    "Привет! Давай поговорим",
+    "I like reading books about history and science",
+]
+
+
+def sequential_routing(user_text: str):
+    """Разбор сообщения так, как это делал get_ollama_response до intent_router."""
+    lower = user_text.strip().lower()
+    word = ollama_service.extract_word_from_query(user_text)
+    translation = ollama_service.is_word_translation_request(user_text)
+    if word:
+        return word, ollama_service.is_word_translation_request(user_text), None
+    if lower.startswith("translate") or lower.startswith("переведи") or lower.startswith("перевести"):
+        text = re.sub(
+            r"^(translate|переведи|перевести)\s*[:,\-]?\s*", "", user_text.strip(), flags=re.IGNORECASE
+        ).strip()
+        text = re.sub(r"^\s*please\s*[:,\-]?\s*", "", text, flags=re.IGNORECASE).strip()
+        return None, translation, text
+    return None, translation, None
+
+
+def routed(user_text: str):
+    intent = intent_router.route(user_text)
+    return intent.word, intent.translation_request, intent.translate_text
+
+
+def measure(route, rounds: int, with_suggest: bool, repeat: int = 5) -> float:
+    """Микросекунд на сообщение, лучший из repeat прогонов (как timeit)."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for text in MESSAGES:
+                word, _, translate_text = route(text)
+                if with_suggest and not word and translate_text is None:
+                    ollama_service.check_word_and_suggest(text)
+        best = min(best, time.perf_counter() - started)
+    return best / (rounds * len(MESSAGES)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время разбора сообщения, мкс")
+    parser.add_argument("--rounds", type=int, default=500)
+    args = parser.parse_args()
+
+    variants = [("последовательно", sequential_routing)]
+    if intent_router is not None:
+        variants.append(("intent_router.route", routed))
+    for name, route in variants:
+        measure(route, 10, True, repeat=1)  # прогрев кешей re и lru_cache
+        print(
+            f"{name}: разбор {measure(route, args.rounds, False):.1f} us/msg, "
+            f"с check_word_and_suggest {measure(route, args.rounds, True):.1f} us/msg"
+        )
+
+
+if __name__ == "__main__":
+    main()
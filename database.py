@@ -1,17 +1,26 @@
 import os
+import queue
 import sqlite3
 import threading
+import time
+import zlib
+from collections import OrderedDict
 from contextlib import contextmanager
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 from dotenv import load_dotenv
 
+from logger import get_logger
+
 load_dotenv()
 
+logger = get_logger("database")
+
 DB_NAME = os.path.join(os.path.dirname(__file__), "bot.db")
 
 # --- columns cache for users table ---
 _USERS_COLUMNS_CACHE = None
+_USERS_LAYOUT_CACHE = None
 
 
 def get_users_columns() -> list[str]:
@@ -23,7 +32,7 @@ def get_users_columns() -> list[str]:
     if _USERS_COLUMNS_CACHE is not None:
         return _USERS_COLUMNS_CACHE
 
-    with _connect_locked() as conn:
+    with _connect_read() as conn:
         cur = conn.cursor()
         cur.execute("PRAGMA table_info(users)")
         cols = [row[1] for row in cur.fetchall()]  # row[1] = name
@@ -31,7 +40,74 @@ def get_users_columns() -> list[str]:
         return cols
 
 
-def user_get(user_row: tuple, column: str, default=None):
+def _reset_users_columns_cache():
+    """Сбросить кеш колонок (после изменения схемы users)."""
+    global _USERS_COLUMNS_CACHE, _USERS_LAYOUT_CACHE
+    _USERS_COLUMNS_CACHE = None
+    _USERS_LAYOUT_CACHE = None
+    _user_cache.clear()
+
+
+class UserRecord:
+    """
+    Строка таблицы users с доступом по имени колонки за O(1): user.level,
+    user.streak_days и т.д. Собирается один раз на строку; объекты шарятся
+    через кеш, поэтому менять их нельзя.
+    """
+
+    __slots__ = (
+        "user_id",
+        "username",
+        "message_count",
+        "created_at",
+        "level",
+        "onboarding_completed",
+        "last_active_date",
+        "streak_days",
+        "referral_code",
+        "last_referral_bonus",
+        "last_reminder_sent",
+        "messages_count",
+        "last_streak_reward",
+    )
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UserRecord is read-only")
+
+    def get(self, column: str, default=None):
+        val = getattr(self, column, None)
+        return default if val is None else val
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"UserRecord({fields})"
+
+
+def _users_layout() -> tuple[tuple[str, int], ...]:
+    """Пары (поле UserRecord, индекс в SELECT * FROM users) для текущей схемы."""
+    global _USERS_LAYOUT_CACHE
+    if _USERS_LAYOUT_CACHE is None:
+        fields = set(UserRecord.__slots__)
+        _USERS_LAYOUT_CACHE = tuple(
+            (name, idx) for idx, name in enumerate(get_users_columns()) if name in fields
+        )
+    return _USERS_LAYOUT_CACHE
+
+
+def _row_to_user(row: tuple | None) -> UserRecord | None:
+    if row is None:
+        return None
+    return UserRecord(**{name: row[idx] for name, idx in _users_layout() if idx < len(row)})
+
+
+def user_get(user_row, column: str, default=None):
+    if isinstance(user_row, UserRecord):
+        return user_row.get(column, default)
+    # Старый формат: кортеж из SELECT * FROM users
     cols = get_users_columns()
     try:
         idx = cols.index(column)
@@ -43,14 +119,81 @@ def user_get(user_row: tuple, column: str, default=None):
     return default if val is None else val
 
 
-# Один общий lock на все операции с БД.
-# Важно: SQLite на Windows легко ловит "database is locked", если параллельно
-# идут несколько записей/DDL или кто-то держит транзакцию открытой.
-_db_lock = threading.RLock()
+# Кеш пользователей в памяти процесса: get_user вызывается 3-5 раз на сообщение.
+# Каждый мутатор users сбрасывает запись после коммита, так что устаревшие
+# данные живут не дольше USER_CACHE_TTL только если строку поменяли в обход database.py.
+_USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+_USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+_MISSING = object()
+
+
+class _UserCache:
+    """LRU + TTL кеш UserRecord по user_id (None тоже кешируется)."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._items = OrderedDict()  # user_id -> (expires_at, UserRecord | None)
+        self._versions = {}  # user_id -> счётчик инвалидаций
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int):
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None:
+                return _MISSING
+            if item[0] < time.monotonic():
+                del self._items[user_id]
+                return _MISSING
+            self._items.move_to_end(user_id)
+            return item[1]
+
+    def version(self, user_id: int) -> int:
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    def put(self, user_id: int, user: UserRecord | None, version: int):
+        with self._lock:
+            # Пока мы читали, строку успели поменять — не кешируем старую версию
+            if self._versions.get(user_id, 0) != version:
+                return
+            self._items[user_id] = (time.monotonic() + self._ttl, user)
+            self._items.move_to_end(user_id)
+            while len(self._items) > self._max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._items.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            for user_id in self._items:
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._items.clear()
+
+
+_user_cache = _UserCache(_USER_CACHE_SIZE, _USER_CACHE_TTL)
+
+
+# Lock только для записи и DDL: пишущее соединение одно, и запись в SQLite
+# всё равно однопоточная. Важно: SQLite на Windows легко ловит "database is locked",
+# если параллельно идут несколько записей/DDL или кто-то держит транзакцию открытой.
+# Чтение идёт без lock через отдельные соединения: в режиме WAL читатели
+# видят последний закоммиченный снимок и не ждут писателя.
+_write_lock = threading.RLock()
 
 # Таймаут ожидания разблокировки БД (сек)
 _SQLITE_TIMEOUT = float(os.getenv("SQLITE_TIMEOUT", "30"))
 
+# Сколько читающих соединений держим открытыми (помимо одного пишущего)
+_SQLITE_READERS = max(1, int(os.getenv("SQLITE_READERS", "4")))
+
+# Размер кеша подготовленных выражений на соединение
+_SQLITE_STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))
+
 
 def _get_connection() -> sqlite3.Connection:
     # check_same_thread=False безопаснее, если какие-то операции окажутся в других потоках
@@ -59,6 +202,7 @@ def _get_connection() -> sqlite3.Connection:
         DB_NAME,
         timeout=_SQLITE_TIMEOUT,
         check_same_thread=False,
+        cached_statements=_SQLITE_STATEMENT_CACHE,
     )
     # Практические настройки для конкуренции:
     # - busy_timeout: сколько ждать, если файл залочен
@@ -70,125 +214,426 @@ def _get_connection() -> sqlite3.Connection:
     return conn
 
 
+class _ConnectionPool:
+    """
+    Долгоживущие соединения: один пишущий + до N читающих.
+    PRAGMA выполняются один раз при открытии, а sqlite3 сам переиспользует
+    подготовленные выражения (cached_statements) между вызовами.
+    """
+
+    def __init__(self, readers: int):
+        self._max_readers = readers
+        self._lock = threading.Lock()
+        self._writer = None
+        self._idle_readers = queue.LifoQueue()
+        self._all_readers = []
+
+    def writer(self) -> sqlite3.Connection:
+        # Вызывается только под _write_lock, поэтому отдельная синхронизация не нужна.
+        if self._writer is None:
+            self._writer = _get_connection()
+        return self._writer
+
+    def acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._idle_readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._all_readers) < self._max_readers:
+                conn = _get_connection()
+                self._all_readers.append(conn)
+                return conn
+        # Все читатели заняты — ждём, пока кто-то вернёт соединение
+        return self._idle_readers.get()
+
+    def release_reader(self, conn: sqlite3.Connection):
+        self._idle_readers.put(conn)
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            for conn in self._all_readers:
+                conn.close()
+            self._all_readers = []
+            self._idle_readers = queue.LifoQueue()
+
+
+_pool = _ConnectionPool(_SQLITE_READERS)
+
+
 @contextmanager
 def _connect_locked():
-    with _db_lock:
-        conn = _get_connection()
+    """Пишущее соединение: запись и DDL строго по одной, коммит при успехе, откат при ошибке."""
+    with _write_lock:
+        conn = _pool.writer()
         try:
             yield conn
             conn.commit()
-        finally:
-            conn.close()
+        except BaseException:
+            conn.rollback()
+            raise
 
 
-def init_db():
-    with _connect_locked() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                message_count INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                level TEXT DEFAULT NULL,
-                onboarding_completed INTEGER DEFAULT 0,
-                last_active_date TEXT,
-                streak_days INTEGER DEFAULT 0,
-                referral_code TEXT,
-                last_referral_bonus TEXT
-            )
-            """
+@contextmanager
+def _connect_read():
+    """Читающее соединение из пула (только SELECT), параллельно с записью."""
+    conn = _pool.acquire_reader()
+    try:
+        yield conn
+    finally:
+        _pool.release_reader(conn)
+
+
+def close_db():
+    """Закрывает все соединения пула (при остановке бота)."""
+    with _write_lock:
+        _pool.close()
+
+
+# --- Счётчики статистики ---
+# /stats читает готовые агрегаты из stats_counters вместо полных сканов users.
+# Счётчики меняются в той же транзакции, что и сами данные, а reconcile_stats()
+# периодически сверяет их с таблицами.
+_STAT_USERS_TOTAL = "users_total"
+_STAT_MESSAGES_TOTAL = "messages_total"
+_STAT_LEVEL_PREFIX = "level:"
+
+
+def _level_stat(level: str | None) -> str:
+    return _STAT_LEVEL_PREFIX + (level or "Unknown")
+
+
+def _bump_stat(cur: sqlite3.Cursor, name: str, delta: int):
+    cur.execute(
+        """
+        INSERT INTO stats_counters (name, value) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        """,
+        (name, delta),
+    )
+
+
+def _compute_stats(cur: sqlite3.Cursor) -> dict[str, int]:
+    """Честный пересчёт счётчиков по таблицам (полный скан users)."""
+    cur.execute("SELECT COUNT(*), COALESCE(SUM(message_count), 0) FROM users")
+    users_total, messages_total = cur.fetchone()
+    stats = {_STAT_USERS_TOTAL: users_total, _STAT_MESSAGES_TOTAL: messages_total}
+    cur.execute("SELECT level, COUNT(*) FROM users GROUP BY COALESCE(level, 'Unknown')")
+    for level, count in cur.fetchall():
+        stats[_level_stat(level)] = count
+    return stats
+
+
+def _write_stats(cur: sqlite3.Cursor, stats: dict[str, int]):
+    cur.execute("DELETE FROM stats_counters")
+    cur.executemany(
+        "INSERT INTO stats_counters (name, value) VALUES (?, ?)", stats.items()
+    )
+
+
+# --- Миграции схемы ---
+# Номер последней применённой миграции хранится в schema_version. При старте
+# сверяем его с SCHEMA_VERSION и выполняем только недостающие шаги, каждый в
+# своей транзакции. Шаги идемпотентны: базы, созданные до появления
+# schema_version, проходят их с нуля без ошибок.
+
+
+def _add_column_if_missing(cur: sqlite3.Cursor, table: str, column: str, ddl: str):
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cur.fetchall()}:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+def _migration_base_tables(cur: sqlite3.Cursor):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            message_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            level TEXT DEFAULT NULL,
+            onboarding_completed INTEGER DEFAULT 0,
+            last_active_date TEXT,
+            streak_days INTEGER DEFAULT 0,
+            referral_code TEXT,
+            last_referral_bonus TEXT
         )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS subscriptions (
-                user_id INTEGER PRIMARY KEY,
-                expires_at TEXT,
-                FOREIGN KEY(user_id) REFERENCES users(user_id)
-            )
-            """
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            user_id INTEGER PRIMARY KEY,
+            expires_at TEXT,
+            FOREIGN KEY(user_id) REFERENCES users(user_id)
         )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS payments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                payment_method TEXT,
-                amount REAL,
-                currency TEXT,
-                transaction_id TEXT UNIQUE,
-                status TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            payment_method TEXT,
+            amount REAL,
+            currency TEXT,
+            transaction_id TEXT UNIQUE,
+            status TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS conversation_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                role TEXT,
-                content TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS conversation_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            role TEXT,
+            content TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS referrals (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                inviter_id INTEGER NOT NULL,
-                invitee_id INTEGER NOT NULL UNIQUE,
-                referral_code TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(inviter_id) REFERENCES users(user_id),
-                FOREIGN KEY(invitee_id) REFERENCES users(user_id)
-            )
-            """
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS referrals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            inviter_id INTEGER NOT NULL,
+            invitee_id INTEGER NOT NULL UNIQUE,
+            referral_code TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(inviter_id) REFERENCES users(user_id),
+            FOREIGN KEY(invitee_id) REFERENCES users(user_id)
         )
-        cursor.execute(
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS processed_transactions (
+            tx_hash TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(user_id)
+        )
+        """
+    )
+
+
+def _migration_users_columns(cur: sqlite3.Cursor):
+    # Колонки, которые раньше добавляли init_db и ensure_columns
+    _add_column_if_missing(cur, "users", "last_reminder_sent", "TEXT")
+    _add_column_if_missing(cur, "users", "level", "TEXT")
+    _add_column_if_missing(cur, "users", "messages_count", "INTEGER DEFAULT 0")
+    _add_column_if_missing(cur, "users", "onboarding_completed", "INTEGER DEFAULT 0")
+    _add_column_if_missing(cur, "users", "referral_code", "TEXT")
+    _add_column_if_missing(cur, "users", "last_streak_reward", "INTEGER DEFAULT 0")
+
+
+def _migration_history_index(cur: sqlite3.Cursor):
+    # История читается по user_id в порядке id (id монотонный, в отличие от
+    # timestamp с точностью до секунды): индекс (user_id, id) отдаёт последние
+    # N строк пользователя без скана таблицы и без сортировки.
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_conversation_history_user_id
+        ON conversation_history (user_id, id)
+        """
+    )
+
+
+def _migration_conversation_archive(cur: sqlite3.Cursor):
+    # Архив старой истории (content сжат zlib), сюда переносит compaction
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS conversation_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            role TEXT,
+            content BLOB,
+            timestamp TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+def _migration_stats_counters(cur: sqlite3.Cursor):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    _write_stats(cur, _compute_stats(cur))
+    # Активные подписки зависят от текущего времени, поэтому не счётчик,
+    # а диапазонный COUNT по индексу
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_expires_at
+        ON subscriptions (expires_at)
+        """
+    )
+
+
+def _migration_dictionary_cache(cur: sqlite3.Cursor):
+    # Кеш ответов LLM на перевод/объяснение слова.
+    # expires_at NULL — без срока (заполняется prewarm-скриптом)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS dictionary_cache (
+            word TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            level TEXT NOT NULL,
+            prompt_hash TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL,
+            PRIMARY KEY (word, mode, level)
+        )
+        """
+    )
+
+
+def _migration_conversation_summaries(cur: sqlite3.Cursor):
+    # Сжатое содержание диалога; summarized_until — id последнего
+    # сообщения conversation_history, вошедшего в summary
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            user_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            summarized_until INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """
+    )
+
+
+def _migration_subscriptions_iso_expiry(cur: sqlite3.Cursor):
+    # Старый add_premium_days писал 'YYYY-MM-DD HH:MM:SS' двумя путями:
+    # datetime('now', '+N day') — UTC, datetime(expires_at, '+N day') от ISO —
+    # локальное время. По строке их не различить; правило то же, что и в старом
+    # чтении через fromisoformat: это локальное время. Переписываем в ISO.
+    cur.execute(
+        """
+        UPDATE subscriptions
+        SET expires_at = replace(expires_at, ' ', 'T')
+        WHERE expires_at LIKE '____-__-__ __:__:__%'
+        """
+    )
+
+
+# Порядок важен, номера не переиспользуем: новая миграция = новый номер в конце
+_MIGRATIONS = [
+    (1, "base tables", _migration_base_tables),
+    (2, "users columns", _migration_users_columns),
+    (3, "conversation_history (user_id, id) index", _migration_history_index),
+    (4, "conversation_archive table", _migration_conversation_archive),
+    (5, "stats_counters table", _migration_stats_counters),
+    (6, "dictionary_cache table", _migration_dictionary_cache),
+    (7, "conversation_summaries table", _migration_conversation_summaries),
+    (8, "subscriptions expires_at as local ISO", _migration_subscriptions_iso_expiry),
+]
+
+SCHEMA_VERSION = _MIGRATIONS[-1][0]
+
+
+def _current_schema_version(cur: sqlite3.Cursor) -> int:
+    try:
+        cur.execute("SELECT MAX(version) FROM schema_version")
+    except sqlite3.OperationalError:
+        # Таблицы ещё нет — база до системы миграций или новая
+        return 0
+    return cur.fetchone()[0] or 0
+
+
+def get_schema_version() -> int:
+    with _connect_read() as conn:
+        return _current_schema_version(conn.cursor())
+
+
+def init_db() -> int:
+    """
+    Приводит схему к SCHEMA_VERSION. Если база актуальна — это один SELECT.
+    Возвращает число применённых миграций.
+    """
+    applied = 0
+    with _connect_locked() as conn:
+        cur = conn.cursor()
+        version = _current_schema_version(cur)
+        if version >= SCHEMA_VERSION:
+            return 0
+
+        cur.execute(
             """
-            CREATE TABLE IF NOT EXISTS processed_transactions (
-                tx_hash TEXT PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                amount REAL NOT NULL,
-                processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(user_id) REFERENCES users(user_id)
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
             """
         )
+        for number, description, step in _MIGRATIONS:
+            if number <= version:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            # Бот и prewarm_dictionary.py могут стартовать одновременно: пока мы
+            # ждали блокировку, другой процесс мог уже применить этот шаг
+            version = _current_schema_version(cur)
+            if number <= version:
+                conn.commit()
+                continue
+            step(cur)
+            cur.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (number, description),
+            )
+            conn.commit()
+            applied += 1
+            logger.info(f"Миграция схемы {number} применена: {description}")
 
-        # Миграция: добавляем last_reminder_sent если нет
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [row[1] for row in cursor.fetchall()]
-        if "last_reminder_sent" not in columns:
-            cursor.execute("ALTER TABLE users ADD COLUMN last_reminder_sent TEXT")
-
-        # Сбрасываем кеш колонок после возможной миграции
-        global _USERS_COLUMNS_CACHE
-        _USERS_COLUMNS_CACHE = None
+    # Схема users могла измениться — сбрасываем кеш колонок и пользователей
+    _reset_users_columns_cache()
+    return applied
 
 
 def create_user(user_id: int, username: str):
     with _connect_locked() as conn:
-        conn.execute(
+        cur = conn.cursor()
+        cur.execute(
             "INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)",
             (user_id, username),
         )
-
-
-def get_user(user_id: int):
-    # Даже чтение делаем через lock: иначе чтение может столкнуться с DDL/WRITE и получить lock.
-    with _connect_locked() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-        return cur.fetchone()
+        if cur.rowcount == 1:
+            _bump_stat(cur, _STAT_USERS_TOTAL, 1)
+            _bump_stat(cur, _level_stat(None), 1)
+    _user_cache.invalidate(user_id)
+
+
+def get_user(user_id: int) -> UserRecord | None:
+    user = _user_cache.get(user_id)
+    if user is not _MISSING:
+        return user
+    version = _user_cache.version(user_id)
+    with _connect_read() as conn:
+        row = conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    # Собираем запись после возврата читателя: на холодном кеше колонок
+    # _row_to_user берёт ещё одно соединение из пула
+    user = _row_to_user(row)
+    _user_cache.put(user_id, user, version)
+    return user
 
 
 def get_user_id_by_username(username: str):
     """Получить user_id по username"""
-    with _connect_locked() as conn:
+    with _connect_read() as conn:
         cur = conn.cursor()
         cur.execute("SELECT user_id FROM users WHERE username = ?", (username,))
         row = cur.fetchone()
@@ -197,7 +642,15 @@ def get_user_id_by_username(username: str):
 
 def set_user_level(user_id: int, level: str):
     with _connect_locked() as conn:
-        conn.execute("UPDATE users SET level = ? WHERE user_id = ?", (level, user_id))
+        cur = conn.cursor()
+        cur.execute("SELECT level FROM users WHERE user_id = ?", (user_id,))
+        row = cur.fetchone()
+        if row is not None:
+            cur.execute("UPDATE users SET level = ? WHERE user_id = ?", (level, user_id))
+            if _level_stat(row[0]) != _level_stat(level):
+                _bump_stat(cur, _level_stat(row[0]), -1)
+                _bump_stat(cur, _level_stat(level), 1)
+    _user_cache.invalidate(user_id)
 
 
 def mark_onboarding_completed(user_id: int):
@@ -205,19 +658,24 @@ def mark_onboarding_completed(user_id: int):
         conn.execute(
             "UPDATE users SET onboarding_completed = 1 WHERE user_id = ?", (user_id,)
         )
+    _user_cache.invalidate(user_id)
 
 
 def is_onboarding_completed(user_id: int) -> bool:
     user = get_user(user_id)
-    return bool(user and user[5])
+    return bool(user and user.onboarding_completed)
 
 
 def increment_message_count(user_id: int, username: str = None):
     with _connect_locked() as conn:
-        conn.execute(
+        cur = conn.cursor()
+        cur.execute(
             "UPDATE users SET message_count = message_count + 1 WHERE user_id = ?",
             (user_id,),
         )
+        if cur.rowcount == 1:
+            _bump_stat(cur, _STAT_MESSAGES_TOTAL, 1)
+    _user_cache.invalidate(user_id)
 
 
 def update_user_streak(user_id: int, streak: int, last_active_date: str):
@@ -226,6 +684,7 @@ def update_user_streak(user_id: int, streak: int, last_active_date: str):
             "UPDATE users SET streak_days = ?, last_active_date = ? WHERE user_id = ?",
             (streak, last_active_date, user_id),
         )
+    _user_cache.invalidate(user_id)
 
 
 def set_referral_code(user_id: int, referral_code: str):
@@ -234,13 +693,74 @@ def set_referral_code(user_id: int, referral_code: str):
             "UPDATE users SET referral_code = ? WHERE user_id = ?",
             (referral_code, user_id),
         )
+    _user_cache.invalidate(user_id)
 
 
 def get_user_by_referral_code(code: str):
-    with _connect_locked() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE referral_code = ?", (code,))
-        return cur.fetchone()
+    with _connect_read() as conn:
+        row = conn.execute("SELECT * FROM users WHERE referral_code = ?", (code,)).fetchone()
+    return _row_to_user(row)
+
+
+# ================== КЕШ ПОДПИСОК ==================
+
+# user_id -> expires_at (epoch). Таблица подписок маленькая, поэтому держим её
+# в памяти целиком: проверка Premium — поиск в словаре без обращения к БД.
+_subscription_expiry: dict[int, float] = {}
+_subscription_expiry_loaded = False
+_subscription_lock = threading.Lock()
+
+
+def _parse_expires_at(value: str | None) -> float | None:
+    """
+    expires_at хранится как локальное время в ISO ('2025-01-01T12:00:00.123456').
+    Старый формат '2025-01-01 12:00:00' (до миграции 8 или переданный в
+    add_subscription) читается так же — как локальное время.
+    """
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        logger.warning(f"Не удалось разобрать expires_at={value!r}")
+        return None
+
+
+def _format_expires_at(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch).isoformat()
+
+
+def _read_expires_at(cur: sqlite3.Cursor, user_id: int) -> float | None:
+    cur.execute("SELECT expires_at FROM subscriptions WHERE user_id = ?", (user_id,))
+    row = cur.fetchone()
+    return _parse_expires_at(row[0]) if row else None
+
+
+def _ensure_subscriptions_loaded():
+    global _subscription_expiry_loaded
+    if _subscription_expiry_loaded:
+        return
+    with _subscription_lock:
+        if _subscription_expiry_loaded:
+            return
+        with _connect_read() as conn:
+            rows = conn.execute("SELECT user_id, expires_at FROM subscriptions").fetchall()
+        for user_id, expires_at in rows:
+            epoch = _parse_expires_at(expires_at)
+            if epoch is not None:
+                _subscription_expiry[user_id] = epoch
+        _subscription_expiry_loaded = True
+
+
+def _set_subscription_expiry(user_id: int, epoch: float | None):
+    """Обновить кеш после commit. До первой загрузки кеш не трогаем."""
+    with _subscription_lock:
+        if not _subscription_expiry_loaded:
+            return
+        if epoch is None:
+            _subscription_expiry.pop(user_id, None)
+        else:
+            _subscription_expiry[user_id] = epoch
 
 
 def activate_subscription(user_id: int, duration_days: int = 7):
@@ -254,36 +774,52 @@ def activate_subscription(user_id: int, duration_days: int = 7):
             """,
             (user_id, expires_at, expires_at),
         )
-    return datetime.fromisoformat(expires_at)
+    expires = datetime.fromisoformat(expires_at)
+    _set_subscription_expiry(user_id, expires.timestamp())
+    return expires
 
 
 def get_subscription(user_id: int):
-    with _connect_locked() as conn:
+    with _connect_read() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM subscriptions WHERE user_id = ?", (user_id,))
         return cur.fetchone()
 
 
+def get_subscription_expiry(user_id: int) -> datetime | None:
+    """Дата окончания подписки (локальное время) или None."""
+    _ensure_subscriptions_loaded()
+    epoch = _subscription_expiry.get(user_id)
+    return datetime.fromtimestamp(epoch) if epoch is not None else None
+
+
 def has_active_subscription(user_id: int) -> bool:
-    sub = get_subscription(user_id)
-    if not sub:
-        return False
-    expires_at = datetime.fromisoformat(sub[1])
-    return datetime.now() < expires_at
+    _ensure_subscriptions_loaded()
+    expires_at = _subscription_expiry.get(user_id)
+    return expires_at is not None and time.time() < expires_at
 
 
 def add_subscription(user_id: int, expires_at: str):
     """Добавляет или обновляет подписку, продлевая её если новая дата позже текущей."""
+    new_epoch = _parse_expires_at(expires_at)
+    if new_epoch is None:
+        raise ValueError(f"Некорректная дата окончания подписки: {expires_at!r}")
     with _connect_locked() as conn:
-        conn.execute(
-            """
-            INSERT INTO subscriptions (user_id, expires_at)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET expires_at =
-                CASE WHEN expires_at > ? THEN expires_at ELSE ? END
-            """,
-            (user_id, expires_at, expires_at, expires_at),
-        )
+        cur = conn.cursor()
+        # Сравниваем моменты времени, а не строки: форматы в таблице разные
+        current = _read_expires_at(cur, user_id)
+        if current is not None and current >= new_epoch:
+            new_epoch = current
+        else:
+            cur.execute(
+                """
+                INSERT INTO subscriptions (user_id, expires_at)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET expires_at = excluded.expires_at
+                """,
+                (user_id, expires_at),
+            )
+    _set_subscription_expiry(user_id, new_epoch)
 
 
 def save_payment(
@@ -304,25 +840,133 @@ def save_payment(
         )
 
 
+_INSERT_MESSAGE_SQL = """
+    INSERT INTO conversation_history (user_id, role, content)
+    VALUES (?, ?, ?)
+"""
+
+# Отложенная запись истории: строки копятся в памяти и пишутся пачкой
+# (executemany) по размеру буфера или по таймеру. Выключено по умолчанию.
+_HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "0") == "1"
+_HISTORY_FLUSH_SIZE = int(os.getenv("HISTORY_FLUSH_SIZE", "64"))
+_HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))
+
+_INSERT_MESSAGE_AT_SQL = """
+    INSERT INTO conversation_history (user_id, role, content, timestamp)
+    VALUES (?, ?, ?, ?)
+"""
+
+
+class _HistoryBuffer:
+    """
+    Буфер write-behind для conversation_history.
+    Строка считается "ожидающей", пока её пачка не закоммичена, поэтому
+    get_conversation_history для того же пользователя сначала дописывает
+    буфер (read-your-writes), а остальные пользователи его не ждут.
+    """
+
+    def __init__(self, max_rows: int, interval: float):
+        self._max_rows = max_rows
+        self._interval = interval
+        self._rows = []
+        self._pending_users = {}  # user_id -> сколько строк ещё не закоммичено
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, rows: list[tuple]):
+        # timestamp ставим сразу, как сделал бы DEFAULT CURRENT_TIMESTAMP (UTC)
+        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            for user_id, role, content in rows:
+                self._rows.append((user_id, role, content, now))
+                self._pending_users[user_id] = self._pending_users.get(user_id, 0) + 1
+            full = len(self._rows) >= self._max_rows
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="history-writer", daemon=True
+                )
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def has_pending(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._pending_users
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                batch, self._rows = self._rows, []
+            if not batch:
+                return 0
+            try:
+                with _connect_locked() as conn:
+                    conn.executemany(_INSERT_MESSAGE_AT_SQL, batch)
+            except Exception:
+                # Возвращаем пачку в начало буфера, чтобы не потерять порядок
+                with self._lock:
+                    self._rows[:0] = batch
+                raise
+            with self._lock:
+                for row in batch:
+                    left = self._pending_users[row[0]] - 1
+                    if left:
+                        self._pending_users[row[0]] = left
+                    else:
+                        del self._pending_users[row[0]]
+            return len(batch)
+
+    def discard_user(self, user_id: int):
+        """Выкинуть ещё не записанные строки пользователя (при сбросе истории)."""
+        with self._flush_lock:
+            with self._lock:
+                self._rows = [row for row in self._rows if row[0] != user_id]
+                self._pending_users.pop(user_id, None)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи буфера истории: {e}", exc_info=True)
+
+
+_history_buffer = (
+    _HistoryBuffer(_HISTORY_FLUSH_SIZE, _HISTORY_FLUSH_INTERVAL)
+    if _HISTORY_WRITE_BEHIND
+    else None
+)
+
+
+def flush_history() -> int:
+    """Записать буфер истории в БД (вызывается при остановке бота)."""
+    if _history_buffer is None:
+        return 0
+    return _history_buffer.flush()
+
+
 def save_message(user_id: int, role: str, content: str):
+    if _history_buffer is not None:
+        _history_buffer.add([(user_id, role, content)])
+        return
     with _connect_locked() as conn:
-        conn.execute(
-            """
-            INSERT INTO conversation_history (user_id, role, content)
-            VALUES (?, ?, ?)
-            """,
-            (user_id, role, content),
-        )
+        conn.execute(_INSERT_MESSAGE_SQL, (user_id, role, content))
 
 
 def get_conversation_history(user_id: int, limit: int = 10):
-    with _connect_locked() as conn:
+    if _history_buffer is not None and _history_buffer.has_pending(user_id):
+        _history_buffer.flush()
+    with _connect_read() as conn:
         cur = conn.cursor()
         cur.execute(
             """
             SELECT role, content FROM conversation_history
             WHERE user_id = ?
-            ORDER BY timestamp DESC
+            ORDER BY id DESC
             LIMIT ?
             """,
             (user_id, limit),
@@ -332,20 +976,236 @@ def get_conversation_history(user_id: int, limit: int = 10):
 
 
 def reset_conversation(user_id: int):
+    if _history_buffer is not None:
+        _history_buffer.discard_user(user_id)
     with _connect_locked() as conn:
         conn.execute("DELETE FROM conversation_history WHERE user_id = ?", (user_id,))
+        conn.execute("DELETE FROM conversation_summaries WHERE user_id = ?", (user_id,))
 
 
-def get_total_users():
+def get_conversation_summary(user_id: int) -> tuple | None:
+    """(summary, summarized_until) или None."""
+    with _connect_read() as conn:
+        return conn.execute(
+            "SELECT summary, summarized_until FROM conversation_summaries WHERE user_id = ?",
+            (user_id,),
+        ).fetchone()
+
+
+def get_messages_after(user_id: int, after_id: int, limit: int) -> list[tuple]:
+    """Сообщения пользователя с id > after_id, от старых к новым: (id, role, content)."""
+    if _history_buffer is not None and _history_buffer.has_pending(user_id):
+        _history_buffer.flush()
+    with _connect_read() as conn:
+        return conn.execute(
+            """
+            SELECT id, role, content FROM conversation_history
+            WHERE user_id = ? AND id > ?
+            ORDER BY id
+            LIMIT ?
+            """,
+            (user_id, after_id, limit),
+        ).fetchall()
+
+
+def save_conversation_summary(user_id: int, summary: str, summarized_until: int) -> bool:
+    """
+    Сохранить summary, если сообщение summarized_until ещё в истории: если
+    пока генерировался summary историю сбросили, старое содержание не вернётся.
+    """
     with _connect_locked() as conn:
+        cur = conn.execute(
+            """
+            INSERT OR REPLACE INTO conversation_summaries
+                (user_id, summary, summarized_until, updated_at)
+            SELECT ?, ?, ?, ?
+            WHERE EXISTS (
+                SELECT 1 FROM conversation_history WHERE user_id = ? AND id = ?
+            )
+            """,
+            (user_id, summary, summarized_until, time.time(), user_id, summarized_until),
+        )
+        return cur.rowcount > 0
+
+
+def get_users_with_history_over(keep_last: int) -> list[int]:
+    """user_id, у которых в conversation_history больше keep_last сообщений."""
+    with _connect_read() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM users")
-        return cur.fetchone()[0]
+        cur.execute(
+            """
+            SELECT user_id FROM conversation_history
+            GROUP BY user_id
+            HAVING COUNT(*) > ?
+            """,
+            (keep_last,),
+        )
+        return [row[0] for row in cur.fetchall()]
+
+
+def archive_conversation_batch(user_id: int, keep_last: int, batch_size: int) -> int:
+    """
+    Переносит до batch_size самых старых сообщений пользователя (кроме последних
+    keep_last) в conversation_archive со сжатием. Одна короткая транзакция на пачку,
+    чтобы не держать пишущее соединение долго. Возвращает число перенесённых строк.
+    """
+    with _connect_locked() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id FROM conversation_history
+            WHERE user_id = ?
+            ORDER BY id DESC
+            LIMIT 1 OFFSET ?
+            """,
+            (user_id, keep_last - 1),
+        )
+        row = cur.fetchone()
+        if row is None:
+            return 0
+        oldest_hot_id = row[0]
+
+        cur.execute(
+            """
+            SELECT id, user_id, role, content, timestamp FROM conversation_history
+            WHERE user_id = ? AND id < ?
+            ORDER BY id
+            LIMIT ?
+            """,
+            (user_id, oldest_hot_id, batch_size),
+        )
+        rows = cur.fetchall()
+        if not rows:
+            return 0
+
+        cur.executemany(
+            """
+            INSERT OR REPLACE INTO conversation_archive (id, user_id, role, content, timestamp)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [
+                (id_, uid, role, zlib.compress((content or "").encode("utf-8")), ts)
+                for id_, uid, role, content, ts in rows
+            ],
+        )
+        cur.execute(
+            "DELETE FROM conversation_history WHERE user_id = ? AND id <= ?",
+            (user_id, rows[-1][0]),
+        )
+        return len(rows)
+
+
+def checkpoint_wal() -> tuple:
+    """Переносит WAL в основной файл и обрезает его. Возвращает (busy, log, checkpointed)."""
+    with _connect_locked() as conn:
+        return conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+
+
+def vacuum_db():
+    """Пересобирает файл БД, возвращая место после удаления строк."""
+    with _connect_locked() as conn:
+        conn.execute("VACUUM")
+
+
+def get_dictionary_entry(word: str, mode: str, level: str) -> tuple | None:
+    """(response, prompt_hash, expires_at) или None."""
+    with _connect_read() as conn:
+        return conn.execute(
+            """
+            SELECT response, prompt_hash, expires_at FROM dictionary_cache
+            WHERE word = ? AND mode = ? AND level = ?
+            """,
+            (word, mode, level),
+        ).fetchone()
+
+
+def save_dictionary_entry(
+    word: str, mode: str, level: str, prompt_hash: str, response: str, expires_at: float | None
+):
+    with _connect_locked() as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO dictionary_cache
+                (word, mode, level, prompt_hash, response, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (word, mode, level, prompt_hash, response, time.time(), expires_at),
+        )
+
+
+def purge_dictionary_cache(current_hashes: dict[str, str]) -> int:
+    """Удалить просроченные записи и записи со старым prompt_hash. Вернёт число удалённых."""
+    with _connect_locked() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "DELETE FROM dictionary_cache WHERE expires_at IS NOT NULL AND expires_at <= ?",
+            (time.time(),),
+        )
+        removed = cur.rowcount
+        for mode, prompt_hash in current_hashes.items():
+            cur.execute(
+                "DELETE FROM dictionary_cache WHERE mode = ? AND prompt_hash != ?",
+                (mode, prompt_hash),
+            )
+            removed += cur.rowcount
+        return removed
+
+
+def get_stats() -> dict:
+    """
+    Сводка для /stats одним запросом к stats_counters:
+    users_total, messages_total, levels ({уровень: число}) и average_messages.
+    """
+    with _connect_read() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT name, value FROM stats_counters")
+        counters = dict(cur.fetchall())
+
+    users_total = counters.get(_STAT_USERS_TOTAL, 0)
+    messages_total = counters.get(_STAT_MESSAGES_TOTAL, 0)
+    prefix_len = len(_STAT_LEVEL_PREFIX)
+    return {
+        "users_total": users_total,
+        "messages_total": messages_total,
+        "levels": {
+            name[prefix_len:]: value
+            for name, value in counters.items()
+            if name.startswith(_STAT_LEVEL_PREFIX) and value > 0
+        },
+        "average_messages": (
+            round(messages_total / users_total, 1) if users_total else 0.0
+        ),
+    }
+
+
+def reconcile_stats() -> dict[str, tuple[int, int]]:
+    """
+    Сверяет счётчики с таблицами и перезаписывает их.
+    Возвращает расхождения: name -> (было в счётчике, на самом деле).
+    """
+    with _connect_locked() as conn:
+        cur = conn.cursor()
+        conn.execute("BEGIN IMMEDIATE")
+        cur.execute("SELECT name, value FROM stats_counters")
+        stored = dict(cur.fetchall())
+        actual = _compute_stats(cur)
+        drift = {
+            name: (stored.get(name, 0), actual.get(name, 0))
+            for name in stored.keys() | actual.keys()
+            if stored.get(name, 0) != actual.get(name, 0)
+        }
+        if drift:
+            _write_stats(cur, actual)
+        return drift
+
+
+def get_total_users():
+    return get_stats()["users_total"]
 
 
 def get_all_user_ids():
     """Получить список всех user_id"""
-    with _connect_locked() as conn:
+    with _connect_read() as conn:
         cur = conn.cursor()
         cur.execute("SELECT user_id FROM users")
         return [row[0] for row in cur.fetchall()]
@@ -355,7 +1215,7 @@ def get_inactive_users(inactive_hours: int = 24):
     """Получить пользователей, неактивных больше N часов и не получавших напоминание сегодня."""
     cutoff = (datetime.now() - timedelta(hours=inactive_hours)).strftime("%Y-%m-%d")
     today = datetime.now().strftime("%Y-%m-%d")
-    with _connect_locked() as conn:
+    with _connect_read() as conn:
         cur = conn.cursor()
         cur.execute(
             """SELECT user_id, username, streak_days, last_active_date
@@ -376,95 +1236,35 @@ def set_reminder_sent(user_id: int):
             "UPDATE users SET last_reminder_sent = ? WHERE user_id = ?",
             (today, user_id),
         )
+    _user_cache.invalidate(user_id)
 
 
 def get_active_subscriptions():
-    now = datetime.now().isoformat()
-    with _connect_locked() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM subscriptions WHERE expires_at > ?", (now,))
-        return cur.fetchone()[0]
+    _ensure_subscriptions_loaded()
+    now = time.time()
+    return sum(1 for expires_at in list(_subscription_expiry.values()) if expires_at > now)
 
 
 def can_send_message(user_id: int, username: str = None) -> bool:
-    WHITELIST = os.getenv("WHITELIST_USERNAMES", "").split(",")
-    FREE_LIMIT = int(os.getenv("FREE_MESSAGE_LIMIT", "25"))
-
-    # VIP
-    if username and username in WHITELIST:
-        return True
-
-    # Premium
-    if has_active_subscription(user_id):
-        return True
-
-    user = get_user(user_id)
-    if not user:
-        return True
-
-    # user[2] = message_count
-    messages_used = int(user_get(user, "message_count", 0))
-
-    # messages_count у тебя добавляется через ensure_columns(), поэтому обычно это последний столбец
-    # (в /status ты используешь user[10]) :contentReference[oaicite:3]{index=3}
-    bonus_messages = int(user_get(user, "messages_count", 0))
+    # Импорт здесь: entitlement_service сам импортирует database
+    from services.entitlement_service import check_entitlement
 
-    total_limit = FREE_LIMIT + max(bonus_messages, 0)
-    print(
-        f"[LIMIT] user={user_id} used={messages_used} bonus={bonus_messages} total={total_limit}"
-    )
-    return messages_used < total_limit
+    return check_entitlement(user_id, username)["allowed"]
 
 
 def get_users_by_level() -> dict:
-    """Вернёт распределение пользователей по уровням (A1/A2/B1/B2/None)."""
-    with _connect_locked() as conn:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT COALESCE(level, 'Unknown') AS lvl, COUNT(*) FROM users GROUP BY lvl"
-        )
-        rows = cur.fetchall()
-        return {lvl: cnt for (lvl, cnt) in rows}
+    """Вернёт распределение пользователей по уровням (A1/A2/B1/B2/Unknown)."""
+    return get_stats()["levels"]
 
 
 def get_average_messages() -> float:
     """Среднее количество использованных сообщений на пользователя."""
-    with _connect_locked() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT AVG(message_count) FROM users")
-        val = cur.fetchone()[0]
-        return round(float(val), 1) if val is not None else 0.0
-
-
-def ensure_columns():
-    """
-    Проверяет и добавляет недостающие колонки в таблицу users
-    Безопасно вызывать при каждом запуске
-    """
-    with _connect_locked() as conn:
-        cur = conn.cursor()
-
-        cur.execute("PRAGMA table_info(users)")
-        existing_columns = {row[1] for row in cur.fetchall()}
-
-        required_columns = {
-            "level": "TEXT",
-            "messages_count": "INTEGER DEFAULT 0",
-            "onboarding_completed": "INTEGER DEFAULT 0",
-            "referral_code": "TEXT",
-            "last_streak_reward": "INTEGER DEFAULT 0",
-        }
-
-        for column, ddl in required_columns.items():
-            if column not in existing_columns:
-                cur.execute(f"ALTER TABLE users ADD COLUMN {column} {ddl}")
-
-        conn.commit()
+    return get_stats()["average_messages"]
 
 
 def get_user_id_by_referral_code(referral_code: str):
     """Вернёт user_id владельца referral_code или None."""
-    with _connect_locked() as conn:
+    with _connect_read() as conn:
         cur = conn.cursor()
         cur.execute(
             "SELECT user_id FROM users WHERE referral_code = ?", (referral_code,)
@@ -494,15 +1294,18 @@ def add_referral(inviter_id: int, invitee_id: int, referral_code: str) -> bool:
             raise
 
 
+def _add_messages(cur: sqlite3.Cursor, user_id: int, amount: int):
+    cur.execute(
+        "UPDATE users SET messages_count = messages_count + ? WHERE user_id = ?",
+        (amount, user_id),
+    )
+
+
 def add_messages(user_id: int, amount: int):
     """Добавляет пользователю сообщения (бонус, рефералка и т.д.)"""
     with _connect_locked() as conn:
-        cur = conn.cursor()
-        cur.execute(
-            "UPDATE users SET messages_count = messages_count + ? WHERE user_id = ?",
-            (amount, user_id),
-        )
-        conn.commit()
+        _add_messages(conn.cursor(), user_id, amount)
+    _user_cache.invalidate(user_id)
 
 
 def is_vip_username(username: str) -> bool:
@@ -516,39 +1319,27 @@ def is_vip_username(username: str) -> bool:
     return username in WHITELIST_USERNAMES
 
 
+def _add_premium_days(cur: sqlite3.Cursor, user_id: int, days: int) -> float:
+    """Продлить подписку на N дней от max(expires_at, now). Вернёт новый expires_at (epoch)."""
+    current = _read_expires_at(cur, user_id)
+    expires = max(current or 0.0, time.time()) + days * 86400
+    # Пишем в том же ISO-формате, что и activate_subscription
+    cur.execute(
+        """
+        INSERT INTO subscriptions (user_id, expires_at)
+        VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET expires_at = excluded.expires_at
+        """,
+        (user_id, _format_expires_at(expires)),
+    )
+    return expires
+
+
 def add_premium_days(user_id: int, days: int = 1):
     """Добавляет дни подписки Premium (увеличивает expires_at)."""
     with _connect_locked() as conn:
-        cur = conn.cursor()
-
-        cur.execute(
-            "SELECT expires_at FROM subscriptions WHERE user_id = ?", (user_id,)
-        )
-        row = cur.fetchone()
-
-        # В SQLite используем datetime('now', '+N day') напрямую в строке
-        if row is None:
-            # Создаём новую подписку на N дней с текущего момента
-            cur.execute(
-                f"INSERT INTO subscriptions (user_id, expires_at) VALUES (?, datetime('now', '+{days} day'))",
-                (user_id,),
-            )
-        else:
-            # Если подписка уже есть: продлеваем от max(expires_at, now)
-            cur.execute(
-                f"""
-                UPDATE subscriptions
-                SET expires_at =
-                    CASE
-                        WHEN expires_at > datetime('now') THEN datetime(expires_at, '+{days} day')
-                        ELSE datetime('now', '+{days} day')
-                    END
-                WHERE user_id = ?
-                """,
-                (user_id,),
-            )
-
-        conn.commit()
+        expires = _add_premium_days(conn.cursor(), user_id, days)
+    _set_subscription_expiry(user_id, expires)
 
 
 def get_streak_reward_level(user_id: int) -> int:
@@ -556,7 +1347,7 @@ def get_streak_reward_level(user_id: int) -> int:
     user = get_user(user_id)
     if not user:
         return 0
-    return int(user_get(user, "last_streak_reward", 0))
+    return int(user.get("last_streak_reward", 0))
 
 
 def set_streak_reward_level(user_id: int, level: int):
@@ -566,11 +1357,103 @@ def set_streak_reward_level(user_id: int, level: int):
             "UPDATE users SET last_streak_reward = ? WHERE user_id = ?",
             (level, user_id),
         )
+    _user_cache.invalidate(user_id)
+
+
+def record_turn(
+    user_id: int,
+    user_text: str,
+    assistant_text: str,
+    streak_rewards: dict[int, tuple[int, int]] | None = None,
+    today: date | None = None,
+) -> dict | None:
+    """
+    Вся запись после ответа LLM одной транзакцией (один commit/fsync вместо ~7):
+    обе реплики в историю, +1 к message_count, streak и streak-награда.
+
+    streak_rewards: {дней: (бонус сообщений, бонус дней премиум)}.
+    Возвращает обновлённые счётчики, чтобы не перечитывать строку users:
+    message_count, messages_count, streak_days, streak_updated (streak
+    пересчитан впервые за день) и reward_milestone (выданная награда или None).
+    None — если пользователя нет (реплики всё равно сохраняются).
+    """
+    today = today or date.today()
+    today_str = today.isoformat()
+    messages = [(user_id, "user", user_text), (user_id, "assistant", assistant_text)]
+    if _history_buffer is not None:
+        _history_buffer.add(messages)
+    with _connect_locked() as conn:
+        cur = conn.cursor()
+        if _history_buffer is None:
+            cur.executemany(_INSERT_MESSAGE_SQL, messages)
+        cur.execute(
+            """
+            SELECT message_count, messages_count, last_active_date, streak_days,
+                   last_streak_reward
+            FROM users WHERE user_id = ?
+            """,
+            (user_id,),
+        )
+        row = cur.fetchone()
+        if row is None:
+            return None
+        message_count, bonus_messages, last_active, streak, last_reward = row
+        message_count = (message_count or 0) + 1
+        bonus_messages = bonus_messages or 0
+        streak = streak or 0
+        last_reward = last_reward or 0
+
+        if last_active == today_str:
+            new_streak = streak
+        elif last_active == (today - timedelta(days=1)).isoformat():
+            new_streak = streak + 1
+        else:
+            new_streak = 1
+
+        cur.execute(
+            """
+            UPDATE users
+            SET message_count = ?, streak_days = ?, last_active_date = ?
+            WHERE user_id = ?
+            """,
+            (message_count, new_streak, today_str, user_id),
+        )
+        _bump_stat(cur, _STAT_MESSAGES_TOTAL, 1)
+
+        # Награда выдаётся только при первом сообщении за день — одна за раз
+        reward_milestone = None
+        premium_expires = None
+        streak_updated = last_active != today_str
+        if streak_updated and streak_rewards:
+            for milestone, (bonus_msgs, bonus_days) in sorted(streak_rewards.items()):
+                if new_streak >= milestone and last_reward < milestone:
+                    if bonus_msgs > 0:
+                        _add_messages(cur, user_id, bonus_msgs)
+                        bonus_messages += bonus_msgs
+                    if bonus_days > 0:
+                        premium_expires = _add_premium_days(cur, user_id, bonus_days)
+                    cur.execute(
+                        "UPDATE users SET last_streak_reward = ? WHERE user_id = ?",
+                        (milestone, user_id),
+                    )
+                    reward_milestone = milestone
+                    break
+    _user_cache.invalidate(user_id)
+    if premium_expires is not None:
+        _set_subscription_expiry(user_id, premium_expires)
+
+    return {
+        "message_count": message_count,
+        "messages_count": bonus_messages,
+        "streak_days": new_streak,
+        "streak_updated": streak_updated,
+        "reward_milestone": reward_milestone,
+    }
 
 
 def is_transaction_processed(tx_hash: str) -> bool:
     """Проверяет, была ли транзакция уже обработана."""
-    with _connect_locked() as conn:
+    with _connect_read() as conn:
         cur = conn.cursor()
         cur.execute(
             "SELECT COUNT(*) FROM processed_transactions WHERE tx_hash = ?",
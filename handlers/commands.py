@@ -5,7 +5,7 @@ import sys
 import os
 from datetime import datetime
 from dotenv import load_dotenv
-from database import user_get
+from async_db import user_get
 
 
 # Загружаем .env
@@ -13,17 +13,15 @@ load_dotenv()
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import (
+from async_db import (
     get_user,
     create_user,
     reset_conversation,
-    get_subscription,
+    get_subscription_expiry,
     has_active_subscription,
-    get_total_users,
+    get_stats,
     get_active_subscriptions,
     is_onboarding_completed,
-    get_users_by_level,
-    get_average_messages,
     get_user_id_by_referral_code,
     add_referral,
     add_messages,
@@ -70,7 +68,7 @@ async def cmd_start(message: Message):
     username = message.from_user.username or message.from_user.first_name
 
     # Создаём пользователя если не существует
-    user = get_user(user_id)
+    user = await get_user(user_id)
     args = message.text.split(maxsplit=1)
     payload = args[1] if len(args) > 1 else None
 
@@ -87,7 +85,7 @@ async def cmd_start(message: Message):
     if payload and payload.startswith("REF_"):
         referral_code = payload[4:].strip()
 
-        inviter_id = get_user_id_by_referral_code(referral_code)
+        inviter_id = await get_user_id_by_referral_code(referral_code)
         if not inviter_id:
             await message.answer("❌ Реферальный код не найден.")
             return
@@ -99,8 +97,8 @@ async def cmd_start(message: Message):
             return
 
         # inviter status
-        inviter_is_vip = is_vip(get_user(inviter_id)[1])
-        inviter_is_premium = has_active_subscription(inviter_id)
+        inviter_is_vip = is_vip((await get_user(inviter_id)).username)
+        inviter_is_premium = await has_active_subscription(inviter_id)
 
         if not inviter_is_vip and not inviter_is_premium:
             await message.answer(
@@ -108,7 +106,7 @@ async def cmd_start(message: Message):
             )
             return
 
-        ok = add_referral(
+        ok = await add_referral(
             inviter_id=inviter_id, invitee_id=user_id, referral_code=referral_code
         )
         if not ok:
@@ -117,7 +115,7 @@ async def cmd_start(message: Message):
 
         # invitee status
         invitee_is_vip = is_vip(username)
-        invitee_is_premium = has_active_subscription(user_id)
+        invitee_is_premium = await has_active_subscription(user_id)
 
         # Бонус приглашаемому
         if invitee_is_vip:
@@ -125,25 +123,25 @@ async def cmd_start(message: Message):
                 "✅ Реферальный код принят! Ты уже VIP — бонус не требуется."
             )
         elif invitee_is_premium:
-            add_premium_days(user_id, 1)
+            await add_premium_days(user_id, 1)
             await message.answer(
                 "🎁 Бонус активирован! Твоя Premium-подписка продлена на 1 день."
             )
         else:
-            add_messages(user_id, 50)
+            await add_messages(user_id, 50)
             await message.answer("🎁 Бонус активирован! Тебе начислено +50 сообщений.")
 
         # Бонус пригласившему
         if inviter_is_premium and not inviter_is_vip:
-            add_premium_days(inviter_id, 1)
+            await add_premium_days(inviter_id, 1)
 
     # --- /Referral activation ---
 
     if not user:
-        create_user(user_id, username)
+        await create_user(user_id, username)
 
     # Проверяем онбординг
-    if not is_onboarding_completed(user_id):
+    if not await is_onboarding_completed(user_id):
         # Запускаем онбординг для новых пользователей
         keyboard = InlineKeyboardMarkup(
             inline_keyboard=[
@@ -181,7 +179,7 @@ async def cmd_start(message: Message):
         "<b>Бесплатно:</b> 25 сообщений\n"
         "<b>Premium:</b> Безлимитный доступ всего за <b>100 Stars</b>/неделю\n\n"
         "Используй кнопки ниже для быстрого доступа! ⬇️",
-        reply_markup=get_main_menu(user_id, username),
+        reply_markup=await get_main_menu(user_id, username),
         parse_mode="HTML",
     )
 
@@ -192,7 +190,7 @@ async def cmd_status(message: Message):
     """Команда /status или кнопка"""
     user_id = message.from_user.id
     username = message.from_user.username
-    user = get_user(user_id)
+    user = await get_user(user_id)
 
     if not user:
         start_kb = InlineKeyboardMarkup(
@@ -205,7 +203,7 @@ async def cmd_status(message: Message):
         return
 
     # Получаем streak и уровень
-    streak = user[7] if len(user) > 7 else 0
+    streak = user.streak_days or 0
     level = user_get(user, "level", "A1") or "A1"
     badge = LEVEL_BADGES.get(level, LEVEL_BADGES["A1"])
     badge_line = f"{badge['emoji']} <b>{level} — {badge['name']}</b> ({badge['title']})"
@@ -220,7 +218,7 @@ async def cmd_status(message: Message):
 
     # Белый список по username
     if username and username in WHITELIST_USERNAMES:
-        referral_code = user[8] if len(user) > 8 else None
+        referral_code = user.referral_code
         bot_info = await message.bot.get_me()
         ref_line = f"🔗 Реферальная ссылка:\n<code>https://t.me/{bot_info.username}?start=REF_{referral_code}</code>" if referral_code else "Реферальный код: не сгенерирован"
         await message.answer(
@@ -230,16 +228,15 @@ async def cmd_status(message: Message):
             f"У вас неограниченный доступ!\n"
             f"Подписка: Пожизненный Premium 💎\n\n"
             f"{ref_line}",
-            reply_markup=get_main_menu(user_id, username),
+            reply_markup=await get_main_menu(user_id, username),
             parse_mode="HTML",
         )
         return
 
     # Проверяем подписку
-    subscription = get_subscription(user_id)
+    expires = await get_subscription_expiry(user_id)
 
-    if has_active_subscription(user_id) and subscription:
-        expires = datetime.fromisoformat(subscription[1])
+    if expires and await has_active_subscription(user_id):
         time_left = expires - datetime.now()
         if time_left.days > 0:
             time_info = f"Дней осталось: {time_left.days}"
@@ -247,7 +244,7 @@ async def cmd_status(message: Message):
             hours_left = time_left.seconds // 3600
             time_info = f"Часов осталось: {hours_left}"
 
-        referral_code = user[8] if len(user) > 8 else None
+        referral_code = user.referral_code
         bot_info = await message.bot.get_me()
         ref_line = f"🔗 Реферальная ссылка:\n<code>https://t.me/{bot_info.username}?start=REF_{referral_code}</code>" if referral_code else "Реферальный код: не сгенерирован"
         await message.answer(
@@ -259,7 +256,7 @@ async def cmd_status(message: Message):
             f"{time_info}\n\n"
             f"{ref_line}\n\n"
             f"Продолжайте в том же духе!",
-            reply_markup=get_main_menu(user_id, username),
+            reply_markup=await get_main_menu(user_id, username),
             parse_mode="HTML",
         )
     else:
@@ -286,7 +283,7 @@ async def cmd_status(message: Message):
                 f"Хотите неограниченный доступ?\n"
                 f"Получите Premium всего за <b>100 Stars</b>/неделя!\n\n"
                 f"Нажмите кнопку ниже, чтобы обновить! ⬇️",
-                reply_markup=get_main_menu(user_id, username),
+                reply_markup=await get_main_menu(user_id, username),
                 parse_mode="HTML",
             )
         else:
@@ -300,7 +297,7 @@ async def cmd_status(message: Message):
                 f"💵 <b>1.5 USDT (BEP-20)</b> — 1 неделя\n"
                 f"📱 <b>Пополнение телефона</b> — 1 неделя (179 ₽)\n\n"
                 f"Нажмите кнопку ниже, чтобы продолжить! ⬇️",
-                reply_markup=get_main_menu(user_id, username),
+                reply_markup=await get_main_menu(user_id, username),
                 parse_mode="HTML",
             )
 
@@ -335,14 +332,14 @@ async def cmd_reset(message: Message):
     username = message.from_user.username
 
     # Сбрасываем историю
-    reset_conversation(user_id)
+    await reset_conversation(user_id)
 
     await message.answer(
         "🧠 <b>Память очищена!</b>\n\n"
         "Я забыл нашу переписку и не помню что мы обсуждали.\n"
         "Давай начнём разговор заново! 🎤\n\n"
         "💡 Сообщения в чате остаются видимыми, но я их больше не помню.",
-        reply_markup=get_main_menu(user_id, username),
+        reply_markup=await get_main_menu(user_id, username),
         parse_mode="HTML",
     )
 
@@ -375,7 +372,7 @@ async def cmd_help(message: Message):
     )
 
     await message.answer(
-        text, parse_mode="HTML", reply_markup=get_main_menu(user_id, username)
+        text, parse_mode="HTML", reply_markup=await get_main_menu(user_id, username)
     )
 
 
@@ -387,7 +384,7 @@ async def cmd_menu(message: Message):
     await message.answer(
         "🏠 <b>Главное меню</b>\n\n"
         "Используй кнопки ниже для навигации ⬇️",
-        reply_markup=get_main_menu(user_id, username),
+        reply_markup=await get_main_menu(user_id, username),
         parse_mode="HTML",
     )
 
@@ -404,10 +401,12 @@ async def cmd_stats(message: Message):
     if username not in WHITELIST_USERNAMES:
         return
 
-    total_users = get_total_users()
-    active_subs = get_active_subscriptions()
-    levels = get_users_by_level()
-    avg_messages = get_average_messages()
+    # Готовые счётчики одним запросом вместо полных сканов users
+    stats = await get_stats()
+    total_users = stats["users_total"]
+    active_subs = await get_active_subscriptions()
+    levels = stats["levels"]
+    avg_messages = stats["average_messages"]
     conversion = (active_subs / total_users * 100) if total_users > 0 else 0
 
     text = (
@@ -423,7 +422,7 @@ async def cmd_stats(message: Message):
     text += f"\n💬 <b>Среднее сообщений на пользователя:</b> {avg_messages}"
 
     await message.answer(
-        text, parse_mode="HTML", reply_markup=get_main_menu(user_id, username)
+        text, parse_mode="HTML", reply_markup=await get_main_menu(user_id, username)
     )
 
 
@@ -478,8 +477,8 @@ async def broadcast_send(message: Message):
     broadcast_state.pop(user_id, None)
     text = message.text
 
-    from database import get_all_user_ids
-    all_users = get_all_user_ids()
+    from async_db import get_all_user_ids
+    all_users = await get_all_user_ids()
 
     sent = 0
     failed = 0
@@ -496,7 +495,7 @@ async def broadcast_send(message: Message):
         f"📣 <b>Рассылка завершена</b>\n\n"
         f"✅ Доставлено: {sent}\n"
         f"❌ Не доставлено: {failed}",
-        reply_markup=get_main_menu(user_id, username),
+        reply_markup=await get_main_menu(user_id, username),
         parse_mode="HTML",
     )
 
@@ -505,7 +504,7 @@ async def broadcast_send(message: Message):
 async def cmd_referral(message: Message):
     """Показать реферальный код"""
     user_id = message.from_user.id
-    user = get_user(user_id)
+    user = await get_user(user_id)
 
     if not user:
         start_kb = InlineKeyboardMarkup(
@@ -517,7 +516,7 @@ async def cmd_referral(message: Message):
         )
         return
 
-    code = user[8] if len(user) > 8 else None
+    code = user.referral_code
     if code:
         bot_info = await message.bot.get_me()
         ref_link = f"https://t.me/{bot_info.username}?start=REF_{code}"
@@ -541,7 +540,7 @@ async def cmd_invite(message: Message):
     """Кнопка 'Пригласить друга' — показывает ссылку на квиз и реферальный код"""
     user_id = message.from_user.id
     username = message.from_user.username
-    user = get_user(user_id)
+    user = await get_user(user_id)
 
     # Получаем username бота
     bot_info = await message.bot.get_me()
@@ -550,7 +549,7 @@ async def cmd_invite(message: Message):
     quiz_link = f"https://t.me/{bot_username}?start=quiz30"
 
     # Реферальный код (если есть)
-    referral_code = user[8] if user and len(user) > 8 and user[8] else None
+    referral_code = user.referral_code if user else None
     referral_link = f"https://t.me/{bot_username}?start=REF_{referral_code}" if referral_code else None
 
     text = (
@@ -571,7 +570,7 @@ async def cmd_invite(message: Message):
 
     await message.answer(
         text,
-        reply_markup=get_main_menu(user_id, username),
+        reply_markup=await get_main_menu(user_id, username),
         parse_mode="HTML",
     )
 
@@ -582,7 +581,7 @@ async def cmd_level(message: Message):
     """Команда /level или кнопка - перепройти тест уровня"""
     user_id = message.from_user.id
     username = message.from_user.username
-    user = get_user(user_id)
+    user = await get_user(user_id)
 
     if not user:
         start_kb = InlineKeyboardMarkup(
@@ -618,11 +617,11 @@ async def cb_go_start(callback: CallbackQuery):
     user_id = callback.from_user.id
     username = callback.from_user.username or callback.from_user.first_name
 
-    user = get_user(user_id)
+    user = await get_user(user_id)
     if not user:
-        create_user(user_id, username)
+        await create_user(user_id, username)
 
-    if not is_onboarding_completed(user_id):
+    if not await is_onboarding_completed(user_id):
         keyboard = InlineKeyboardMarkup(
             inline_keyboard=[
                 [InlineKeyboardButton(text="🚀 Начать!", callback_data="start_onboarding")]
@@ -652,6 +651,6 @@ async def cb_go_start(callback: CallbackQuery):
             "<b>Бесплатно:</b> 25 сообщений\n"
             "<b>Premium:</b> Безлимитный доступ всего за <b>100 Stars</b>/неделю\n\n"
             "Используй кнопки ниже для быстрого доступа! ⬇️",
-            reply_markup=get_main_menu(user_id, username),
+            reply_markup=await get_main_menu(user_id, username),
             parse_mode="HTML",
         )
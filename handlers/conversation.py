@@ -1,6 +1,7 @@
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.enums import ChatAction
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 import sys
 import os
 import re
@@ -10,28 +11,20 @@ import asyncio
 import random
 import tempfile
 from time import time
-from datetime import date, timedelta
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import (
+from async_db import (
     get_conversation_history,
-    save_message,
-    increment_message_count,
+    get_conversation_summary,
+    record_turn,
     get_user,
     create_user,
-    can_send_message,
+    check_entitlement,
     is_onboarding_completed,
-    update_user_streak,
-    user_get,
-    has_active_subscription,
-    get_streak_reward_level,
-    set_streak_reward_level,
-    add_messages,
-    add_premium_days,
 )
 
 # Streak-награды: {дней: (описание, бонус сообщений, бонус дней премиум)}
@@ -43,6 +36,8 @@ STREAK_MILESTONES = {
 }
 
 from services.ollama_service import get_ollama_response
+from services.entitlement_service import free_messages_left
+from services import summary_service
 from services.whisper_service import transcribe_audio
 from services.tts_service import text_to_speech
 from handlers.keyboards import get_main_menu
@@ -50,7 +45,6 @@ from handlers.keyboards import get_main_menu
 from dotenv import load_dotenv
 
 load_dotenv()
-WHITELIST_USERNAMES = os.getenv("WHITELIST_USERNAMES", "").split(",")
 
 from logger import get_logger
 
@@ -61,6 +55,11 @@ _last_message_time = {}
 RATE_LIMIT_SECONDS = 3
 SUGGESTIONS_CACHE: dict[int, dict[str, str]] = {}
 
+# Streaming: ответ появляется сразу и дописывается через edit_text
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "1") == "1"
+# Telegram ограничивает частоту правок одного чата — не чаще раза в N секунд
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
 
 # phrases = [p.strip() for p in phrases if isinstance(p, str) and p.strip()]
 
@@ -115,8 +114,88 @@ def extract_english_for_tts(text: str) -> str:
     return result.strip()
 
 
-async def process_user_message(message: Message, user_text: str, from_user=None):
-    """from_user — передавать callback.from_user при вызове из callback-хендлеров."""
+class _StreamedReply:
+    """Сообщение бота, которое дописывается через edit_text по мере генерации."""
+
+    def __init__(self, message: Message):
+        self._source = message
+        self.sent: Message | None = None
+        self._text = ""
+        self._edited_at = 0.0
+        self.retry_after = 0
+        # Первое сообщение не ушло — дальше не стримим, ответ уйдёт целиком в finish
+        self._send_failed = False
+
+    async def update(self, text: str):
+        if self._send_failed:
+            return
+        if self.sent is None:
+            # Ошибка Telegram здесь не должна обрывать генерацию: иначе
+            # готовый ответ LLM заменится на LLM_ERROR_REPLY
+            try:
+                self.sent = await self._source.answer(text)
+            except TelegramRetryAfter as e:
+                logger.warning(f"Flood control при отправке streaming-сообщения: {e}")
+                self.retry_after = e.retry_after
+                self._send_failed = True
+                return
+            except Exception as e:
+                logger.warning(f"Не удалось отправить streaming-сообщение: {e}")
+                self._send_failed = True
+                return
+            self._text = text
+            self._edited_at = time()
+            return
+        if time() - self._edited_at >= STREAM_EDIT_INTERVAL:
+            await self._edit(text)
+
+    async def _edit(self, text: str, reply_markup=None) -> bool:
+        """True — в сообщении теперь text (или он там уже был)."""
+        if text == self._text and reply_markup is None:
+            return True
+        self._edited_at = time()
+        try:
+            await self.sent.edit_text(text, reply_markup=reply_markup)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                logger.warning(f"Не удалось обновить streaming-сообщение: {e}")
+                return False
+        except TelegramRetryAfter as e:
+            logger.warning(f"Flood control при обновлении streaming-сообщения: {e}")
+            self.retry_after = e.retry_after
+            return False
+        except Exception as e:
+            logger.warning(f"Не удалось обновить streaming-сообщение: {e}")
+            return False
+        self._text = text
+        return True
+
+    async def finish(self, text: str, reply_markup=None) -> bool:
+        """
+        Показать итоговый текст. False — итог не показан (первое сообщение не ушло
+        или последняя правка не прошла): тогда ответ отправляется обычным сообщением.
+        """
+        if self.sent is not None:
+            if await self._edit(text, reply_markup):
+                return True
+            # Оборванный ответ убираем, чтобы полный не дублировал его
+            try:
+                await self.sent.delete()
+            except Exception as e:
+                logger.warning(f"Не удалось удалить неполное streaming-сообщение: {e}")
+        if self.retry_after:
+            # Telegram всё равно отклонит отправку раньше, чем истечёт пауза
+            await asyncio.sleep(self.retry_after)
+        return False
+
+
+async def process_user_message(
+    message: Message, user_text: str, from_user=None, entitlement: dict | None = None
+):
+    """
+    from_user — передавать callback.from_user при вызове из callback-хендлеров.
+    entitlement — результат check_entitlement, если хендлер уже проверил лимиты.
+    """
     if from_user:
         user_id = from_user.id
         username = from_user.username
@@ -124,26 +203,37 @@ async def process_user_message(message: Message, user_text: str, from_user=None)
         user_id = message.from_user.id
         username = message.from_user.username
     bot = message.bot
+    if entitlement is None:
+        entitlement = await check_entitlement(user_id, username)
 
-    history = get_conversation_history(user_id)
+    history, summary_row = await asyncio.gather(
+        get_conversation_history(user_id), get_conversation_summary(user_id)
+    )
     await bot.send_chat_action(user_id, ChatAction.TYPING)
-    await asyncio.sleep(random.uniform(1.5, 3.0))
+    if not STREAM_REPLIES:
+        await asyncio.sleep(random.uniform(1.5, 3.0))
 
     # --- Получаем уровень пользователя ---
     user_level = "A1"
-    user = get_user(user_id)
-    if user and len(user) > 4 and user[4]:
-        user_level = user[4]
+    user = await get_user(user_id)
+    if user and user.level:
+        user_level = user.level
 
     # --- Запрос к LLM (теперь возвращает dict) ---
-    response_data = get_ollama_response(user_text, history, level=user_level or "A1")
+    streamed = _StreamedReply(message) if STREAM_REPLIES else None
+    response_data = await get_ollama_response(
+        user_text,
+        history,
+        level=user_level or "A1",
+        on_partial=streamed.update if streamed else None,
+        summary=summary_row[0] if summary_row else None,
+    )
 
     # --- Извлекаем компоненты ---
     reply = response_data.get("reply", "").strip()
     question = response_data.get("question")
     quick_replies = response_data.get("quick_replies", [])
     correction = response_data.get("correction")
-    tip = response_data.get("tip")
 
     # --- Формируем финальный текст ---
     parts = []
@@ -155,26 +245,42 @@ async def process_user_message(message: Message, user_text: str, from_user=None)
         parts.append(question)
     full_text = "\n".join(parts).strip()
 
+    # --- Готовим клавиатуру для quick replies (только A1/A2 и если есть вопрос) ---
+    quick_reply_kb = None
+    if user_level in ["A1", "A2"] and question and quick_replies:
+        # Очищаем и ограничиваем
+        clean_phrases = []
+        for p in quick_replies[:4]:
+            if isinstance(p, str):
+                t = p.strip()
+                if t and len(t) <= 35:
+                    clean_phrases.append(t)
+        if clean_phrases:
+            SUGGESTIONS_CACHE[message.message_id] = {
+                str(i): clean_phrases[i] for i in range(len(clean_phrases))
+            }
+            quick_reply_kb = build_suggestions_inline(clean_phrases)
+
+    # --- Streaming: дописываем correction/question и подсказки в уже показанное сообщение ---
+    text_sent = False
+    if streamed and full_text:
+        text_sent = await streamed.finish(full_text, reply_markup=quick_reply_kb)
+
     # --- Сохраняем в историю (без correction, чтобы LLM не повторял старые исправления) ---
+    # --- Одной транзакцией: история, счётчик сообщений, streak и streak-награда ---
     history_text = "\n".join([p for p in [reply, question] if p]).strip()
-    save_message(user_id, "user", user_text)
-    save_message(user_id, "assistant", history_text or full_text)
-    increment_message_count(user_id, username)
-
-    # --- STREAK ---
-    user_data = user
-    if user_data and len(user_data) >= 8:
-        last_active = user_data[6]
-        current_streak = user_data[7] or 0
-        today = date.today()
-        today_str = today.isoformat()
-        if last_active == today_str:
-            new_streak = current_streak
-        elif last_active == (today - timedelta(days=1)).isoformat():
-            new_streak = current_streak + 1
-        else:
-            new_streak = 1
-        update_user_streak(user_id, new_streak, today_str)
+    turn = await record_turn(
+        user_id,
+        user_text,
+        history_text or full_text,
+        streak_rewards={
+            days: (bonus_msgs, bonus_days)
+            for days, (_, bonus_msgs, bonus_days) in STREAK_MILESTONES.items()
+        },
+    )
+    if turn:
+        # Раз в N сообщений сворачиваем новые реплики в summary, в фоне
+        summary_service.schedule_refresh(user_id, turn["message_count"])
 
     # --- TTS: только английский текст ---
     tts_text = extract_english_for_tts(reply + (" " + question if question else ""))
@@ -193,27 +299,12 @@ async def process_user_message(message: Message, user_text: str, from_user=None)
         except Exception as e:
             logger.error(f"Error generating voice: {e}", exc_info=True)
 
-    # --- Готовим клавиатуру для quick replies (только A1/A2 и если есть вопрос) ---
-    quick_reply_kb = None
-    if user_level in ["A1", "A2"] and question and quick_replies:
-        # Очищаем и ограничиваем
-        clean_phrases = []
-        for p in quick_replies[:4]:
-            if isinstance(p, str):
-                t = p.strip()
-                if t and len(t) <= 35:
-                    clean_phrases.append(t)
-        if clean_phrases:
-            SUGGESTIONS_CACHE[message.message_id] = {
-                str(i): clean_phrases[i] for i in range(len(clean_phrases))
-            }
-            quick_reply_kb = build_suggestions_inline(clean_phrases)
-
     # --- Отправляем основной текст с клавиатурой (если есть) ---
-    main_kb = get_main_menu(user_id, username)
+    main_kb = await get_main_menu(user_id, username)
     final_kb = quick_reply_kb or main_kb
 
-    await message.answer(full_text, reply_markup=final_kb)
+    if not text_sent:
+        await message.answer(full_text, reply_markup=final_kb)
 
     # --- Удаляем временный аудиофайл ---
     if audio_path:
@@ -223,23 +314,22 @@ async def process_user_message(message: Message, user_text: str, from_user=None)
             pass
 
     # --- Предупреждение о лимите (FREE) ---
-    if not (username and username in WHITELIST_USERNAMES) and user_data:
-        if not has_active_subscription(user_id):
-            FREE_LIMIT = int(os.getenv("FREE_MESSAGE_LIMIT", "25"))
-            used = int(user_get(user_data, "message_count", 0))
-            bonus = int(user_get(user_data, "messages_count", 0))
-            total = FREE_LIMIT + max(bonus, 0)
-            messages_left = total - used
-            if 0 < messages_left <= 5:
-                await message.answer(
-                    f"You have {messages_left} free messages left.\n"
-                    f"Press button below to get unlimited access!",
-                    reply_markup=main_kb,
-                )
+    # VIP/Premium определены ещё при проверке лимита, счётчики — из record_turn
+    # (streak-награда с днями Premium в этом же ходе снимает лимит)
+    reward = turn["reward_milestone"] if turn else None
+    premium_reward = bool(reward) and STREAK_MILESTONES[reward][2] > 0
+    if entitlement["messages_left"] is not None and turn and not premium_reward:
+        messages_left = free_messages_left(turn["message_count"], turn["messages_count"])
+        if 0 < messages_left <= 5:
+            await message.answer(
+                f"You have {messages_left} free messages left.\n"
+                f"Press button below to get unlimited access!",
+                reply_markup=main_kb,
+            )
 
     # --- Streak уведомление + награды ---
-    if "last_active" in locals() and last_active != today_str:
-        days = new_streak
+    if turn and turn["streak_updated"]:
+        days = turn["streak_days"]
         if days % 10 == 1 and days % 100 != 11:
             word = "день"
         elif 2 <= days % 10 <= 4 and not (12 <= days % 100 <= 14):
@@ -247,18 +337,12 @@ async def process_user_message(message: Message, user_text: str, from_user=None)
         else:
             word = "дней"
 
-        # Проверяем streak-награды
-        last_reward = get_streak_reward_level(user_id)
+        # Streak-награда уже начислена в record_turn
         reward_text = ""
-        for milestone, (desc, bonus_msgs, bonus_days) in sorted(STREAK_MILESTONES.items()):
-            if days >= milestone and last_reward < milestone:
-                if bonus_msgs > 0:
-                    add_messages(user_id, bonus_msgs)
-                if bonus_days > 0:
-                    add_premium_days(user_id, bonus_days)
-                set_streak_reward_level(user_id, milestone)
-                reward_text = f"\n\n🏅 Награда за {milestone} дней: {desc}"
-                break  # одна награда за раз
+        milestone = turn["reward_milestone"]
+        if milestone:
+            desc = STREAK_MILESTONES[milestone][0]
+            reward_text = f"\n\n🏅 Награда за {milestone} дней: {desc}"
 
         # Прогресс до следующей награды
         next_milestone = None
@@ -318,15 +402,15 @@ async def handle_voice_message(message: Message):
     _last_message_time[user_id] = current_time
 
     # Проверяем/создаём пользователя
-    user = get_user(user_id)
-    if user and len(user) > 4 and user[4]:
-        user_level = user[4]
+    user = await get_user(user_id)
+    if user and user.level:
+        user_level = user.level
 
     if not user:
-        create_user(user_id, username or message.from_user.first_name)
+        await create_user(user_id, username or message.from_user.first_name)
 
     # Проверяем онбординг
-    if not is_onboarding_completed(user_id):
+    if not await is_onboarding_completed(user_id):
         # Кнопка для начала онбординга
         start_kb = InlineKeyboardMarkup(
             inline_keyboard=[
@@ -340,12 +424,13 @@ async def handle_voice_message(message: Message):
         return
 
     # ПРОВЕРЯЕМ ЛИМИТЫ С USERNAME
-    if not can_send_message(user_id, username):
+    entitlement = await check_entitlement(user_id, username)
+    if not entitlement["allowed"]:
         await message.answer(
             "You've used all your free messages!\n"
             "Get a subscription to continue practicing English\n"
             "Press button below to see prices!",
-            reply_markup=get_main_menu(user_id, username),
+            reply_markup=await get_main_menu(user_id, username),
         )
         return
 
@@ -369,7 +454,7 @@ async def handle_voice_message(message: Message):
             await message.answer(
                 "Sorry, I couldn't understand that. Could you try again?\n"
                 "Make sure you're speaking clearly in English.",
-                reply_markup=get_main_menu(user_id, username),
+                reply_markup=await get_main_menu(user_id, username),
             )
             return
         # Показываем что услышали
@@ -377,7 +462,7 @@ async def handle_voice_message(message: Message):
         # Небольшая задержка перед обработкой
         await asyncio.sleep(random.uniform(0.5, 1.0))
         # Обрабатываем как обычное сообщение
-        await process_user_message(message, user_text)
+        await process_user_message(message, user_text, entitlement=entitlement)
     except Exception as e:
         print(f"Error processing voice: {e}")
         import traceback
@@ -386,7 +471,7 @@ async def handle_voice_message(message: Message):
         await message.answer(
             "Sorry, there was an error processing your voice message. "
             "Please try again or send a text message.",
-            reply_markup=get_main_menu(user_id, username),
+            reply_markup=await get_main_menu(user_id, username),
         )
 
 
@@ -428,17 +513,17 @@ async def handle_text_message(message: Message):
 
     # Проверяем/создаём пользователя
     print(f"Проверяю пользователя в базе...")
-    user = get_user(user_id)
+    user = await get_user(user_id)
     if not user:
         print(f"Пользователь не найден! Создаю...")
-        create_user(user_id, username or message.from_user.first_name)
-        user = get_user(user_id)
+        await create_user(user_id, username or message.from_user.first_name)
+        user = await get_user(user_id)
         print(f"Пользователь создан: {user}")
     else:
         print(f"Пользователь найден: {user}")
 
     # Проверяем онбординг
-    if not is_onboarding_completed(user_id):
+    if not await is_onboarding_completed(user_id):
         # Кнопка для начала онбординга
         start_kb = InlineKeyboardMarkup(
             inline_keyboard=[
@@ -453,20 +538,20 @@ async def handle_text_message(message: Message):
 
     # ПРОВЕРЯЕМ ЛИМИТЫ С USERNAME
     print(f"Проверяю лимиты...")
-    can_send = can_send_message(user_id, username)
-    print(f"Результат can_send_message: {can_send}")
-    if not can_send:
+    entitlement = await check_entitlement(user_id, username)
+    print(f"Результат проверки лимитов: {entitlement}")
+    if not entitlement["allowed"]:
         print(f"Лимит исчерпан!")
         await message.answer(
             "You've used all your free messages!\n"
             "Get a subscription to continue practicing English\n"
             "Press button below to see prices!",
-            reply_markup=get_main_menu(user_id, username),
+            reply_markup=await get_main_menu(user_id, username),
         )
         return
 
     # Обрабатываем сообщение
-    await process_user_message(message, user_text)
+    await process_user_message(message, user_text, entitlement=entitlement)
 
 
 @router.callback_query(F.data.startswith("sugg:"))
@@ -4,7 +4,7 @@ from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
 )
-from database import has_active_subscription
+from async_db import has_active_subscription
 import os
 from dotenv import load_dotenv
 
@@ -38,7 +38,7 @@ def get_suggested_phrases_keyboard():
     )
 
 
-def get_main_menu(user_id=None, username=None):
+async def get_main_menu(user_id=None, username=None):
     """Главное меню в зависимости от статуса"""
     # VIP пользователи
     if username and username in WHITELIST_USERNAMES:
@@ -70,7 +70,7 @@ def get_main_menu(user_id=None, username=None):
             persistent=True,
         )
     # Premium пользователи
-    elif user_id and has_active_subscription(user_id):
+    elif user_id and await has_active_subscription(user_id):
         keyboard = ReplyKeyboardMarkup(
             keyboard=[
                 [
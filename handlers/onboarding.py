@@ -14,7 +14,7 @@ import string
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import (
+from async_db import (
     create_user,
     get_user,
     set_user_level,
@@ -340,19 +340,19 @@ async def complete_onboarding(callback: CallbackQuery, level: str, last_correct:
     username = callback.from_user.username
 
     # Создаём пользователя если его нет
-    if not get_user(user_id):
-        create_user(user_id, username)
+    if not await get_user(user_id):
+        await create_user(user_id, username)
 
     # Сохраняем уровень и завершаем онбординг
-    set_user_level(user_id, level)
-    mark_onboarding_completed(user_id)
+    await set_user_level(user_id, level)
+    await mark_onboarding_completed(user_id)
 
     # Генерируем реферальный код только если его ещё нет
-    user = get_user(user_id)
-    existing_code = user[8] if user and len(user) > 8 else None
+    user = await get_user(user_id)
+    existing_code = user.referral_code if user else None
     if not existing_code:
         referral_code = generate_referral_code()
-        set_referral_code(user_id, referral_code)
+        await set_referral_code(user_id, referral_code)
     else:
         referral_code = existing_code
 
@@ -385,10 +385,10 @@ async def complete_onboarding(callback: CallbackQuery, level: str, last_correct:
     await callback.message.answer(
         text,
         parse_mode="HTML",
-        reply_markup=get_main_menu(user_id, username),
+        reply_markup=await get_main_menu(user_id, username),
     )
 
     await callback.message.answer(
         "✅ Меню включено",
-        reply_markup=get_main_menu(user_id, username),
+        reply_markup=await get_main_menu(user_id, username),
     )
@@ -5,7 +5,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import activate_subscription, save_payment, get_user, set_referral_code
+from async_db import activate_subscription, save_payment, get_user, set_referral_code
 from handlers.keyboards import get_main_menu, get_buy_menu, get_stars_help_menu
 
 router = Router()
@@ -59,7 +59,7 @@ async def callback_pay_usdt(callback: CallbackQuery):
         await callback.message.answer(
             "Оплата USDT временно недоступна.\n"
             "Используй Telegram Stars.",
-            reply_markup=get_main_menu(user_id, username)
+            reply_markup=await get_main_menu(user_id, username)
         )
         return
     
@@ -135,8 +135,8 @@ async def callback_phone_paid(callback: CallbackQuery):
         if admin_username:
             try:
                 # Ищем admin user_id в базе по username
-                from database import get_user_id_by_username
-                admin_id = get_user_id_by_username(admin_username)
+                from async_db import get_user_id_by_username
+                admin_id = await get_user_id_by_username(admin_username)
                 if admin_id:
                     admin_kb = InlineKeyboardMarkup(inline_keyboard=[
                         [InlineKeyboardButton(
@@ -166,7 +166,7 @@ async def callback_phone_paid(callback: CallbackQuery):
         "Администратор проверит пополнение и активирует\n"
         "Premium в течение 1 часа.\n\n"
         "Спасибо за оплату!",
-        reply_markup=get_main_menu(user_id, username),
+        reply_markup=await get_main_menu(user_id, username),
         parse_mode="HTML"
     )
 
@@ -178,10 +178,10 @@ async def confirm_phone_payment(callback: CallbackQuery):
     user_id = int(callback.data.split("_")[-1])
 
     # Активируем подписку
-    expires = activate_subscription(user_id, duration_days=7)
+    expires = await activate_subscription(user_id, duration_days=7)
 
     # Сохраняем платёж
-    save_payment(
+    await save_payment(
         user_id=user_id,
         payment_method="phone_topup",
         amount=179,
@@ -192,7 +192,7 @@ async def confirm_phone_payment(callback: CallbackQuery):
 
     # Генерируем реферальный код
     referral_code = generate_referral_code()
-    set_referral_code(user_id, referral_code)
+    await set_referral_code(user_id, referral_code)
 
     # Уведомляем пользователя
     try:
@@ -273,7 +273,7 @@ async def back_to_main_menu(callback: CallbackQuery):
     await callback.message.answer(
         "Главное меню\n\n"
         "Выбери действие с помощью кнопок ниже:",
-        reply_markup=get_main_menu(user_id, username)
+        reply_markup=await get_main_menu(user_id, username)
     )
     try:
         await callback.message.delete()
@@ -316,7 +316,7 @@ async def cmd_buy_usdt(message: Message):
         await message.answer(
             "Оплата USDT временно недоступна.\n"
             "Используй /buy_stars для оплаты через Telegram Stars.",
-            reply_markup=get_main_menu(user_id, username)
+            reply_markup=await get_main_menu(user_id, username)
         )
         return
     
@@ -357,10 +357,10 @@ async def successful_payment_handler(message: Message):
     payment_info = message.successful_payment
     
     # Активируем подписку
-    expires = activate_subscription(user_id, duration_days=7)
+    expires = await activate_subscription(user_id, duration_days=7)
     
     # Сохраняем платёж
-    save_payment(
+    await save_payment(
         user_id=user_id,
         payment_method="telegram_stars",
         amount=STARS_PRICE,
@@ -371,7 +371,7 @@ async def successful_payment_handler(message: Message):
     
     # === ГЕНЕРИРУЕМ И СОХРАНЯЕМ РЕФЕРАЛЬНЫЙ КОД ===
     referral_code = generate_referral_code()
-    set_referral_code(user_id, referral_code)
+    await set_referral_code(user_id, referral_code)
 
 # === ОДНО СООБЩЕНИЕ ===
     await message.answer(
@@ -381,5 +381,5 @@ async def successful_payment_handler(message: Message):
         f"🎉 Твой реферальный код: `{referral_code}`\n"
         f"Пригласи друга — и получи +1 день Premium!\n\n"
         f"Используй /status для проверки подписки.",
-        reply_markup=get_main_menu(user_id, username)
+        reply_markup=await get_main_menu(user_id, username)
     )
\ No newline at end of file
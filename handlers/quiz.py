@@ -7,7 +7,7 @@ from urllib.parse import quote
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 
-from database import get_user, create_user
+from async_db import get_user, create_user
 
 router = Router()
 
@@ -193,9 +193,9 @@ async def start_quiz(message: Message):
     username = message.from_user.username or message.from_user.first_name
 
     # Создаём пользователя если нет
-    user = get_user(user_id)
+    user = await get_user(user_id)
     if not user:
-        create_user(user_id, username)
+        await create_user(user_id, username)
 
     questions = _select_quiz_questions(5)
     quiz_state[user_id] = {
@@ -5,7 +5,7 @@ import random
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 
-from database import get_user, user_get, is_onboarding_completed, reset_conversation
+from async_db import get_user, user_get, is_onboarding_completed, reset_conversation
 from handlers.keyboards import get_main_menu
 
 router = Router()
@@ -259,7 +259,7 @@ async def random_topic(message: Message):
     """Предложить случайную тему для разговора."""
     user_id = message.from_user.id
 
-    if not is_onboarding_completed(user_id):
+    if not await is_onboarding_completed(user_id):
         start_kb = InlineKeyboardMarkup(
             inline_keyboard=[
                 [InlineKeyboardButton(text="🚀 Старт", callback_data="start_onboarding")]
@@ -297,7 +297,7 @@ async def topic_phrase_click(callback: CallbackQuery):
 
     # Новая тема должна начинаться с чистого контекста, иначе модель "залипает"
     # на предыдущем обсуждаемом слове/теме.
-    reset_conversation(user_id)
+    await reset_conversation(user_id)
 
     # Убираем кнопки у предыдущего сообщения
     try:
@@ -1,7 +1,7 @@
 import asyncio
 from aiogram import Bot, Dispatcher
 from dotenv import load_dotenv
-from database import init_db, ensure_columns
+from database import init_db, close_db, flush_history
 import os
 
 load_dotenv()
@@ -11,6 +11,9 @@ from handlers import commands, conversation, payments, onboarding
 from handlers import topics, quiz
 from database import init_db
 from services.reminder_service import reminder_loop
+from services.maintenance_service import maintenance_loop
+from services.ollama_service import llm_router
+import async_db
 # from payment_checker import start_payment_checker  # BscScan API требует платный план
 
 logger = get_logger('main')
@@ -19,7 +22,6 @@ BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 async def main():
     try:
         init_db()
-        ensure_columns()  # ← ДОБАВЬ ЭТУ СТРОКУ
         logger.info("База данных инициализирована")
     except Exception as e:
         logger.error(f"Ошибка инициализации БД: {e}")
@@ -44,10 +46,18 @@ async def main():
     # Фоновые напоминания неактивным пользователям (каждый час)
     asyncio.create_task(reminder_loop(bot))
 
+    # Фоновое обслуживание БД: архив старой истории, checkpoint WAL, VACUUM
+    asyncio.create_task(maintenance_loop())
+
     try:
         await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Критическая ошибка при работе бота: {e}", exc_info=True)
+    finally:
+        await llm_router.close()
+        async_db.shutdown()
+        flush_history()
+        close_db()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -8,7 +8,7 @@ from dotenv import load_dotenv
 
 from logger import get_logger
 from services.bscscan_service import find_payment_by_amount
-from database import (
+from async_db import (
     is_transaction_processed,
     mark_transaction_processed,
     activate_subscription,
@@ -50,7 +50,7 @@ async def check_pending_payments(bot):
             tx_hash = tx["hash"]
             
             # Проверяем не обработали ли мы уже эту транзакцию
-            if is_transaction_processed(tx_hash):
+            if await is_transaction_processed(tx_hash):
                 continue
             
             logger.info(f"💰 Новый платеж! Hash: {tx_hash[:16]}... | Сумма: {tx['value']} USDT")
@@ -69,7 +69,7 @@ async def check_pending_payments(bot):
 
             # Отмечаем транзакцию как обработанную (чтобы не показывать повторно)
             # user_id=0 означает что платеж получен, но еще не привязан к пользователю
-            mark_transaction_processed(tx_hash, user_id=0, amount=tx['value'])
+            await mark_transaction_processed(tx_hash, user_id=0, amount=tx['value'])
                 
     except Exception as e:
         logger.error(f"Ошибка при проверке платежей: {e}", exc_info=True)
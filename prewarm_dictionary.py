@@ -0,0 +1,130 @@
+"""
+Предварительное заполнение словарного кеша для слов из COMMON_WORDS.
+
+Для каждого слова генерирует перевод и объяснение для каждого уровня
+и сохраняет их без срока жизни — во время работы бота эти слова
+не обращаются к LLM. Уже готовые записи пропускаются, поэтому
+прерванный запуск можно просто повторить.
+
+    python prewarm_dictionary.py --concurrency 4
+    python prewarm_dictionary.py --modes translate --limit 100
+"""
+import argparse
+import asyncio
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import async_db
+from database import init_db, close_db
+from logger import get_logger
+from services import dictionary_cache
+from services.ollama_service import (
+    COMMON_WORDS,
+    dictionary_cache_level,
+    generate_dictionary_entry,
+    is_cacheable_dictionary_entry,
+    llm_router,
+)
+
+logger = get_logger("prewarm")
+
+# Уровень, с которым генерируется объяснение; A1 и A2 делят одну запись
+EXPLAIN_LEVELS = ["A1", "B1", "B2"]
+
+
+def build_jobs(modes: list[str], limit: int | None) -> list[tuple[str, str, str]]:
+    """(word, mode, level) для всех слов × режимов × уровней."""
+    words = sorted(COMMON_WORDS)
+    if limit:
+        words = words[:limit]
+    jobs = []
+    for word in words:
+        if dictionary_cache.MODE_TRANSLATE in modes:
+            jobs.append((word, dictionary_cache.MODE_TRANSLATE, "A1"))
+        if dictionary_cache.MODE_EXPLAIN in modes:
+            for level in EXPLAIN_LEVELS:
+                jobs.append((word, dictionary_cache.MODE_EXPLAIN, level))
+    return jobs
+
+
+async def prewarm(modes: list[str], concurrency: int, limit: int | None = None) -> dict:
+    jobs = build_jobs(modes, limit)
+    queue: asyncio.Queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+
+    counts = {"generated": 0, "promoted": 0, "skipped": 0, "failed": 0}
+    started = time.monotonic()
+
+    def log_progress():
+        done = sum(counts.values())
+        elapsed = time.monotonic() - started
+        rate = counts["generated"] / elapsed * 60 if elapsed else 0.0
+        logger.info(f"📚 {done}/{len(jobs)} — {counts}, {rate:.1f} записей/мин")
+
+    async def worker():
+        while True:
+            try:
+                word, mode, level = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            cache_level = dictionary_cache_level(mode, level)
+            existing = await dictionary_cache.lookup(word, mode, cache_level)
+            if existing is not None:
+                response, expires_at = existing
+                if expires_at is None:
+                    counts["skipped"] += 1
+                else:
+                    # Запись с TTL из рантайма — делаем бессрочной без обращения к LLM
+                    await dictionary_cache.put(word, mode, cache_level, response, ttl=None)
+                    counts["promoted"] += 1
+            else:
+                response = await generate_dictionary_entry(word, mode, level)
+                if is_cacheable_dictionary_entry(response):
+                    await dictionary_cache.put(word, mode, cache_level, response, ttl=None)
+                    counts["generated"] += 1
+                else:
+                    counts["failed"] += 1
+                    logger.warning(f"Не удалось получить {mode}/{cache_level or '-'} для '{word}'")
+            if sum(counts.values()) % 50 == 0:
+                log_progress()
+
+    # Ограничение RPM/TPM соблюдают лимитеры провайдеров внутри call_ollama_raw
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    finally:
+        await llm_router.close()
+
+    elapsed = time.monotonic() - started
+    log_progress()
+    return {**counts, "total": len(jobs), "seconds": round(elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заполнить словарный кеш для COMMON_WORDS")
+    parser.add_argument("--concurrency", type=int, default=4, help="число параллельных запросов")
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=[dictionary_cache.MODE_TRANSLATE, dictionary_cache.MODE_EXPLAIN],
+        default=[dictionary_cache.MODE_TRANSLATE, dictionary_cache.MODE_EXPLAIN],
+    )
+    parser.add_argument("--limit", type=int, default=None, help="только первые N слов")
+    args = parser.parse_args()
+
+    init_db()
+    try:
+        result = asyncio.run(prewarm(args.modes, args.concurrency, args.limit))
+        logger.info(f"✅ Готово: {result}")
+    except KeyboardInterrupt:
+        logger.info("⏹ Прервано — готовые записи сохранены, повторный запуск продолжит с места остановки")
+    finally:
+        async_db.shutdown()
+        close_db()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Кеш словарных ответов LLM (перевод и объяснение слова).
+Ключ — (нормализованное слово, режим, уровень): сначала LRU в памяти,
+затем таблица dictionary_cache в SQLite. У записи есть срок жизни и
+prompt_hash — после изменения промпта старые ответы больше не отдаются.
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+from async_db import get_dictionary_entry, save_dictionary_entry, purge_dictionary_cache
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+DICT_CACHE_SIZE = int(os.getenv("DICT_CACHE_SIZE", "2000"))
+# Срок жизни записи в секундах (по умолчанию 30 дней)
+DICT_CACHE_TTL = int(os.getenv("DICT_CACHE_TTL", str(30 * 24 * 3600)))
+
+MODE_TRANSLATE = "translate"
+MODE_EXPLAIN = "explain"
+
+# mode -> prompt_hash актуальных шаблонов (регистрирует ollama_service)
+PROMPT_HASHES: dict[str, str] = {}
+
+# (word, mode, level) -> (response, prompt_hash, expires_at)
+_memory: OrderedDict[tuple[str, str, str], tuple[str, str, float | None]] = OrderedDict()
+_metrics = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stale": 0, "stores": 0}
+
+
+def register_prompt(mode: str, *templates: str) -> str:
+    """Посчитать prompt_hash по тексту шаблонов и запомнить его для режима."""
+    digest = hashlib.sha1("\x00".join(templates).encode("utf-8")).hexdigest()[:16]
+    PROMPT_HASHES[mode] = digest
+    return digest
+
+
+def normalize_word(word: str) -> str:
+    return " ".join(word.strip().lower().split())
+
+
+def _fresh(entry: tuple | None, prompt_hash: str, now: float) -> bool:
+    if entry is None:
+        return False
+    _, entry_hash, expires_at = entry
+    return entry_hash == prompt_hash and (expires_at is None or expires_at > now)
+
+
+def _remember(key: tuple, entry: tuple):
+    _memory[key] = entry
+    _memory.move_to_end(key)
+    while len(_memory) > DICT_CACHE_SIZE:
+        _memory.popitem(last=False)
+
+
+async def get(word: str, mode: str, level: str = "") -> str | None:
+    """Ответ из кеша или None (нет, просрочен или получен старым промптом)."""
+    key = (normalize_word(word), mode, level)
+    prompt_hash = PROMPT_HASHES.get(mode, "")
+    now = time.time()
+
+    entry = _memory.get(key)
+    if _fresh(entry, prompt_hash, now):
+        _memory.move_to_end(key)
+        _metrics["memory_hits"] += 1
+        return entry[0]
+
+    entry = await get_dictionary_entry(*key)
+    if _fresh(entry, prompt_hash, now):
+        _remember(key, tuple(entry))
+        _metrics["db_hits"] += 1
+        return entry[0]
+
+    _metrics["stale" if entry else "misses"] += 1
+    return None
+
+
+async def lookup(word: str, mode: str, level: str = "") -> tuple[str, float | None] | None:
+    """(response, expires_at) актуальной записи из БД, без памяти и метрик (для prewarm)."""
+    entry = await get_dictionary_entry(normalize_word(word), mode, level)
+    if _fresh(entry, PROMPT_HASHES.get(mode, ""), time.time()):
+        return entry[0], entry[2]
+    return None
+
+
+async def put(word: str, mode: str, level: str, response: str, ttl: int | None = DICT_CACHE_TTL):
+    """Сохранить ответ. ttl=None — запись без срока."""
+    key = (normalize_word(word), mode, level)
+    prompt_hash = PROMPT_HASHES.get(mode, "")
+    expires_at = time.time() + ttl if ttl is not None else None
+    await save_dictionary_entry(*key, prompt_hash, response, expires_at)
+    _remember(key, (response, prompt_hash, expires_at))
+    _metrics["stores"] += 1
+
+
+async def purge() -> int:
+    """Удалить из БД просроченные записи и ответы на старые промпты."""
+    return await purge_dictionary_cache(dict(PROMPT_HASHES))
+
+
+def stats() -> dict:
+    lookups = _metrics["memory_hits"] + _metrics["db_hits"] + _metrics["misses"] + _metrics["stale"]
+    hits = _metrics["memory_hits"] + _metrics["db_hits"]
+    return {
+        **_metrics,
+        "memory_entries": len(_memory),
+        "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+    }
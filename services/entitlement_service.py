@@ -0,0 +1,53 @@
+"""
+Права на отправку сообщений: VIP / Premium / бесплатный лимит.
+Настройки из .env читаются один раз при импорте, проверка берёт подписку
+из кеша подписок и пользователя из кеша пользователей — в худшем случае
+это один запрос к БД.
+"""
+import os
+
+from dotenv import load_dotenv
+
+import database
+
+load_dotenv()
+
+WHITELIST_USERNAMES = frozenset(
+    name.strip() for name in os.getenv("WHITELIST_USERNAMES", "").split(",") if name.strip()
+)
+FREE_MESSAGE_LIMIT = int(os.getenv("FREE_MESSAGE_LIMIT", "25"))
+
+REASON_VIP = "vip"
+REASON_PREMIUM = "premium"
+REASON_NEW_USER = "new_user"
+REASON_FREE = "free"
+REASON_LIMIT_REACHED = "limit_reached"
+
+
+def free_messages_left(message_count: int, bonus_messages: int) -> int:
+    """Сколько бесплатных сообщений осталось (messages_count — бонусные сообщения)."""
+    limit = FREE_MESSAGE_LIMIT + max(int(bonus_messages or 0), 0)
+    return max(limit - int(message_count or 0), 0)
+
+
+def check_entitlement(user_id: int, username: str | None = None) -> dict:
+    """
+    Вернёт {"allowed", "reason", "messages_left"}.
+    messages_left — None для VIP, Premium и ещё не созданных пользователей.
+    """
+    if username and username in WHITELIST_USERNAMES:
+        return {"allowed": True, "reason": REASON_VIP, "messages_left": None}
+
+    if database.has_active_subscription(user_id):
+        return {"allowed": True, "reason": REASON_PREMIUM, "messages_left": None}
+
+    user = database.get_user(user_id)
+    if not user:
+        return {"allowed": True, "reason": REASON_NEW_USER, "messages_left": None}
+
+    left = free_messages_left(user.get("message_count", 0), user.get("messages_count", 0))
+    return {
+        "allowed": left > 0,
+        "reason": REASON_FREE if left > 0 else REASON_LIMIT_REACHED,
+        "messages_left": left,
+    }
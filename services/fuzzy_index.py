@@ -0,0 +1,75 @@
+"""
+Нечёткий поиск по словарю (SymSpell): для каждого слова заранее строятся
+все варианты с удалением до max_distance букв. Кандидаты для запроса —
+слова, у которых есть общий вариант удаления с запросом, поэтому поиск
+не перебирает весь словарь и не зависит от его размера.
+Кандидаты ранжируются как в difflib.get_close_matches (SequenceMatcher.ratio).
+"""
+from difflib import SequenceMatcher
+from heapq import nlargest
+
+
+def _deletes(word: str, max_distance: int) -> set[str]:
+    """Все строки, получаемые из word удалением от 0 до max_distance символов."""
+    result = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        next_frontier = set()
+        for item in frontier:
+            if len(item) <= 1:
+                continue
+            for i in range(len(item)):
+                next_frontier.add(item[:i] + item[i + 1:])
+        next_frontier -= result
+        result |= next_frontier
+        frontier = next_frontier
+    return result
+
+
+class FuzzyIndex:
+    """
+    index = FuzzyIndex(words)
+    index.suggest("aple")  # -> ["apple", ...]
+
+    prefix_length ограничивает индекс началом слова (как в SymSpell):
+    память растёт линейно от размера словаря, а опечатки в начале слова
+    всё равно находятся.
+    """
+
+    def __init__(self, words, max_distance: int = 2, prefix_length: int = 7):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.words = sorted(set(words))
+        # вариант удаления -> индексы слов в self.words
+        self._index: dict[str, list[int]] = {}
+        for idx, word in enumerate(self.words):
+            for variant in _deletes(word[:prefix_length], max_distance):
+                self._index.setdefault(variant, []).append(idx)
+
+    def __len__(self):
+        return len(self.words)
+
+    def candidates(self, word: str) -> set[str]:
+        found = set()
+        for variant in _deletes(word[:self.prefix_length], self.max_distance):
+            bucket = self._index.get(variant)
+            if bucket:
+                found.update(bucket)
+        return {self.words[idx] for idx in found}
+
+    def suggest(self, word: str, n: int = 3, cutoff: float = 0.6) -> list[str]:
+        """Лучшие n похожих слов с SequenceMatcher.ratio() >= cutoff (как get_close_matches)."""
+        matcher = SequenceMatcher()
+        matcher.set_seq2(word)
+        scored = []
+        for candidate in self.candidates(word):
+            # Разница длин больше max_distance — это точно больше max_distance правок
+            if abs(len(candidate) - len(word)) > self.max_distance:
+                continue
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() < cutoff or matcher.quick_ratio() < cutoff:
+                continue
+            score = matcher.ratio()
+            if score >= cutoff:
+                scored.append((score, candidate))
+        return [candidate for _, candidate in nlargest(n, scored)]
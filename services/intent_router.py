@@ -0,0 +1,149 @@
+"""
+Классификация входящего сообщения до обращения к LLM.
+
+Все шаблоны скомпилированы один раз при импорте; поиск слова идёт одним
+объединённым регулярным выражением вместо последовательных re.search.
+Результат — Intent: слово для словарного режима, признак запроса перевода
+и текст для полного перевода.
+"""
+import re
+
+_WORD_RE = r"[a-zA-Zа-яА-ЯёЁ][a-zA-Zа-яА-ЯёЁ'\-]{0,30}"
+
+# Порядок = приоритет: побеждает первый шаблон, нашедшийся где угодно в тексте
+_WORD_PATTERNS = [
+    # English intents (в т.ч. длинные фразы с вводными словами)
+    r"\bwhat\s+does\s+{w}\s+mean\b",
+    r"\bwhat\s+is\s+the\s+meaning\s+of\s+{w}\b",
+    r"\bmeaning\s+of\s+{w}\b",
+    r"\btranslation\s+of\s+(?:the\s+)?(?:word\s+)?{w}\b",
+    r"\brussian\s+translation\s+of\s+(?:the\s+)?(?:word\s+)?{w}\b",
+    r"\btranslate\s+(?:please\s+)?(?:the\s+)?(?:word\s+)?{w}\b",
+    r"\bwhat\s+is\s+mean\s+by\s+{w}\b",
+    r"\bwhat\s+is\s+mean\s+in\s+{w}\b",  # ASR typo
+    r"\bwhat\s+is\s+mean\s+{w}\b",  # ASR typo: "what is mean table"
+    r"\bwhat's\s+{w}\b",
+    # Russian intents
+    r"\bчто\s+значит\s+{w}\b",
+    r"\bчто\s+такое\s+{w}\b",
+    r"\bчто\s+означает\s+{w}\b",
+    r"\bзначение\s+{w}\b",
+    r"\bперевод\s+{w}\b",
+    r"\bпереведи\s+(?:слово\s+)?(?:пожалуйста\s+)?{w}\b",
+    r"\bкак\s+переводится\s+{w}\b",
+    r"\bкак\s+будет\s+{w}\b",
+    r"\bкак\s+(?:по-английски|по\s+английски)\s+{w}\b",
+    r"\b{w}\s*-\s*это\s+что\b",
+    r"\b{w}\s*-\s*что\s+это\b",
+]
+
+_WORD_REGEXES = [
+    re.compile(p.format(w=f"({_WORD_RE})"), re.IGNORECASE) for p in _WORD_PATTERNS
+]
+# ^(?:.*?p0|.*?p1|...) — ветки перебираются по порядку, и каждая ищет самое левое
+# совпадение своего шаблона, то есть ровно как цикл re.search, но за один вызов
+_COMBINED_WORD_RE = re.compile(
+    "^(?:"
+    + "|".join(
+        ".*?" + p.format(w=f"(?P<w{i}>{_WORD_RE})") for i, p in enumerate(_WORD_PATTERNS)
+    )
+    + ")",
+    re.IGNORECASE | re.DOTALL,
+)
+
+_TRANSLATION_RE = re.compile(
+    r"\b(?:translation|translate|meaning|mean|перевод|переведи|перевести"
+    r"|что\s+значит|что\s+означает|как\s+переводится)\b"
+)
+
+_NORMALIZE_RE = re.compile(r"[^a-zA-Zа-яА-ЯёЁ0-9\s'\-]")
+_SPACES_RE = re.compile(r"\s+")
+
+_TRANSLATE_PREFIXES = ("translate", "переведи", "перевести")
+_TRANSLATE_PREFIX_RE = re.compile(r"^(translate|переведи|перевести)\s*[:,\-]?\s*", re.IGNORECASE)
+_PLEASE_PREFIX_RE = re.compile(r"^\s*please\s*[:,\-]?\s*", re.IGNORECASE)
+
+INTENT_WORD_TRANSLATE = "word_translate"
+INTENT_WORD_LOOKUP = "word_lookup"
+INTENT_FULL_TRANSLATE = "full_translate"
+INTENT_CHAT = "chat"
+
+
+class Intent:
+    """
+    word — слово для словарного режима (или None);
+    translation_request — пользователь просит именно перевод;
+    translate_text — текст после "translate/переведи" в начале сообщения
+    (None, если такого префикса нет; "" — префикс без текста).
+    """
+
+    __slots__ = ("word", "translation_request", "translate_text")
+
+    def __init__(self, word: str | None, translation_request: bool, translate_text: str | None):
+        self.word = word
+        self.translation_request = translation_request
+        self.translate_text = translate_text
+
+    @property
+    def kind(self) -> str:
+        if self.word:
+            return INTENT_WORD_TRANSLATE if self.translation_request else INTENT_WORD_LOOKUP
+        if self.translate_text is not None:
+            return INTENT_FULL_TRANSLATE
+        return INTENT_CHAT
+
+    def __repr__(self):
+        return (
+            f"Intent({self.kind}, word={self.word!r}, "
+            f"translation_request={self.translation_request}, translate_text={self.translate_text!r})"
+        )
+
+
+def _clean_word(match_text: str) -> str | None:
+    word = match_text.strip(" -'\"")
+    return word.lower() if len(word) >= 2 else None
+
+
+def extract_word(user_text: str) -> str | None:
+    """Слово из запроса о значении/переводе (на русском или английском)."""
+    normalized = _NORMALIZE_RE.sub(" ", user_text.strip().lower())
+    normalized = _SPACES_RE.sub(" ", normalized).strip()
+
+    match = _COMBINED_WORD_RE.match(normalized)
+    if not match:
+        return None
+    index = int(match.lastgroup[1:])
+    word = _clean_word(match.group(match.lastgroup))
+    if word:
+        return word
+
+    # Слово короче 2 букв (например "a'") — как и раньше, пробуем следующие шаблоны
+    for regex in _WORD_REGEXES[index + 1:]:
+        match = regex.search(normalized)
+        if match:
+            word = _clean_word(match.group(1))
+            if word:
+                return word
+    return None
+
+
+def is_translation_request(user_text: str) -> bool:
+    """Пользователь просит именно перевод/значение слова."""
+    return _TRANSLATION_RE.search(user_text.strip().lower()) is not None
+
+
+def extract_translate_text(user_text: str) -> str | None:
+    """Текст для полного перевода или None, если сообщение не начинается с translate/переведи."""
+    if not user_text.strip().lower().startswith(_TRANSLATE_PREFIXES):
+        return None
+    text = _TRANSLATE_PREFIX_RE.sub("", user_text.strip()).strip()
+    return _PLEASE_PREFIX_RE.sub("", text).strip()
+
+
+def route(user_text: str) -> Intent:
+    """Разобрать сообщение за один проход по каждому признаку."""
+    return Intent(
+        word=extract_word(user_text),
+        translation_request=is_translation_request(user_text),
+        translate_text=extract_translate_text(user_text),
+    )
@@ -0,0 +1,107 @@
+"""
+Ограничитель запросов к LLM: не больше N одновременных запросов
+и бюджет запросов/токенов в минуту (лимиты бесплатного тарифа Groq).
+Запрос сверх бюджета не падает с 429, а ждёт в очереди, пока окно освободится.
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class _Reservation:
+    """Запись в минутном окне. tokens можно уточнить по usage из ответа."""
+
+    __slots__ = ("at", "tokens")
+
+    def __init__(self, at: float, tokens: int):
+        self.at = at
+        self.tokens = tokens
+
+
+class LLMLimiter:
+    def __init__(self, max_concurrency: int, rpm: int, tpm: int, window: float = 60.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        # Очередь ожидающих: lock держится и во время ожидания, поэтому порядок FIFO
+        self._queue_lock = asyncio.Lock()
+        self._reservations: deque[_Reservation] = deque()
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def _window_tokens(self) -> int:
+        return sum(r.tokens for r in self._reservations)
+
+    def _purge(self, now: float):
+        while self._reservations and now - self._reservations[0].at >= self.window:
+            self._reservations.popleft()
+
+    def _delay(self, tokens: int, now: float) -> float:
+        """Сколько ждать до освобождения бюджета (0 — можно отправлять)."""
+        self._purge(now)
+        if not self._reservations:
+            # Пустое окно пропускает даже запрос больше tpm, иначе он ждал бы вечно
+            return 0.0
+        over_rpm = self.rpm > 0 and len(self._reservations) >= self.rpm
+        over_tpm = self.tpm > 0 and self._window_tokens() + tokens > self.tpm
+        if not (over_rpm or over_tpm):
+            return 0.0
+        return max(self._reservations[0].at + self.window - now, 0.01)
+
+    def would_wait(self, tokens: int) -> bool:
+        """Придётся ли новому запросу ждать (очередь, бюджет или все слоты заняты)."""
+        return (
+            self._queue_lock.locked()
+            or self._semaphore.locked()
+            or self._delay(tokens, time.monotonic()) > 0
+        )
+
+    async def _reserve(self, tokens: int) -> _Reservation:
+        started = time.monotonic()
+        async with self._queue_lock:
+            while True:
+                now = time.monotonic()
+                delay = self._delay(tokens, now)
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            waited = now - started
+            # Короткое ожидание соседей в очереди не считаем
+            if waited >= 0.05:
+                self.waits += 1
+                self.wait_seconds += waited
+                logger.info(f"⏳ LLM-бюджет исчерпан, запрос ждал {waited:.1f} с")
+            reservation = _Reservation(now, tokens)
+            self._reservations.append(reservation)
+            return reservation
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int):
+        """
+        async with limiter.slot(estimate) as reservation:
+            response = await client...
+            reservation.tokens = response.usage.total_tokens
+        """
+        # Сначала слот, потом бюджет: время записи в окне — это время отправки.
+        # Иначе запрос, ждущий слот, попадает в окно раньше, чем уходит, и в
+        # реальные 60 с может уйти больше rpm запросов
+        async with self._semaphore:
+            reservation = await self._reserve(estimated_tokens)
+            yield reservation
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        self._purge(now)
+        return {
+            "requests_in_window": len(self._reservations),
+            "tokens_in_window": self._window_tokens(),
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 2),
+        }
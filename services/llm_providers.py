@@ -0,0 +1,387 @@
+"""
+Провайдеры LLM за общим интерфейсом: Groq (облако) и локальный сервер Ollama.
+У каждого провайдера свой лимитер, повторы с circuit breaker и гистограммы
+задержек. LLMRouter выбирает самого быстрого из здоровых провайдеров,
+а при 429 или открытом breaker переходит к следующему.
+"""
+import json
+import math
+import time
+
+import aiohttp
+from groq import AsyncGroq
+
+from logger import get_logger
+from services.llm_limiter import LLMLimiter
+from services.llm_resilience import (
+    CircuitOpenError,
+    Resilience,
+    parse_retry_after,
+    status_code,
+)
+
+logger = get_logger(__name__)
+
+# Границы корзин гистограммы, мс
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, math.inf)
+# Сколько не трогаем провайдера после 429 без Retry-After
+THROTTLE_DEFAULT_SECONDS = 10.0
+
+
+class LatencyHistogram:
+    """Гистограмма задержек и EWMA (по ней роутер сравнивает провайдеров)."""
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.counts = [0] * len(LATENCY_BUCKETS_MS)
+        self.count = 0
+        self.total = 0.0
+        self.ewma: float | None = None
+
+    def observe(self, seconds: float):
+        ms = seconds * 1000
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if ms <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += seconds
+        self.ewma = seconds if self.ewma is None else self.ewma + self.alpha * (seconds - self.ewma)
+
+    def quantile(self, q: float) -> float | None:
+        """Верхняя граница корзины, в которую попадает квантиль q, мс."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS_MS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000) if self.count else None,
+            "ewma_ms": round(self.ewma * 1000) if self.ewma is not None else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "buckets": {
+                ("inf" if bound == math.inf else str(bound)): n
+                for bound, n in zip(LATENCY_BUCKETS_MS, self.counts)
+            },
+        }
+
+
+class Usage:
+    """Токены из ответа провайдера; cached_tokens — None, если провайдер их не сообщает."""
+
+    __slots__ = ("prompt_tokens", "cached_tokens", "total_tokens")
+
+    def __init__(self, prompt_tokens: int, cached_tokens: int | None, total_tokens: int):
+        self.prompt_tokens = prompt_tokens
+        self.cached_tokens = cached_tokens
+        self.total_tokens = total_tokens
+
+
+class LLMProvider:
+    """
+    Наследник реализует _complete, _open_stream и _iter_stream.
+    sampling: temperature, top_p, max_tokens.
+    """
+
+    name = "llm"
+
+    def __init__(self, limiter: LLMLimiter, resilience: Resilience, prior_latency: float):
+        self.limiter = limiter
+        self.resilience = resilience
+        # Оценка задержки, пока нет ни одного замера
+        self.prior_latency = prior_latency
+        self.throttled_until = 0.0
+        self.latency = LatencyHistogram()
+        self.first_token = LatencyHistogram()
+        self.prompt_tokens = 0
+        # Доля кеша считается только по ответам, где провайдер сообщил cached_tokens
+        self.cache_reported_tokens = 0
+        self.cached_tokens = 0
+
+    async def _complete(self, messages: list[dict], sampling: dict) -> tuple[str, Usage | None]:
+        """(текст ответа, usage или None)."""
+        raise NotImplementedError
+
+    async def _open_stream(self, messages: list[dict], sampling: dict):
+        raise NotImplementedError
+
+    async def _iter_stream(self, handle):
+        """Асинхронный генератор (фрагмент текста, usage или None)."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def expected_latency(self) -> float:
+        return self.latency.ewma if self.latency.ewma is not None else self.prior_latency
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.throttled_until and self.resilience.breaker.available()
+
+    def throttle(self, retry_after: float | None):
+        seconds = retry_after if retry_after is not None else THROTTLE_DEFAULT_SECONDS
+        self.throttled_until = time.monotonic() + seconds
+        logger.warning(f"🚦 LLM {self.name}: 429, провайдер отложен на {seconds:.1f} с")
+
+    def _record_usage(self, usage: Usage, reservation):
+        if usage.total_tokens:
+            reservation.tokens = usage.total_tokens
+        self.prompt_tokens += usage.prompt_tokens
+        if usage.cached_tokens is not None:
+            self.cache_reported_tokens += usage.prompt_tokens
+            self.cached_tokens += usage.cached_tokens
+
+    async def _attempt(self, messages: list[dict], sampling: dict, estimated: int) -> str:
+        # Каждая попытка (в том числе повтор) занимает своё место в бюджете RPM/TPM
+        async with self.limiter.slot(estimated) as reservation:
+            started = time.monotonic()
+            text, usage = await self._complete(messages, sampling)
+            self.latency.observe(time.monotonic() - started)
+            if usage:
+                self._record_usage(usage, reservation)
+        return text
+
+    async def complete(self, messages: list[dict], sampling: dict, estimated: int) -> str:
+        return await self.resilience.call(lambda: self._attempt(messages, sampling, estimated))
+
+    async def stream(self, messages: list[dict], sampling: dict, estimated: int, on_chunk) -> str:
+        """
+        on_chunk(delta) на каждый фрагмент. Повторяется только открытие потока:
+        после первых фрагментов пользователь уже видит текст, и начинать заново нельзя.
+        """
+        chunks = []
+        async with self.limiter.slot(estimated) as reservation:
+            started = time.monotonic()
+            handle = await self.resilience.call(lambda: self._open_stream(messages, sampling))
+            async for delta, usage in self._iter_stream(handle):
+                if usage:
+                    self._record_usage(usage, reservation)
+                if not delta:
+                    continue
+                if not chunks:
+                    self.first_token.observe(time.monotonic() - started)
+                chunks.append(delta)
+                await on_chunk(delta)
+            self.latency.observe(time.monotonic() - started)
+        return "".join(chunks)
+
+    def stats(self) -> dict:
+        return {
+            "healthy": self.is_healthy(time.monotonic()),
+            "latency": self.latency.snapshot(),
+            "first_token": self.first_token.snapshot(),
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cached_ratio": (
+                round(self.cached_tokens / self.cache_reported_tokens, 3)
+                if self.cache_reported_tokens
+                else None
+            ),
+            "limiter": self.limiter.stats(),
+            "resilience": self.resilience.stats(),
+        }
+
+
+def _groq_usage(usage) -> Usage | None:
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return Usage(usage.prompt_tokens, getattr(details, "cached_tokens", None), usage.total_tokens)
+
+
+class GroqProvider(LLMProvider):
+    name = "groq"
+
+    def __init__(self, api_key: str | None, model: str, **kwargs):
+        super().__init__(**kwargs)
+        self.model = model
+        self._api_key = api_key
+        self._client = None
+
+    def _get_client(self) -> AsyncGroq:
+        # Клиент создаётся при первом запросе: без GROQ_API_KEY SDK падает
+        # в конструкторе, а импорт модуля (тесты, prewarm с Ollama) ключа не требует
+        if self._client is None:
+            # Повторы делает Resilience, встроенные повторы SDK отключены
+            self._client = AsyncGroq(api_key=self._api_key, max_retries=0)
+        return self._client
+
+    async def _complete(self, messages, sampling):
+        response = await self._get_client().chat.completions.create(
+            model=self.model, messages=messages, **sampling
+        )
+        return response.choices[0].message.content, _groq_usage(getattr(response, "usage", None))
+
+    async def _open_stream(self, messages, sampling):
+        return await self._get_client().chat.completions.create(
+            model=self.model, messages=messages, stream=True, **sampling
+        )
+
+    async def _iter_stream(self, stream):
+        async for chunk in stream:
+            # Groq присылает usage в x_groq последнего фрагмента
+            usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            yield delta, _groq_usage(usage)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+
+
+class OllamaHTTPError(Exception):
+    """Ответ Ollama не 2xx; status_code и response — как у ошибок SDK Groq."""
+
+    def __init__(self, status: int, body: str, response):
+        super().__init__(f"Ollama HTTP {status}: {body[:200]}")
+        self.status_code = status
+        self.response = response
+
+
+class OllamaProvider(LLMProvider):
+    """Локальный сервер Ollama, POST /api/chat (ответ или поток NDJSON)."""
+
+    name = "ollama"
+
+    def __init__(self, base_url: str, model: str, timeout: float, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    def _payload(self, messages, sampling, stream: bool) -> dict:
+        return {
+            "model": self.model,
+            "messages": messages,
+            "stream": stream,
+            "options": {
+                "temperature": sampling.get("temperature"),
+                "top_p": sampling.get("top_p"),
+                "num_predict": sampling.get("max_tokens"),
+            },
+        }
+
+    @staticmethod
+    def _usage(data: dict) -> Usage | None:
+        # Ollama не сообщает, сколько токенов промпта взято из кеша
+        if "eval_count" not in data:
+            return None
+        prompt_tokens = data.get("prompt_eval_count", 0)
+        return Usage(prompt_tokens, None, prompt_tokens + data["eval_count"])
+
+    async def _post(self, payload: dict):
+        response = await self._get_session().post(f"{self.base_url}/api/chat", json=payload)
+        if response.status >= 400:
+            body = await response.text()
+            response.release()
+            raise OllamaHTTPError(response.status, body, response)
+        return response
+
+    async def _complete(self, messages, sampling):
+        response = await self._post(self._payload(messages, sampling, stream=False))
+        async with response:
+            data = await response.json(content_type=None)
+        return data["message"]["content"], self._usage(data)
+
+    async def _open_stream(self, messages, sampling):
+        return await self._post(self._payload(messages, sampling, stream=True))
+
+    async def _iter_stream(self, response):
+        async with response:
+            async for line in response.content:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(f"Ollama: {data['error']}")
+                yield data.get("message", {}).get("content"), self._usage(data)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class LLMRouter:
+    """
+    Выбор провайдера на каждый запрос: сначала здоровые (не отложены после 429,
+    breaker не открыт), среди них — те, кому не придётся ждать бюджета,
+    затем по EWMA задержки. Остальные — запасные в конце списка.
+    """
+
+    def __init__(self, providers: list[LLMProvider]):
+        self.providers = providers
+        self.fallbacks = 0
+
+    def ordered(self, estimated: int) -> list[LLMProvider]:
+        now = time.monotonic()
+        return sorted(
+            self.providers,
+            key=lambda p: (
+                not p.is_healthy(now),
+                p.limiter.would_wait(estimated),
+                p.expected_latency(),
+            ),
+        )
+
+    def _failed(self, provider: LLMProvider, error: Exception, has_next: bool):
+        if status_code(error) == 429:
+            provider.throttle(parse_retry_after(error))
+        if has_next:
+            self.fallbacks += 1
+            reason = "circuit open" if isinstance(error, CircuitOpenError) else type(error).__name__
+            logger.warning(f"LLM {provider.name} не ответил ({reason}), пробуем следующий провайдер")
+        else:
+            raise error
+
+    async def complete(self, messages: list[dict], sampling: dict, estimated: int) -> str:
+        providers = self.ordered(estimated)
+        for i, provider in enumerate(providers):
+            try:
+                return await provider.complete(messages, sampling, estimated)
+            except Exception as e:
+                self._failed(provider, e, has_next=i + 1 < len(providers))
+
+    async def stream(self, messages: list[dict], sampling: dict, estimated: int, on_chunk) -> str:
+        """Переход к следующему провайдеру — только пока не пришло ни одного фрагмента."""
+        providers = self.ordered(estimated)
+        for i, provider in enumerate(providers):
+            started = False
+
+            async def forward(delta):
+                nonlocal started
+                started = True
+                await on_chunk(delta)
+
+            try:
+                return await provider.stream(messages, sampling, estimated, forward)
+            except Exception as e:
+                self._failed(provider, e, has_next=not started and i + 1 < len(providers))
+
+    async def close(self):
+        for provider in self.providers:
+            try:
+                await provider.close()
+            except Exception as e:
+                logger.warning(f"Не удалось закрыть LLM-провайдера {provider.name}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "fallbacks": self.fallbacks,
+            "providers": {p.name: p.stats() for p in self.providers},
+        }
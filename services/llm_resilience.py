@@ -0,0 +1,231 @@
+"""
+Устойчивость вызовов LLM: повтор временных ошибок с экспоненциальной
+задержкой и jitter, учёт Retry-After и circuit breaker — пока провайдер
+лежит, запросы сразу получают отказ, а не ждут таймаута; раз в
+reset_timeout один пробный запрос (half-open) проверяет, ожил ли он.
+"""
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# Retry-After дольше этого не ждём: пользователь ждёт ответа в чате
+LLM_MAX_RETRY_AFTER = float(os.getenv("LLM_MAX_RETRY_AFTER", "20"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Провайдер считается недоступным, запрос не отправлялся."""
+
+
+def status_code(error: Exception) -> int | None:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def parse_retry_after(error: Exception) -> float | None:
+    """Retry-After из ответа: число секунд или HTTP-дата."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error: Exception) -> tuple[bool, bool]:
+    """
+    (retryable, provider_failure).
+    429 — повторяем, но провайдер не «лежит»; 5xx, таймауты и обрывы соединения —
+    повторяем и считаем отказом провайдера; остальные 4xx — ошибка запроса, не повторяем.
+    """
+    status = status_code(error)
+    if status is not None:
+        if status == 429:
+            return True, False
+        if status == 408 or status >= 500:
+            return True, True
+        return False, False
+    name = type(error).__name__
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError, OSError)) or (
+        "Timeout" in name or "Connection" in name
+    ):
+        return True, True
+    return False, False
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.opened_count = 0
+
+    def available(self) -> bool:
+        """Проверка без побочных эффектов: не открыт (или пора делать пробный запрос)."""
+        if self.state == STATE_OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        return not (self.state == STATE_HALF_OPEN and self._probe_in_flight)
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос. В half-open пропускает ровно один пробный."""
+        if self.state == STATE_CLOSED:
+            return True
+        if self.state == STATE_OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = STATE_HALF_OPEN
+            self._probe_in_flight = False
+            logger.info("🔌 LLM circuit breaker: half-open, пробный запрос")
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        if self.state != STATE_CLOSED:
+            logger.info("🔌 LLM circuit breaker: провайдер снова доступен, closed")
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == STATE_HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._open()
+
+    def release_probe(self):
+        """Пробный запрос завершился без вердикта о провайдере (например, 4xx)."""
+        self._probe_in_flight = False
+
+    def _open(self):
+        if self.state != STATE_OPEN:
+            self.opened_count += 1
+            logger.warning(
+                f"🔌 LLM circuit breaker: open после {self.consecutive_failures} ошибок подряд, "
+                f"пауза {self.reset_timeout:.0f} с"
+            )
+        self.state = STATE_OPEN
+        self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+
+class Resilience:
+    """
+    result = await resilience.call(lambda: client.chat.completions.create(...))
+    Исключение пробрасывается, если ошибка не временная или попытки кончились;
+    CircuitOpenError — если провайдер сейчас считается недоступным.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = LLM_MAX_RETRIES,
+        base_delay: float = LLM_RETRY_BASE_DELAY,
+        max_delay: float = LLM_RETRY_MAX_DELAY,
+        max_retry_after: float = LLM_MAX_RETRY_AFTER,
+        breaker: CircuitBreaker | None = None,
+        retry_rate_limited: bool = True,
+    ):
+        """retry_rate_limited=False — 429 сразу пробрасывается (есть другой провайдер)."""
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.breaker = breaker or CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_RESET)
+        self.retry_rate_limited = retry_rate_limited
+        self.metrics = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "short_circuited": 0,
+        }
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: равномерно от 0 до экспоненциальной границы
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, request):
+        self.metrics["calls"] += 1
+        if not self.breaker.allow():
+            self.metrics["short_circuited"] += 1
+            raise CircuitOpenError("LLM provider circuit is open")
+
+        # Пробный запрос в half-open не повторяем: его задача — только проверить провайдера
+        attempts = 1 if self.breaker.state == STATE_HALF_OPEN else self.max_retries + 1
+        for attempt in range(attempts):
+            try:
+                result = await request()
+            except asyncio.CancelledError:
+                if self.breaker.state == STATE_HALF_OPEN:
+                    self.breaker.release_probe()
+                raise
+            except Exception as e:
+                retryable, provider_failure = classify_error(e)
+                if status_code(e) == 429 and not self.retry_rate_limited:
+                    retryable = False
+                if provider_failure:
+                    self.breaker.record_failure()
+                elif self.breaker.state == STATE_HALF_OPEN:
+                    self.breaker.release_probe()
+                if status_code(e) == 429:
+                    self.metrics["rate_limited"] += 1
+
+                retry_after = parse_retry_after(e)
+                last_attempt = attempt + 1 >= attempts
+                if (
+                    not retryable
+                    or last_attempt
+                    or self.breaker.state == STATE_OPEN
+                    or (retry_after is not None and retry_after > self.max_retry_after)
+                ):
+                    self.metrics["failures"] += 1
+                    raise
+
+                delay = retry_after if retry_after is not None else self._backoff(attempt)
+                self.metrics["retries"] += 1
+                logger.warning(
+                    f"LLM: временная ошибка ({type(e).__name__}, status={status_code(e)}), "
+                    f"повтор {attempt + 1}/{attempts - 1} через {delay:.2f} с"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            self.metrics["successes"] += 1
+            return result
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics,
+            "breaker_state": self.breaker.state,
+            "breaker_opened": self.breaker.opened_count,
+            "consecutive_failures": self.breaker.consecutive_failures,
+        }
@@ -0,0 +1,95 @@
+"""
+Фоновое обслуживание базы данных.
+Раз в час переносит старую историю диалогов в сжатый архив
+(LLM всё равно видит только последние несколько реплик),
+делает checkpoint WAL и время от времени VACUUM,
+сверяет счётчики /stats с реальными таблицами
+чистит устаревшие записи словарного кеша и пишет в лог метрики LLM.
+"""
+import asyncio
+import os
+
+from async_db import (
+    get_users_with_history_over,
+    archive_conversation_batch,
+    checkpoint_wal,
+    vacuum_db,
+    reconcile_stats,
+)
+from logger import get_logger
+from services import dictionary_cache
+from services.ollama_service import get_llm_stats
+from services.summary_service import summary_stats
+
+logger = get_logger(__name__)
+
+# Сколько последних сообщений на пользователя оставляем в conversation_history
+HISTORY_KEEP_LAST = max(1, int(os.getenv("HISTORY_KEEP_LAST", "50")))
+# Размер пачки переноса: одна пачка = одна короткая транзакция писателя
+HISTORY_ARCHIVE_BATCH = int(os.getenv("HISTORY_ARCHIVE_BATCH", "500"))
+# Пауза между пачками, чтобы запросы пользователей успевали к писателю
+HISTORY_ARCHIVE_PAUSE = 0.1
+MAINTENANCE_INTERVAL = int(os.getenv("MAINTENANCE_INTERVAL", "3600"))
+# VACUUM пересобирает весь файл, поэтому делаем его редко (раз в N циклов)
+VACUUM_EVERY_RUNS = int(os.getenv("VACUUM_EVERY_RUNS", "24"))
+
+
+async def compact_history() -> int:
+    """Перенести в архив всё, кроме последних HISTORY_KEEP_LAST сообщений."""
+    archived = 0
+    for user_id in await get_users_with_history_over(HISTORY_KEEP_LAST):
+        while True:
+            moved = await archive_conversation_batch(
+                user_id, HISTORY_KEEP_LAST, HISTORY_ARCHIVE_BATCH
+            )
+            archived += moved
+            if moved < HISTORY_ARCHIVE_BATCH:
+                break
+            await asyncio.sleep(HISTORY_ARCHIVE_PAUSE)
+        await asyncio.sleep(HISTORY_ARCHIVE_PAUSE)
+
+    if archived > 0:
+        logger.info(f"🗄 Перенесено в архив {archived} старых сообщений истории")
+    return archived
+
+
+async def check_stats() -> dict:
+    """Сверить счётчики stats_counters с таблицами и исправить расхождения."""
+    drift = await reconcile_stats()
+    if drift:
+        details = ", ".join(
+            f"{name}: {stored} → {actual}" for name, (stored, actual) in sorted(drift.items())
+        )
+        logger.warning(f"📊 Счётчики статистики разошлись с таблицами, исправлено: {details}")
+    return drift
+
+
+async def purge_dictionary_cache() -> int:
+    """Удалить просроченные и устаревшие (старый промпт) записи словарного кеша."""
+    removed = await dictionary_cache.purge()
+    logger.info(f"📚 Словарный кеш: удалено {removed} записей, метрики {dictionary_cache.stats()}")
+    return removed
+
+
+def log_llm_stats():
+    logger.info(f"🤖 LLM: {get_llm_stats()}, summary: {summary_stats}")
+
+
+async def maintenance_loop():
+    """Фоновый цикл — compaction истории и сверка статистики каждый MAINTENANCE_INTERVAL секунд."""
+    logger.info("🧹 Сервис обслуживания БД запущен")
+    runs = 0
+    while True:
+        try:
+            await compact_history()
+            await check_stats()
+            await purge_dictionary_cache()
+            log_llm_stats()
+            await checkpoint_wal()
+            runs += 1
+            if VACUUM_EVERY_RUNS > 0 and runs % VACUUM_EVERY_RUNS == 0:
+                await vacuum_db()
+                logger.info("🧹 VACUUM базы данных выполнен")
+        except Exception as e:
+            logger.error(f"Ошибка в maintenance_loop: {e}")
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
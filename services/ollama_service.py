@@ -1,17 +1,59 @@
+import asyncio
 import requests
 import re
 import json
 import os
+import time
 from datetime import datetime
-from difflib import get_close_matches, SequenceMatcher
+from difflib import SequenceMatcher
 from logger import get_logger
-from groq import Groq
+from services.llm_limiter import LLMLimiter
+from services.llm_resilience import CircuitOpenError, Resilience
+from services.llm_providers import GroqProvider, LLMRouter, OllamaProvider
+from services import dictionary_cache, intent_router
+from services.prompt_budget import count_tokens, pack_history, prompt_metrics
+from services.fuzzy_index import FuzzyIndex
 
 logger = get_logger(__name__)
 
-# Groq client initialization (FREE!)
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-MODEL_NAME = "llama-3.1-8b-instant"  # Быстрая бесплатная модель
+# Groq — основной провайдер (бесплатный тариф)
+MODEL_NAME = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")  # Быстрая бесплатная модель
+MAX_TOKENS = 350
+SAMPLING = {"temperature": 0.5, "top_p": 0.9, "max_tokens": MAX_TOKENS}
+
+# Локальный Ollama включается, только если задан OLLAMA_BASE_URL
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "").strip()
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1:8b")
+
+groq_provider = GroqProvider(
+    api_key=os.getenv("GROQ_API_KEY"),
+    model=MODEL_NAME,
+    # Лимиты бесплатного тарифа Groq для llama-3.1-8b-instant: 30 RPM, 6000 TPM
+    limiter=LLMLimiter(
+        max_concurrency=int(os.getenv("GROQ_MAX_CONCURRENCY", "4")),
+        rpm=int(os.getenv("GROQ_RPM_LIMIT", "30")),
+        tpm=int(os.getenv("GROQ_TPM_LIMIT", "6000")),
+    ),
+    # Есть запасной провайдер — на 429 не ждём Groq, а сразу уходим к нему
+    resilience=Resilience(retry_rate_limited=not OLLAMA_BASE_URL),
+    prior_latency=1.0,
+)
+llm_providers = [groq_provider]
+if OLLAMA_BASE_URL:
+    llm_providers.append(
+        OllamaProvider(
+            base_url=OLLAMA_BASE_URL,
+            model=OLLAMA_MODEL,
+            timeout=float(os.getenv("OLLAMA_TIMEOUT", "60")),
+            # Локальный сервер: лимитов RPM/TPM нет, только число одновременных запросов
+            limiter=LLMLimiter(
+                max_concurrency=int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2")), rpm=0, tpm=0
+            ),
+            resilience=Resilience(),
+            prior_latency=5.0,
+        )
+    )
+llm_router = LLMRouter(llm_providers)
 
 COMMON_WORDS = {
     # === БАЗОВЫЕ СЛОВА ===
@@ -859,136 +901,293 @@ Animal - животное
 - Output ONLY the JSON object. No extra text, no markdown, no ```json.
 """
 
+LEVEL_STYLE = {
+    "A1": "Use very simple words. Short sentences. Ask easy questions. Avoid complex grammar terms.",
+    "A2": "Use simple everyday English. Short explanations. One simple follow-up question.",
+    "B1": "Use natural English. Give brief corrections. Ask open-ended questions sometimes.",
+    "B2": "Use natural fluent English. Correct subtle mistakes. Ask deeper questions.",
+}
+
+# Провайдер кеширует совпадающее начало промпта, поэтому неизменная часть
+# (одинаковая байт в байт для всех) идёт первой, а уровень и дата — в конце
+CHAT_SYSTEM_PREFIX = (
+    SYSTEM_PROMPT
+    + """CORRECTION TASK: The student's latest message is shown after "Student (NOW):". If it has grammar errors, put the SAME sentence with fixes into "correction". Do NOT use words or sentences from conversation history in "correction"!"""
+)
+
+
+def _level_system_prompt(level: str) -> str:
+    style = LEVEL_STYLE.get(level, LEVEL_STYLE["A1"])
+    return f"{CHAT_SYSTEM_PREFIX}\nStudent level: {level}\nTeaching style: {style}"
+
+
+# Собираются один раз при импорте, а не f-строкой на каждое сообщение
+CHAT_SYSTEM_PROMPTS = {level: _level_system_prompt(level) for level in LEVEL_STYLE}
+
+
+# --- Промпты словарного режима (ответы кешируются, см. services/dictionary_cache.py) ---
+TRANSLATE_WORD_PROMPT = """You are a bilingual EN-RU dictionary.
+Translate the English word "{word}" into Russian.
+
+Rules:
+1) Return EXACTLY 2 lines.
+2) Line 1 format: {word} - <one most common Russian translation>
+3) Line 2 format: Пример: <short English example> - <Russian translation>
+4) No JSON, no extra notes, no questions.
+"""
+
+EXPLAIN_WORD_PROMPT_BEGINNER = """You are teaching English to A1-A2 beginner students.
+Explain the word "{word}" in VERY SIMPLE English.
+
+Rules:
+1. First line: ONE SHORT sentence (5-8 words) explaining the meaning
+2. Second line: Word - Russian translation (ONLY ONE main translation)
+3. Third line: Пример with translation
+
+Example format:
+Not the same.
+Different - другой, различный
+Пример: This pen is different. - Эта ручка другая.
+
+Now explain "{word}"."""
+
+EXPLAIN_WORD_PROMPT = """You are teaching English to {level} students.
+Explain the word "{word}".
+
+Rules:
+1. First line: Clear short explanation
+2. Second line: Word - Russian translation
+3. Third line: Пример with translation
+
+Example format:
+Not the same as something else.
+Different - другой, различный, отличающийся
+Пример: Everyone is different in their own way. - Каждый по-своему уникален.
+
+Now explain "{word}"."""
+
+STRICT_EXPLAIN_WORD_PROMPT = """You are a bilingual EN-RU dictionary.
+Explain the English word "{word}".
+
+Return EXACTLY 3 lines:
+1) Short English meaning (max 10 words)
+2) {word} - <Russian translation>
+3) Пример: <short English sentence> - <Russian translation>
+
+No extra text, no questions.
+"""
+
+# Смена модели или текста промпта меняет hash — старые записи кеша перестают отдаваться
+dictionary_cache.register_prompt(
+    dictionary_cache.MODE_TRANSLATE, MODEL_NAME, TRANSLATE_WORD_PROMPT
+)
+dictionary_cache.register_prompt(
+    dictionary_cache.MODE_EXPLAIN,
+    MODEL_NAME,
+    EXPLAIN_WORD_PROMPT_BEGINNER,
+    EXPLAIN_WORD_PROMPT,
+    STRICT_EXPLAIN_WORD_PROMPT,
+)
+
+_CYRILLIC_RE = re.compile(r"[А-Яа-яЁё]")
+
+
+# Вопрос о значении ОДНОГО слова: шаблоны взаимоисключающие (якоря ^...$),
+# поэтому объединены в одно выражение
+_SUGGEST_WORD_RE = re.compile(
+    r"^\s*(?:what\s+does\s+(\w+)\s+mean|what\s+is\s+(\w+)|meaning\s+of\s+(\w+)|translate\s+(\w+))\s*\??\s*$"
+)
+
+# Индекс для подсказок "Did you mean": строится один раз, поиск не перебирает весь словарь
+COMMON_WORDS_INDEX = FuzzyIndex(COMMON_WORDS)
+
+# базовые слова НЕ трогаем вообще
+_SUGGEST_STOP_WORDS = frozenset(
+    {"your", "it", "please", "i", "you", "we", "they", "he", "she", "a", "an", "the", "to", "of", "in", "on"}
+)
+
 
 def check_word_and_suggest(user_text: str):
     """Подсказки ТОЛЬКО если пользователь явно спрашивает значение ОДНОГО слова"""
-    patterns = [
-        r"^\s*what\s+does\s+(\w+)\s+mean\s*\??\s*$",
-        r"^\s*what\s+is\s+(\w+)\s*\??\s*$",
-        r"^\s*meaning\s+of\s+(\w+)\s*\??\s*$",
-        r"^\s*translate\s+(\w+)\s*\??\s*$",
-    ]
-
-    for pattern in patterns:
-        match = re.search(pattern, user_text.lower())
-        if match:
-            word = match.group(1).lower()
-
-            # базовые слова НЕ трогаем вообще
-            STOP_WORDS = {
-                "your",
-                "it",
-                "please",
-                "i",
-                "you",
-                "we",
-                "they",
-                "he",
-                "she",
-                "a",
-                "an",
-                "the",
-                "to",
-                "of",
-                "in",
-                "on",
-            }
-            if word in STOP_WORDS:
-                return None
+    match = _SUGGEST_WORD_RE.search(user_text.lower())
+    if not match:
+        return None
+
+    word = next(g for g in match.groups() if g is not None).lower()
+    if word in _SUGGEST_STOP_WORDS:
+        return None
 
-            if word not in COMMON_WORDS:
-                suggestions = get_close_matches(word, COMMON_WORDS, n=3, cutoff=0.6)
-                if suggestions:
-                    return (
-                        f"I’m not sure about '{word}'. Did you mean: {', '.join(suggestions)}?\n"
-                        f"Reply with the correct one."
-                    )
+    if word not in COMMON_WORDS:
+        suggestions = COMMON_WORDS_INDEX.suggest(word, n=3, cutoff=0.6)
+        if suggestions:
+            return (
+                f"I’m not sure about '{word}'. Did you mean: {', '.join(suggestions)}?\n"
+                f"Reply with the correct one."
+            )
 
     return None
 
 
-def call_ollama_raw(prompt: str, system_prompt: str = None) -> str:
-    """Вызов Groq API (бесплатный Llama 3.1)"""
+LLM_ERROR_REPLY = (
+    "⚠️ Извините, сейчас технические неполадки с ИИ.\n"
+    "Попробуйте отправить сообщение через минуту."
+)
+
+
+def _build_messages(prompt: str, system_prompt: str = None) -> list[dict]:
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+def _clean_llm_output(bot_response: str) -> str:
+    bot_response = bot_response.strip()
+
+    # чистим мусор
+    bot_response = re.sub(r"\(Note:.*?\)", "", bot_response, flags=re.DOTALL)
+    bot_response = re.sub(
+        r"\(I corrected.*?\)", "", bot_response, flags=re.DOTALL
+    )
+    bot_response = bot_response.strip()
+
+    # если вдруг модель вернула пустые поля перевода — убираем блок
+    if "Perevod: None" in bot_response or "Primer: None" in bot_response:
+        if "---" in bot_response:
+            bot_response = bot_response.split("---")[0].strip()
+
+    return bot_response
+
+
+# Single-flight: одинаковые запросы, пришедшие одновременно, делят один вызов Groq
+_inflight: dict[tuple, asyncio.Task] = {}
+coalesce_stats = {"upstream": 0, "coalesced": 0}
+
+
+async def call_ollama_raw(prompt: str, system_prompt: str = None) -> str:
+    """
+    Вызов LLM через роутер провайдеров (Groq, при 429 или сбое — локальный Ollama).
+    Если такой же запрос (промпты, параметры) уже выполняется,
+    ждём его результат вместо второго вызова.
+    """
+    key = (MAX_TOKENS, system_prompt, prompt)
+    task = _inflight.get(key)
+    if task is None:
+        coalesce_stats["upstream"] += 1
+        task = asyncio.ensure_future(_call_ollama_upstream(prompt, system_prompt))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        coalesce_stats["coalesced"] += 1
+    # shield: отмена одного из ожидающих не отменяет общий запрос для остальных
+    return await asyncio.shield(task)
+
+
+def get_llm_stats() -> dict:
+    total = coalesce_stats["upstream"] + coalesce_stats["coalesced"]
+    return {
+        **coalesce_stats,
+        "coalesce_ratio": round(coalesce_stats["coalesced"] / total, 3) if total else 0.0,
+        "in_flight": len(_inflight),
+        **llm_router.stats(),
+        "prompt": prompt_metrics.stats(),
+    }
+
+
+def _estimate_request(prompt: str, system_prompt: str = None) -> int:
+    # В бюджет TPM входят и prompt, и ответ — резервируем по максимуму,
+    # после ответа уточняем по usage
+    return count_tokens(prompt) + count_tokens(system_prompt or "") + MAX_TOKENS
+
+
+async def _call_ollama_upstream(prompt: str, system_prompt: str = None) -> str:
     try:
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        messages.append({"role": "user", "content": prompt})
-
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=messages,
-            temperature=0.5,
-            top_p=0.9,
-            max_tokens=350,
+        messages = _build_messages(prompt, system_prompt)
+        response = await llm_router.complete(
+            messages, SAMPLING, _estimate_request(prompt, system_prompt)
         )
+        return _clean_llm_output(response)
 
-        bot_response = response.choices[0].message.content.strip()
+    except CircuitOpenError:
+        logger.warning("LLM недоступен (circuit breaker open), запрос не отправлен")
+        return LLM_ERROR_REPLY
+    except Exception as e:
+        logger.error(f"Error calling LLM: {e}", exc_info=True)
+        return LLM_ERROR_REPLY
 
-        # чистим мусор
-        bot_response = re.sub(r"\(Note:.*?\)", "", bot_response, flags=re.DOTALL)
-        bot_response = re.sub(
-            r"\(I corrected.*?\)", "", bot_response, flags=re.DOTALL
-        )
-        bot_response = bot_response.strip()
 
-        # если вдруг модель вернула пустые поля перевода — убираем блок
-        if "Perevod: None" in bot_response or "Primer: None" in bot_response:
-            if "---" in bot_response:
-                bot_response = bot_response.split("---")[0].strip()
+async def stream_ollama_raw(prompt: str, system_prompt: str = None, on_text=None) -> str:
+    """
+    То же, что call_ollama_raw, но потоком: on_text(text_so_far)
+    вызывается на каждый пришедший фрагмент. Возвращает полный очищенный ответ.
+    """
+    try:
+        messages = _build_messages(prompt, system_prompt)
+        chunks = []
 
-        return bot_response
+        async def on_chunk(delta: str):
+            chunks.append(delta)
+            if on_text:
+                await on_text("".join(chunks))
 
-    except Exception as e:
-        logger.error(f"Error calling Groq API: {e}", exc_info=True)
-        return (
-            "⚠️ Извините, сейчас технические неполадки с ИИ.\n"
-            "Попробуйте отправить сообщение через минуту."
+        response = await llm_router.stream(
+            messages, SAMPLING, _estimate_request(prompt, system_prompt), on_chunk
         )
+        return _clean_llm_output(response)
+
+    except CircuitOpenError:
+        logger.warning("LLM недоступен (circuit breaker open), запрос не отправлен")
+        return LLM_ERROR_REPLY
+    except Exception as e:
+        logger.error(f"Error streaming from LLM: {e}", exc_info=True)
+        return LLM_ERROR_REPLY
+
+
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+def partial_json_string(raw: str, key: str) -> str | None:
+    """
+    Значение строкового поля key из ещё не законченного JSON.
+    Незакрытая строка возвращается как есть (без оборванного escape в конце).
+    """
+    match = re.search(r'"%s"\s*:\s*"' % re.escape(key), raw)
+    if not match:
+        return None
+    out = []
+    i = match.end()
+    n = len(raw)
+    while i < n:
+        ch = raw[i]
+        if ch == '"':
+            break
+        if ch != "\\":
+            out.append(ch)
+            i += 1
+            continue
+        if i + 1 >= n:
+            break
+        esc = raw[i + 1]
+        if esc == "u":
+            if i + 6 > n:
+                break
+            try:
+                out.append(chr(int(raw[i + 2:i + 6], 16)))
+            except ValueError:
+                pass
+            i += 6
+            continue
+        out.append(_JSON_ESCAPES.get(esc, esc))
+        i += 2
+    # \uXXXX могут быть суррогатными парами (эмодзи) — склеиваем,
+    # а оборванную в конце половину пары отбрасываем
+    return "".join(out).encode("utf-16-le", "surrogatepass").decode("utf-16-le", "ignore")
 
 
 def extract_word_from_query(user_text: str):
     """Извлекает слово из запроса о значении (на русском или английском)"""
-    lower = user_text.strip().lower()
-    normalized = re.sub(r"[^a-zA-Zа-яА-ЯёЁ0-9\s'\-]", " ", lower)
-    normalized = re.sub(r"\s+", " ", normalized).strip()
-
-    word_re = r"([a-zA-Zа-яА-ЯёЁ][a-zA-Zа-яА-ЯёЁ'\-]{0,30})"
-
-    patterns = [
-        # English intents (в т.ч. длинные фразы с вводными словами)
-        rf"\bwhat\s+does\s+{word_re}\s+mean\b",
-        rf"\bwhat\s+is\s+the\s+meaning\s+of\s+{word_re}\b",
-        rf"\bmeaning\s+of\s+{word_re}\b",
-        rf"\btranslation\s+of\s+(?:the\s+)?(?:word\s+)?{word_re}\b",
-        rf"\brussian\s+translation\s+of\s+(?:the\s+)?(?:word\s+)?{word_re}\b",
-        rf"\btranslate\s+(?:please\s+)?(?:the\s+)?(?:word\s+)?{word_re}\b",
-        rf"\bwhat\s+is\s+mean\s+by\s+{word_re}\b",
-        rf"\bwhat\s+is\s+mean\s+in\s+{word_re}\b",   # ASR typo
-        rf"\bwhat\s+is\s+mean\s+{word_re}\b",        # ASR typo: "what is mean table"
-        rf"\bwhat's\s+{word_re}\b",
-        # Russian intents
-        rf"\bчто\s+значит\s+{word_re}\b",
-        rf"\bчто\s+такое\s+{word_re}\b",
-        rf"\bчто\s+означает\s+{word_re}\b",
-        rf"\bзначение\s+{word_re}\b",
-        rf"\bперевод\s+{word_re}\b",
-        rf"\bпереведи\s+(?:слово\s+)?(?:пожалуйста\s+)?{word_re}\b",
-        rf"\bкак\s+переводится\s+{word_re}\b",
-        rf"\bкак\s+будет\s+{word_re}\b",
-        rf"\bкак\s+(?:по-английски|по\s+английски)\s+{word_re}\b",
-        rf"\b{word_re}\s*-\s*это\s+что\b",
-        rf"\b{word_re}\s*-\s*что\s+это\b",
-    ]
-
-    for pattern in patterns:
-        match = re.search(pattern, normalized, flags=re.IGNORECASE)
-        if match:
-            word = match.group(1).strip(" -'\"")
-            if len(word) >= 2:
-                return word.lower()
-
-    return None
+    return intent_router.extract_word(user_text)
 
 
 def _normalize_en_token(value: str) -> str:
@@ -1004,11 +1203,9 @@ def _token_skeleton(value: str) -> str:
     return head + tail
 
 
-def _extract_noisy_target_phrase(user_text: str) -> str:
-    text = re.sub(r"[^a-zA-Zа-яА-ЯёЁ0-9\s']", " ", user_text.lower())
-    text = re.sub(r"\s+", " ", text).strip()
-
-    tail_patterns = [
+_NOISY_TAIL_PATTERNS = [
+    re.compile(p)
+    for p in (
         r"(?:what\s+does)\s+(.+?)\s+mean",
         r"(?:what\s+is\s+the\s+meaning\s+of)\s+(.+)$",
         r"(?:what\s+is\s+mean(?:\s+by|\s+in)?)\s+(.+)$",
@@ -1016,21 +1213,33 @@ def _extract_noisy_target_phrase(user_text: str) -> str:
         r"(?:translation\s+of(?:\s+the)?(?:\s+word)?)\s+(.+)$",
         r"(?:translate(?:\s+please)?(?:\s+the)?(?:\s+word)?)\s+(.+)$",
         r"(?:что\s+значит|что\s+означает|перевод|переведи(?:\s+слово)?|как\s+переводится)\s+(.+)$",
-    ]
+    )
+]
+_NOISY_FILLER_RE = re.compile(
+    r"\b(and|it|is|the|a|an|word|please|me|to|know|now|tell|about|just|i|want|no)\b"
+)
+
+
+def _extract_noisy_target_phrase(user_text: str) -> str:
+    text = re.sub(r"[^a-zA-Zа-яА-ЯёЁ0-9\s']", " ", user_text.lower())
+    text = re.sub(r"\s+", " ", text).strip()
 
-    for pattern in tail_patterns:
-        m = re.search(pattern, text)
+    for pattern in _NOISY_TAIL_PATTERNS:
+        m = pattern.search(text)
         if not m:
             continue
         tail = m.group(1).strip()
         tail = tail.split("?")[0].strip()
-        tail = re.sub(r"\b(and|it|is|the|a|an|word|please|me|to|know|now|tell|about|just|i|want|no)\b", " ", tail)
+        tail = _NOISY_FILLER_RE.sub(" ", tail)
         tail = re.sub(r"\s+", " ", tail).strip()
         if tail:
             return tail
     return ""
 
 
+_CANDIDATE_WORD_RE = re.compile(r"[a-zA-Z][a-zA-Z'-]{2,30}")
+
+
 def infer_word_from_recent_context(user_text: str, history: list) -> str | None:
     """Пытается восстановить слово из недавнего контекста, если STT исказил его."""
     if not history:
@@ -1040,11 +1249,12 @@ def infer_word_from_recent_context(user_text: str, history: list) -> str | None:
     if not noisy_phrase:
         return None
 
-    noisy_tokens = [
-        _normalize_en_token(t)
-        for t in noisy_phrase.split()
-        if _normalize_en_token(t) and len(_normalize_en_token(t)) >= 3
-    ]
+    # Нормализуем один раз; повтор токена не может дать строго лучший score
+    noisy_tokens = list(
+        dict.fromkeys(
+            token for token in map(_normalize_en_token, noisy_phrase.split()) if len(token) >= 3
+        )
+    )
     if not noisy_tokens:
         return None
 
@@ -1052,7 +1262,7 @@ def infer_word_from_recent_context(user_text: str, history: list) -> str | None:
     assistant_text = " ".join(
         content for role, content in history[-6:] if role == "assistant" and isinstance(content, str)
     )
-    candidates = re.findall(r"[a-zA-Z][a-zA-Z'-]{2,30}", assistant_text.lower())
+    candidates = _CANDIDATE_WORD_RE.findall(assistant_text.lower())
     stop = {
         "what", "your", "have", "with", "this", "that", "from", "into", "about",
         "would", "could", "should", "there", "their", "them", "they", "you",
@@ -1062,18 +1272,46 @@ def infer_word_from_recent_context(user_text: str, history: list) -> str | None:
     if not candidates:
         return None
 
+    # Каждый кандидат нормализуется один раз; дубликаты убираем с сохранением
+    # порядка (при равном score выигрывает первый — как и раньше).
+    # SequenceMatcher держит кандидата как seq2: его индекс символов строится один раз
+    scorers = []
+    for cand_n in dict.fromkeys(map(_normalize_en_token, candidates)):
+        if len(cand_n) < 3:
+            continue
+        cand_sk = _token_skeleton(cand_n)
+        scorers.append(
+            (
+                cand_n,
+                len(cand_n),
+                len(cand_sk),
+                SequenceMatcher(None, "", cand_n),
+                SequenceMatcher(None, "", cand_sk),
+            )
+        )
+
     best_word = None
     best_score = 0.0
 
     for noisy in noisy_tokens:
         noisy_sk = _token_skeleton(noisy)
-        for cand in candidates:
-            cand_n = _normalize_en_token(cand)
-            if len(cand_n) < 3:
+        len_raw, len_skel = len(noisy), len(noisy_sk)
+        for cand_n, cand_len, cand_sk_len, raw_matcher, skel_matcher in scorers:
+            # ratio = 2*M/(la+lb) <= 2*min(la, lb)/(la+lb): если даже эта граница
+            # не лучше текущего результата (или ниже порога) — кандидат не победит
+            bound = max(
+                2 * min(len_raw, cand_len) / (len_raw + cand_len),
+                2 * min(len_skel, cand_sk_len) / (len_skel + cand_sk_len),
+            )
+            if bound <= best_score or bound < 0.60:
                 continue
-            score_raw = SequenceMatcher(None, noisy, cand_n).ratio()
-            score_skel = SequenceMatcher(None, noisy_sk, _token_skeleton(cand_n)).ratio()
-            score = max(score_raw, score_skel)
+            raw_matcher.set_seq1(noisy)
+            skel_matcher.set_seq1(noisy_sk)
+            # quick_ratio (общие символы без учёта порядка) — тоже верхняя граница ratio
+            bound = max(raw_matcher.quick_ratio(), skel_matcher.quick_ratio())
+            if bound <= best_score or bound < 0.60:
+                continue
+            score = max(raw_matcher.ratio(), skel_matcher.ratio())
             if score > best_score:
                 best_score = score
                 best_word = cand_n
@@ -1086,123 +1324,84 @@ def infer_word_from_recent_context(user_text: str, history: list) -> str | None:
 
 def is_word_translation_request(user_text: str) -> bool:
     """Определяет, что пользователь просит именно перевод слова."""
-    text = user_text.strip().lower()
-    patterns = [
-        r"\btranslation\b",
-        r"\btranslate\b",
-        r"\bmeaning\b",
-        r"\bmean\b",
-        r"\bперевод\b",
-        r"\bпереведи\b",
-        r"\bперевести\b",
-        r"\bчто\s+значит\b",
-        r"\bчто\s+означает\b",
-        r"\bкак\s+переводится\b",
-    ]
-    return any(re.search(p, text) for p in patterns)
+    return intent_router.is_translation_request(user_text)
+
+
+def dictionary_cache_level(mode: str, level: str) -> str:
+    """Уровень в ключе кеша: перевод от уровня не зависит, A1 и A2 делят один промпт."""
+    if mode == dictionary_cache.MODE_TRANSLATE:
+        return ""
+    return "A1-A2" if level in ["A1", "A2"] else level
+
+
+def is_cacheable_dictionary_entry(text: str) -> bool:
+    # В кеш — только нормальный словарный ответ (не ошибку API и не ответ без перевода)
+    return text != LLM_ERROR_REPLY and bool(_CYRILLIC_RE.search(text))
+
 
+async def generate_dictionary_entry(word: str, mode: str, level: str = "A1") -> str:
+    """Словарный ответ от LLM без кеша (перевод или объяснение слова)."""
+    if mode == dictionary_cache.MODE_TRANSLATE:
+        translate_word_prompt = TRANSLATE_WORD_PROMPT.format(word=word)
+        return (await call_ollama_raw(translate_word_prompt)).strip()
 
-def get_ollama_response(user_text: str, history: list = None, level: str = "A1"):
-    """Получить структурированный ответ от Ollama в виде dict"""
-    lower = user_text.strip().lower()
+    # Специальный промпт для объяснения значения слова
+    if level in ["A1", "A2"]:
+        explain_prompt = EXPLAIN_WORD_PROMPT_BEGINNER.format(word=word)
+    else:
+        explain_prompt = EXPLAIN_WORD_PROMPT.format(word=word, level=level)
+
+    raw_explanation = await call_ollama_raw(explain_prompt)
+
+    # Гарантия RU-перевода: если модель ответила только на английском,
+    # повторяем запрос в более строгом словарном формате.
+    if not _CYRILLIC_RE.search(raw_explanation):
+        strict_prompt = STRICT_EXPLAIN_WORD_PROMPT.format(word=word)
+        raw_explanation = (await call_ollama_raw(strict_prompt)).strip()
+    return raw_explanation
+
+
+async def get_ollama_response(
+    user_text: str, history: list = None, level: str = "A1", on_partial=None, summary: str = None
+):
+    """
+    Получить структурированный ответ от Ollama в виде dict.
+    on_partial — корутина, в режиме разговора получает растущий текст "reply"
+    по мере генерации (streaming); итоговый dict возвращается как обычно.
+    summary — краткое содержание более раннего диалога (summary_service).
+    """
+    # Все регулярные выражения по сообщению — один раз, в intent_router
+    intent = intent_router.route(user_text)
 
     # --- WORD MEANING / WORD TRANSLATION MODE (приоритет!) ---
-    word_to_explain = extract_word_from_query(user_text)
-    if not word_to_explain and is_word_translation_request(user_text):
+    word_to_explain = intent.word
+    if not word_to_explain and intent.translation_request:
         word_to_explain = infer_word_from_recent_context(user_text, history or [])
     if word_to_explain:
         # Если пользователь явно просит перевод слова — даём перевод без лишней болтовни.
-        if is_word_translation_request(user_text):
-            translate_word_prompt = f"""You are a bilingual EN-RU dictionary.
-Translate the English word "{word_to_explain}" into Russian.
-
-Rules:
-1) Return EXACTLY 2 lines.
-2) Line 1 format: {word_to_explain} - <one most common Russian translation>
-3) Line 2 format: Пример: <short English example> - <Russian translation>
-4) No JSON, no extra notes, no questions.
-"""
-            raw_translation = call_ollama_raw(translate_word_prompt).strip()
-            return {
-                "reply": raw_translation,
-                "question": None,
-                "quick_replies": [],
-                "correction": None,
-                "tip": None,
-            }
-
-        # Специальный промпт для объяснения значения слова
-        if level in ["A1", "A2"]:
-            explain_prompt = f"""You are teaching English to A1-A2 beginner students.
-Explain the word "{word_to_explain}" in VERY SIMPLE English.
-
-Rules:
-1. First line: ONE SHORT sentence (5-8 words) explaining the meaning
-2. Second line: Word - Russian translation (ONLY ONE main translation)
-3. Third line: Пример with translation
-
-Example format:
-Not the same.
-Different - другой, различный
-Пример: This pen is different. - Эта ручка другая.
-
-Now explain "{word_to_explain}"."""
+        if intent.translation_request:
+            mode = dictionary_cache.MODE_TRANSLATE
         else:
-            explain_prompt = f"""You are teaching English to {level} students.
-Explain the word "{word_to_explain}".
-
-Rules:
-1. First line: Clear short explanation
-2. Second line: Word - Russian translation
-3. Third line: Пример with translation
-
-Example format:
-Not the same as something else.
-Different - другой, различный, отличающийся
-Пример: Everyone is different in their own way. - Каждый по-своему уникален.
-
-Now explain "{word_to_explain}"."""
-
-        raw_explanation = call_ollama_raw(explain_prompt)
-
-        # Гарантия RU-перевода: если модель ответила только на английском,
-        # повторяем запрос в более строгом словарном формате.
-        if not re.search(r"[А-Яа-яЁё]", raw_explanation):
-            strict_prompt = f"""You are a bilingual EN-RU dictionary.
-Explain the English word "{word_to_explain}".
+            mode = dictionary_cache.MODE_EXPLAIN
+        cache_level = dictionary_cache_level(mode, level)
 
-Return EXACTLY 3 lines:
-1) Short English meaning (max 10 words)
-2) {word_to_explain} - <Russian translation>
-3) Пример: <short English sentence> - <Russian translation>
-
-No extra text, no questions.
-"""
-            raw_explanation = call_ollama_raw(strict_prompt).strip()
+        raw_explanation = await dictionary_cache.get(word_to_explain, mode, cache_level)
+        if raw_explanation is None:
+            raw_explanation = await generate_dictionary_entry(word_to_explain, mode, level)
+            if is_cacheable_dictionary_entry(raw_explanation):
+                await dictionary_cache.put(word_to_explain, mode, cache_level, raw_explanation)
 
         return {
             "reply": raw_explanation,
             "question": None,
-            "quick_replies": [],
-            "correction": None,
-            "tip": None,
-        }
-
+            "quick_replies": [],
+            "correction": None,
+            "tip": None,
+        }
+
     # --- TRANSLATE MODE (полный текст) ---
-    if (
-        lower.startswith("translate")
-        or lower.startswith("переведи")
-        or lower.startswith("перевести")
-    ):
-        text_to_translate = re.sub(
-            r"^(translate|переведи|перевести)\s*[:,\-]?\s*",
-            "",
-            user_text.strip(),
-            flags=re.IGNORECASE,
-        ).strip()
-        text_to_translate = re.sub(
-            r"^\s*please\s*[:,\-]?\s*", "", text_to_translate, flags=re.IGNORECASE
-        ).strip()
+    if intent.translate_text is not None:
+        text_to_translate = intent.translate_text
         if not text_to_translate or text_to_translate.lower() in {
             "please",
             "pls",
@@ -1220,7 +1419,7 @@ Translate the text into Russian. Keep the meaning natural.
 Text:
 {text_to_translate}
 Russian translation:"""
-        raw_translation = call_ollama_raw(translate_prompt)
+        raw_translation = await call_ollama_raw(translate_prompt)
         return {
             "reply": raw_translation,
             "question": None,
@@ -1241,39 +1440,51 @@ Russian translation:"""
         }
 
     # --- CONVERSATION HISTORY ---
-    conversation = ""
-    if history:
-        for role, content in history[-4:]:
-            if role == "user":
-                conversation += f"\nStudent: {content}"
-            else:
-                # Убираем строки с ✅ (старые исправления), чтобы LLM не повторял их
-                clean_lines = [ln for ln in content.split("\n") if not ln.strip().startswith("✅")]
-                clean_content = "\n".join(clean_lines).strip()
-                if clean_content:
-                    conversation += f"\nTeacher: {clean_content}"
+    # Реплики упаковываются в бюджет токенов от новых к старым, длинные обрезаются
+    history_lines = []
+    for role, content in history or []:
+        if role == "user":
+            history_lines.append(f"Student: {content}")
+        else:
+            # Убираем строки с ✅ (старые исправления), чтобы LLM не повторял их
+            clean_lines = [ln for ln in content.split("\n") if not ln.strip().startswith("✅")]
+            clean_content = "\n".join(clean_lines).strip()
+            if clean_content:
+                history_lines.append(f"Teacher: {clean_content}")
+    packed_history = pack_history(history_lines)
+    conversation = "".join(f"\n{line}" for line in packed_history.lines)
 
+    # Дата меняется раз в сутки — только в самом конце system
     current_date = datetime.now().strftime("%A, %B %d, %Y")
-    LEVEL_STYLE = {
-        "A1": "Use very simple words. Short sentences. Ask easy questions. Avoid complex grammar terms.",
-        "A2": "Use simple everyday English. Short explanations. One simple follow-up question.",
-        "B1": "Use natural English. Give brief corrections. Ask open-ended questions sometimes.",
-        "B2": "Use natural fluent English. Correct subtle mistakes. Ask deeper questions.",
-    }
-    style = LEVEL_STYLE.get(level, LEVEL_STYLE["A1"])
+    system = (
+        CHAT_SYSTEM_PROMPTS.get(level) or _level_system_prompt(level)
+    ) + f"\nIMPORTANT: Today's date is {current_date}."
 
-    system = f"""{SYSTEM_PROMPT}
-IMPORTANT: Today's date is {current_date}.
-Student level: {level}
-Teaching style: {style}
-CORRECTION TASK: The student's latest message is shown after "Student (NOW):". If it has grammar errors, put the SAME sentence with fixes into "correction". Do NOT use words or sentences from conversation history in "correction"!"""
-
-    user_prompt = f"""Conversation history:{conversation}
+    summary_block = f"Summary of the earlier conversation: {summary}\n\n" if summary else ""
+    user_prompt = f"""{summary_block}Conversation history:{conversation}
 
 Student (NOW): {user_text}
 Respond to the student's latest message above as the Teacher. Output valid JSON:"""
 
-    raw_response = call_ollama_raw(user_prompt, system_prompt=system).strip()
+    started = time.monotonic()
+    if on_partial is None:
+        raw_response = (await call_ollama_raw(user_prompt, system_prompt=system)).strip()
+    else:
+        last_reply = ""
+
+        async def on_text(raw_so_far: str):
+            nonlocal last_reply
+            reply_so_far = partial_json_string(raw_so_far, "reply")
+            if reply_so_far and reply_so_far.strip() != last_reply:
+                last_reply = reply_so_far.strip()
+                await on_partial(last_reply)
+
+        raw_response = (
+            await stream_ollama_raw(user_prompt, system_prompt=system, on_text=on_text)
+        ).strip()
+    prompt_metrics.record(
+        count_tokens(system) + count_tokens(user_prompt), packed_history, time.monotonic() - started
+    )
 
     # === ПАРСИНГ JSON ===
     try:
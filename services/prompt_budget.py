@@ -0,0 +1,150 @@
+"""
+Бюджет токенов промпта: оценка числа токенов (кешируется по строке),
+упаковка истории диалога в заданный бюджет от новых реплик к старым
+с обрезкой длинных реплик и метрики размера промпта по запросам.
+"""
+import math
+import os
+import re
+from functools import lru_cache
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Бюджет на историю диалога в промпте, токенов
+PROMPT_HISTORY_BUDGET = int(os.getenv("PROMPT_HISTORY_BUDGET", "350"))
+# Не больше стольких последних сообщений истории, даже если бюджет позволяет
+PROMPT_HISTORY_MAX_MESSAGES = int(os.getenv("PROMPT_HISTORY_MAX_MESSAGES", "4"))
+# Одна реплика длиннее этого обрезается
+PROMPT_TURN_MAX_TOKENS = int(os.getenv("PROMPT_TURN_MAX_TOKENS", "120"))
+
+# Корзины размера промпта (токенов) для связи размера контекста с задержкой
+PROMPT_SIZE_BUCKETS = (500, 1000, 1500, 2000, 3000, math.inf)
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+_TRUNCATION_MARK = "…"
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """
+    Оценка числа токенов без токенизатора модели: английское слово ~ 6 символов
+    на токен, кириллица и прочий не-ASCII ~ 3 символа, знак препинания — токен.
+    """
+    tokens = 0
+    for piece in _PIECE_RE.findall(text):
+        if not piece[0].isalnum() and piece[0] != "_":
+            tokens += 1
+        elif piece.isascii():
+            tokens += max(1, math.ceil(len(piece) / 6))
+        else:
+            tokens += max(1, math.ceil(len(piece) / 3))
+    return tokens + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Оставить начало текста, укладывающееся в max_tokens, обрезав по границе слова."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    end = len(text)
+    while end > 0:
+        # Сокращаем пропорционально превышению, затем до границы слова
+        end = int(end * max_tokens / count_tokens(text[:end] + _TRUNCATION_MARK) * 0.95)
+        space = text.rfind(" ", 0, end)
+        if space > end // 2:
+            end = space
+        candidate = text[:end].rstrip() + _TRUNCATION_MARK
+        if count_tokens(candidate) <= max_tokens:
+            return candidate
+    return _TRUNCATION_MARK
+
+
+class PackedHistory:
+    """Строки истории в хронологическом порядке и что пришлось отбросить."""
+
+    __slots__ = ("lines", "tokens", "dropped", "truncated")
+
+    def __init__(self, lines: list[str], tokens: int, dropped: int, truncated: int):
+        self.lines = lines
+        self.tokens = tokens
+        self.dropped = dropped
+        self.truncated = truncated
+
+
+def pack_history(
+    lines: list[str],
+    budget: int = PROMPT_HISTORY_BUDGET,
+    max_messages: int = PROMPT_HISTORY_MAX_MESSAGES,
+    max_turn_tokens: int = PROMPT_TURN_MAX_TOKENS,
+) -> PackedHistory:
+    """
+    lines — реплики от старых к новым. Из последних max_messages берём с конца,
+    пока влезают в бюджет; длинная реплика обрезается до max_turn_tokens.
+    На первой не влезшей останавливаемся, чтобы в истории не было дыр.
+    """
+    candidates = lines[-max_messages:] if max_messages > 0 else []
+    packed = []
+    used = 0
+    truncated = 0
+    for line in reversed(candidates):
+        if count_tokens(line) > max_turn_tokens:
+            line = truncate_to_tokens(line, max_turn_tokens)
+            truncated += 1
+        tokens = count_tokens(line)
+        if used + tokens > budget:
+            break
+        packed.append(line)
+        used += tokens
+    packed.reverse()
+    return PackedHistory(packed, used, len(candidates) - len(packed), truncated)
+
+
+class PromptMetrics:
+    """Размер промпта по запросам и средняя задержка в разрезе размера контекста."""
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.history_tokens = 0
+        self.dropped_messages = 0
+        self.truncated_messages = 0
+        self.by_size = [[0, 0.0] for _ in PROMPT_SIZE_BUCKETS]
+
+    def record(self, prompt_tokens: int, history: PackedHistory, seconds: float):
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.max_prompt_tokens = max(self.max_prompt_tokens, prompt_tokens)
+        self.history_tokens += history.tokens
+        self.dropped_messages += history.dropped
+        self.truncated_messages += history.truncated
+        for bucket, bound in zip(self.by_size, PROMPT_SIZE_BUCKETS):
+            if prompt_tokens <= bound:
+                bucket[0] += 1
+                bucket[1] += seconds
+                break
+        logger.debug(
+            f"Промпт ~{prompt_tokens} токенов (история {history.tokens}, "
+            f"{len(history.lines)} сообщ., отброшено {history.dropped}), ответ за {seconds:.2f} с"
+        )
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "avg_prompt_tokens": round(self.prompt_tokens / self.requests) if self.requests else 0,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "avg_history_tokens": round(self.history_tokens / self.requests) if self.requests else 0,
+            "dropped_messages": self.dropped_messages,
+            "truncated_messages": self.truncated_messages,
+            "latency_by_prompt_size": {
+                ("inf" if bound == math.inf else f"<={bound}"): {
+                    "count": count,
+                    "avg_ms": round(seconds / count * 1000) if count else None,
+                }
+                for bound, (count, seconds) in zip(PROMPT_SIZE_BUCKETS, self.by_size)
+            },
+        }
+
+
+prompt_metrics = PromptMetrics()
@@ -9,7 +9,7 @@ import random
 
 from aiogram import Bot
 
-from database import get_inactive_users, set_reminder_sent, get_user
+from async_db import get_inactive_users, set_reminder_sent, get_user
 
 logger = logging.getLogger(__name__)
 
@@ -47,7 +47,7 @@ REMINDER_TEMPLATES = [
 
 async def send_reminders(bot: Bot):
     """Отправить напоминания неактивным пользователям."""
-    inactive = get_inactive_users(inactive_hours=24)
+    inactive = await get_inactive_users(inactive_hours=24)
 
     if not inactive:
         return 0
@@ -66,7 +66,7 @@ async def send_reminders(bot: Bot):
 
         try:
             await bot.send_message(user_id, template, parse_mode="HTML")
-            set_reminder_sent(user_id)
+            await set_reminder_sent(user_id)
             sent += 1
             # Пауза между сообщениями чтобы не спамить API
             await asyncio.sleep(0.5)
@@ -0,0 +1,118 @@
+"""
+Скользящее краткое содержание диалога (summary) для каждого пользователя.
+Раз в SUMMARY_EVERY_TURNS сообщений фоновым дешёвым вызовом LLM в summary
+дописываются новые реплики из conversation_history. Summary идёт в промпт
+перед последними репликами, поэтому старый контекст не теряется, а размер
+промпта остаётся постоянным. Если лимит провайдера занят ответами
+пользователям, обновление переносится на следующий раз.
+"""
+import asyncio
+import os
+import time
+
+from async_db import get_conversation_summary, get_messages_after, save_conversation_summary
+from logger import get_logger
+from services.ollama_service import llm_router
+from services.prompt_budget import PROMPT_TURN_MAX_TOKENS, count_tokens, truncate_to_tokens
+
+logger = get_logger(__name__)
+
+# Обновлять summary каждые N сообщений пользователя (0 — выключено)
+SUMMARY_EVERY_TURNS = int(os.getenv("SUMMARY_EVERY_TURNS", "6"))
+# Предел длины summary, токенов (он же max_tokens ответа LLM)
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "120"))
+# Сколько новых сообщений сворачиваем за один вызов
+SUMMARY_BATCH_MESSAGES = 4 * max(1, SUMMARY_EVERY_TURNS)
+
+SUMMARY_SAMPLING = {"temperature": 0.2, "top_p": 0.9, "max_tokens": SUMMARY_MAX_TOKENS}
+
+SUMMARY_PROMPT = """You keep a short running summary of a chat between an English teacher and a Russian-speaking student.
+Update the summary with the new messages. Keep what helps continue the conversation: facts about the student (name, interests, plans), topics discussed, recurring mistakes. Drop greetings and small talk.
+Write plain English text, no lists or headings, at most {max_words} words.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+
+Updated summary:"""
+
+_refreshing: dict[int, asyncio.Task] = {}
+summary_stats = {"refreshed": 0, "failed": 0, "skipped": 0, "postponed": 0}
+
+
+def _format_message(role: str, content: str) -> str | None:
+    if role == "user":
+        line = f"Student: {content}"
+    else:
+        # Строки с ✅ — исправления, в содержание они не нужны
+        clean = "\n".join(
+            ln for ln in content.split("\n") if not ln.strip().startswith("✅")
+        ).strip()
+        if not clean:
+            return None
+        line = f"Teacher: {clean}"
+    return truncate_to_tokens(line, PROMPT_TURN_MAX_TOKENS)
+
+
+def _clean_summary(text: str) -> str:
+    text = text.strip()
+    if text.lower().startswith("updated summary:"):
+        text = text[len("updated summary:"):].strip()
+    return truncate_to_tokens(" ".join(text.split()), SUMMARY_MAX_TOKENS)
+
+
+async def refresh_summary(user_id: int) -> bool:
+    """Свернуть новые сообщения в summary. True — summary обновлён."""
+    try:
+        row = await get_conversation_summary(user_id)
+        summary, until = row if row else ("", 0)
+        messages = await get_messages_after(user_id, until, SUMMARY_BATCH_MESSAGES)
+        if not messages:
+            summary_stats["skipped"] += 1
+            return False
+
+        lines = [line for _, role, content in messages if (line := _format_message(role, content))]
+        prompt = SUMMARY_PROMPT.format(
+            max_words=SUMMARY_MAX_TOKENS * 2 // 3,
+            summary=summary or "(empty)",
+            messages="\n".join(lines),
+        )
+        estimated = count_tokens(prompt) + SUMMARY_MAX_TOKENS
+        # Фоновый вызов не должен занимать лимит, нужный ответам пользователям:
+        # если первый по очереди провайдер отложен или его лимитер заставит ждать,
+        # переносим обновление — сообщения останутся в истории до следующего раза
+        provider = llm_router.ordered(estimated)[0]
+        if not provider.is_healthy(time.monotonic()) or provider.limiter.would_wait(estimated):
+            summary_stats["postponed"] += 1
+            return False
+        response = await llm_router.complete(
+            [{"role": "user", "content": prompt}], SUMMARY_SAMPLING, estimated
+        )
+        new_summary = _clean_summary(response or "")
+        if not new_summary:
+            summary_stats["failed"] += 1
+            return False
+        if not await save_conversation_summary(user_id, new_summary, messages[-1][0]):
+            # Историю сбросили, пока шёл вызов
+            summary_stats["skipped"] += 1
+            return False
+    except Exception as e:
+        summary_stats["failed"] += 1
+        logger.warning(f"Не удалось обновить summary для {user_id}: {type(e).__name__}: {e}")
+        return False
+
+    summary_stats["refreshed"] += 1
+    return True
+
+
+def schedule_refresh(user_id: int, message_count: int):
+    """Запустить фоновое обновление, если пора; не ждёт его завершения."""
+    if SUMMARY_EVERY_TURNS <= 0 or message_count % SUMMARY_EVERY_TURNS:
+        return
+    if user_id in _refreshing:
+        return
+    task = asyncio.create_task(refresh_summary(user_id))
+    _refreshing[user_id] = task
+    task.add_done_callback(lambda _: _refreshing.pop(user_id, None))
@@ -0,0 +1,161 @@
+"""
+Конкурентный доступ к SQLite через пул соединений: много пользователей
+одновременно на холодном старте, по временной базе (DB_NAME).
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+import async_db
+import database
+
+USERS = 40
+MESSAGES_PER_USER = 3
+# Дольше этого — считаем, что потоки зависли на пуле
+DEADLOCK_TIMEOUT = 10
+# Сколько медленная запись держит транзакцию и допустимая пауза event loop
+SLOW_WRITE_SECONDS = 0.5
+MAX_LOOP_STALL = 0.1
+
+
+@pytest.fixture(params=[1, 4], ids=["readers=1", "readers=4"])
+def fresh_db(request, tmp_path, monkeypatch):
+    """Пустая база во временном каталоге, свой пул на request.param читателей."""
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "bot.db"))
+    monkeypatch.setattr(database, "_pool", database._ConnectionPool(request.param))
+    monkeypatch.setattr(database, "_subscription_expiry", {})
+    monkeypatch.setattr(database, "_subscription_expiry_loaded", False)
+    database.init_db()
+    for user_id in range(1, USERS + 1):
+        database.create_user(user_id, f"user{user_id}")
+    yield request.param
+    database.flush_history()
+    database.close_db()
+    database._reset_users_columns_cache()
+
+
+def _run_concurrently(fn, args: list, workers: int) -> list:
+    """
+    Выполнить fn(arg) для каждого arg в workers потоках и вернуть результаты.
+    Потоки-демоны: при взаимной блокировке тест падает по таймауту, а не виснет.
+    """
+    pending = list(enumerate(args))
+    results = [None] * len(args)
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                index, arg = pending.pop()
+            try:
+                results[index] = fn(arg)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + DEADLOCK_TIMEOUT
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    assert not any(thread.is_alive() for thread in threads), "потоки зависли на пуле соединений"
+    assert not errors, errors
+    return results
+
+
+def _user_turn(user_id: int) -> bool:
+    allowed = database.can_send_message(user_id, f"user{user_id}")
+    for i in range(MESSAGES_PER_USER):
+        database.save_message(user_id, "user", f"message {i}")
+    return allowed and database.get_user(user_id).user_id == user_id
+
+
+def test_cold_start_burst_does_not_deadlock(fresh_db):
+    # Холодный кеш колонок: каждый get_user сам идёт в PRAGMA table_info
+    database._reset_users_columns_cache()
+    users = _run_concurrently(database.get_user, list(range(1, USERS + 1)), fresh_db * 4)
+    assert [user.user_id for user in users] == list(range(1, USERS + 1))
+
+
+def test_concurrent_users_read_and_write(fresh_db):
+    database._reset_users_columns_cache()
+    assert all(_run_concurrently(_user_turn, list(range(1, USERS + 1)), 16))
+
+    database.flush_history()
+    for user_id in range(1, USERS + 1):
+        history = database.get_conversation_history(user_id, limit=10)
+        assert [content for _, content in history] == [
+            f"message {i}" for i in range(MESSAGES_PER_USER)
+        ]
+    assert database.get_stats()["users_total"] == USERS
+
+
+def test_event_loop_keeps_running_during_slow_write(fresh_db):
+    database._reset_users_columns_cache()
+
+    def slow_write():
+        with database._connect_locked() as conn:
+            conn.execute("UPDATE users SET level = 'B1' WHERE user_id = 1")
+            time.sleep(SLOW_WRITE_SECONDS)
+        return time.monotonic()
+
+    async def main():
+        gaps = []
+
+        async def ticker():
+            last = time.monotonic()
+            while True:
+                await asyncio.sleep(0.01)
+                now = time.monotonic()
+                gaps.append(now - last)
+                last = now
+
+        ticks = asyncio.create_task(ticker())
+        write = asyncio.create_task(async_db.run_write(slow_write))
+        await asyncio.sleep(0.05)
+        # Чтение идёт мимо занятого писателя и видит последний коммит
+        user = await async_db.get_user(2)
+        history = await async_db.get_conversation_history(2)
+        read_done = time.monotonic()
+        write_done = await write
+        ticks.cancel()
+        return gaps, user, history, read_done, write_done
+
+    gaps, user, history, read_done, write_done = asyncio.run(main())
+    assert max(gaps) < MAX_LOOP_STALL
+    assert len(gaps) >= SLOW_WRITE_SECONDS / 0.02
+    assert user.user_id == 2 and history == []
+    assert read_done < write_done
+    assert database.get_user(1).level == "B1"
+
+
+def test_reads_do_not_queue_behind_writes(fresh_db):
+    # Записей больше, чем потоков у читателей: раньше они занимали общий пул целиком
+    writes_count = database._SQLITE_READERS + 2
+
+    def slow_write(user_id):
+        with database._connect_locked() as conn:
+            conn.execute("UPDATE users SET level = 'B2' WHERE user_id = ?", (user_id,))
+            time.sleep(0.1)
+
+    async def main():
+        writes = [
+            asyncio.ensure_future(async_db.run_write(slow_write, user_id))
+            for user_id in range(1, writes_count + 1)
+        ]
+        await asyncio.sleep(0.02)
+        started = time.monotonic()
+        users = await asyncio.gather(*(async_db.get_user(user_id) for user_id in range(1, USERS + 1)))
+        read_seconds = time.monotonic() - started
+        await asyncio.gather(*writes)
+        return users, read_seconds
+
+    users, read_seconds = asyncio.run(main())
+    assert [user.user_id for user in users] == list(range(1, USERS + 1))
+    # Все записи вместе идут не меньше writes_count * 0.1 с
+    assert read_seconds < 0.1
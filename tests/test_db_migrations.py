@@ -0,0 +1,73 @@
+"""
+Миграции схемы при одновременном старте нескольких процессов
+(бот и prewarm_dictionary.py) на одной базе.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+import database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "bot.db")
+    monkeypatch.setattr(database, "DB_NAME", path)
+    monkeypatch.setattr(database, "_pool", database._ConnectionPool(1))
+    yield path
+    database.close_db()
+    database._reset_users_columns_cache()
+
+
+def _applied_versions() -> list[int]:
+    with database._connect_read() as conn:
+        return [row[0] for row in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+
+
+def test_step_applied_by_another_process_is_skipped(db_path, monkeypatch):
+    database.init_db()
+
+    # Первое чтение версии устарело: другой процесс применил все шаги
+    # между ним и BEGIN IMMEDIATE
+    real = database._current_schema_version
+    calls = []
+
+    def stale_first_read(cur):
+        calls.append(1)
+        return 0 if len(calls) == 1 else real(cur)
+
+    monkeypatch.setattr(database, "_current_schema_version", stale_first_read)
+    assert database.init_db() == 0
+    assert _applied_versions() == [number for number, _, _ in database._MIGRATIONS]
+
+
+def test_concurrent_processes_apply_each_step_once(db_path):
+    script = (
+        "import database, sys; database.DB_NAME = sys.argv[1]; "
+        "print(database.init_db()); database.close_db()"
+    )
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-c", script, db_path],
+            cwd=str(os.path.dirname(db_path)),
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        for _ in range(4)
+    ]
+    applied = []
+    for process in processes:
+        out, err = process.communicate(timeout=60)
+        assert process.returncode == 0, err
+        applied.append(int(out.strip().splitlines()[-1]))
+
+    assert sum(applied) == database.SCHEMA_VERSION
+    assert _applied_versions() == [number for number, _, _ in database._MIGRATIONS]
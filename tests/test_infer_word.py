@@ -0,0 +1,93 @@
+"""
+Фиксированный корпус для infer_word_from_recent_context: ожидаемые слова сняты
+с исходной (не оптимизированной) реализации, чтобы отсечение кандидатов
+по верхним границам ratio не меняло результат.
+"""
+import pytest
+
+from services.ollama_service import infer_word_from_recent_context
+
+
+def bot(text):
+    return ("assistant", text)
+
+
+def student(text):
+    return ("user", text)
+
+
+CORPUS = [
+    # STT разбил слово на несколько: "comedies" -> "come it is"
+    ("what does come it is mean", [bot("Do you like comedies or dramas?")], "comedies"),
+    (
+        "what does come it is mean?",
+        [student("I watch films"), bot("Great! Do you prefer comedies, thrillers or dramas?")],
+        "comedies",
+    ),
+    ("meaning of rain bow", [bot("Look, a rainbow over the river!")], "rainbow"),
+    ("meaning of lib rary", [bot("The library is near the library of the school.")], "library"),
+    ("what does tom or row mean", [bot("See you tomorrow, or maybe the day after tomorrow.")], None),
+    # Опечатки и искажения одного слова
+    ("meaning of vegetable", [bot("Eat more vegetables and fruit every day.")], "vegetables"),
+    ("what is the meaning of beautifull", [bot("What a beautiful sunny morning!")], "beautiful"),
+    ("translate the word nessesary", [bot("It is necessary to practice every day.")], "necessary"),
+    (
+        "translation of the word enviroment",
+        [bot("We should protect the environment around us.")],
+        "environment",
+    ),
+    ("what does advencher mean", [bot("I love adventure stories.")], "adventure"),
+    ("what does kat mean", [bot("I have a cat and a dog.")], "cat"),
+    (
+        "meaning of strawbery",
+        [bot("Your favourite meaning of the word please: strawberry, raspberry, blueberry.")],
+        "strawberry",
+    ),
+    (
+        "what does brekfast mean",
+        [
+            bot("What did you have for breakfast?"),
+            student("eggs"),
+            bot("Eggs are a healthy breakfast. What about lunch?"),
+        ],
+        "breakfast",
+    ),
+    (
+        "translate please the word sircle",
+        [bot("Draw a circle, then a circus tent and a cycle path.")],
+        "circle",
+    ),
+    (
+        "what is mean by comitee",
+        [bot("The committee will meet on Monday to commit to a decision.")],
+        "committee",
+    ),
+    (
+        "what does wether mean",
+        [bot("What's the weather like? Whether it rains or not, we go.")],
+        "weather",
+    ),
+    ("meaning of interesting", [bot("That is an interesting and interested question.")], "interesting"),
+    ("meaning of she", [bot("She sells sea shells.")], "she"),
+    # При равном score побеждает кандидат, встретившийся раньше
+    ("what does kat mean", [bot("A bat and a cat sat on a mat.")], "bat"),
+    ("what does kat mean", [bot("A cat and a bat sat on a mat.")], "cat"),
+    # Нечего восстанавливать
+    ("what does it mean", [bot("Do you like comedies?")], None),
+    ("what does xyzzy mean", [bot("Do you like comedies?")], None),
+    ("что значит адвенчур", [bot("I love adventure stories.")], None),
+    ("hello there", [bot("Do you like comedies?")], None),
+    ("meaning of travel", [], None),
+    # Кандидаты берутся только из реплик ассистента и только из последних шести
+    ("meaning of comedies", [student("what does comedies mean"), student("comedies?")], None),
+    (
+        "what does ocupation mean",
+        [bot("old message about occupation")] + [bot("recent chat about weather")] * 3 + [student("ok")] * 3,
+        None,
+    ),
+]
+
+
+@pytest.mark.parametrize("text, history, expected", CORPUS)
+def test_infer_word_corpus(text, history, expected):
+    assert infer_word_from_recent_context(text, history) == expected
@@ -0,0 +1,68 @@
+"""
+Золотые ответы intent_router.route(): ожидаемые значения получены прежними
+последовательными re.search из ollama_service и заморожены, чтобы объединённое
+регулярное выражение не разошлось с ними при правках шаблонов.
+"""
+import pytest
+
+from services import intent_router
+
+# (сообщение, word, translation_request, translate_text, kind)
+GOLDEN = [
+    ('What does apple mean?', 'apple', True, None, 'word_translate'),
+    ("what does 'serendipity' mean", None, True, None, 'chat'),
+    ('What is the meaning of freedom?', 'freedom', True, None, 'word_translate'),
+    ('Tell me the meaning of lazy', 'lazy', True, None, 'word_translate'),
+    ('Russian translation of the word castle', 'castle', True, None, 'word_translate'),
+    ('translation of word bridge', 'bridge', True, None, 'word_translate'),
+    ('Translate please the word window', 'window', True, 'the word window', 'word_translate'),
+    ('translate: I love my cat', None, True, 'I love my cat', 'full_translate'),
+    ('Translate please, how are you?', 'how', True, 'how are you?', 'word_translate'),
+    ('translate', None, True, '', 'full_translate'),
+    ('what is mean by ambiguous', 'ambiguous', True, None, 'word_translate'),
+    ('what is mean table', 'table', True, None, 'word_translate'),
+    ("what's fridge", 'fridge', False, None, 'word_lookup'),
+    ('Hi! I like football very much.', None, False, None, 'chat'),
+    ('I want to travel to London next year', None, False, None, 'chat'),
+    ('What do you mean?', None, True, None, 'chat'),
+    ('That means a lot to me', None, False, None, 'chat'),
+    ('Что значит awesome?', 'awesome', True, None, 'word_translate'),
+    ('что такое вдохновение', 'вдохновение', False, None, 'word_lookup'),
+    ('Что означает слово deadline', 'слово', True, None, 'word_translate'),
+    ('значение слова удача', 'слова', False, None, 'word_lookup'),
+    ('перевод apple', 'apple', True, None, 'word_translate'),
+    ('Переведи слово пожалуйста яблоко', 'яблоко', True, 'слово пожалуйста яблоко', 'word_translate'),
+    ('переведи: я люблю читать книги', None, True, 'я люблю читать книги', 'full_translate'),
+    ('перевести текст на английский', None, True, 'текст на английский', 'full_translate'),
+    ('Как переводится cucumber?', 'cucumber', True, None, 'word_translate'),
+    ('как будет собака', 'собака', False, None, 'word_lookup'),
+    ('как по-английски кошка', 'кошка', False, None, 'word_lookup'),
+    ('Как по английски стол', 'стол', False, None, 'word_lookup'),
+    ('хобби - это что?', 'хобби', False, None, 'word_lookup'),
+    ('deadline - что это', 'deadline', False, None, 'word_lookup'),
+    ('Привет, как дела?', None, False, None, 'chat'),
+    ('Я учу английский каждый день', None, False, None, 'chat'),
+    ('what does a mean? meaning of apple', 'apple', True, None, 'word_translate'),
+    ("what's a", None, False, None, 'chat'),
+    ('что значит я', None, True, None, 'chat'),
+]
+
+
+@pytest.mark.parametrize("text, word, translation_request, translate_text, kind", GOLDEN)
+def test_route_matches_golden(text, word, translation_request, translate_text, kind):
+    intent = intent_router.route(text)
+    assert intent.word == word
+    assert intent.translation_request is translation_request
+    assert intent.translate_text == translate_text
+    assert intent.kind == kind
+
+
+def test_short_word_falls_through_to_next_pattern():
+    # Первый шаблон нашёл "a" (короче 2 букв) — слово берётся из следующего шаблона
+    assert intent_router.extract_word("what does a mean? meaning of apple") == "apple"
+    assert intent_router.extract_word("what's a") is None
+
+
+def test_pattern_priority_wins_over_position():
+    # "meaning of" стоит в списке раньше "translate", хотя в тексте позже
+    assert intent_router.extract_word("translate cat, meaning of dog") == "dog"
@@ -0,0 +1,31 @@
+"""
+LLMLimiter: запись в минутном окне ставится в момент отправки,
+поэтому в любое окно уходит не больше rpm запросов.
+"""
+import asyncio
+import time
+
+from services.llm_limiter import LLMLimiter
+
+WINDOW = 0.5
+
+
+def test_rpm_counts_actual_send_times():
+    limiter = LLMLimiter(max_concurrency=1, rpm=2, tpm=0, window=WINDOW)
+    sent = []
+
+    async def request(hold: float):
+        async with limiter.slot(1):
+            sent.append(time.monotonic())
+            await asyncio.sleep(hold)
+
+    async def main():
+        # Первый запрос долго держит слот, остальные ждут его в очереди
+        await asyncio.gather(request(0.45), request(0.01), request(0.01), request(0.01))
+
+    asyncio.run(main())
+    assert len(sent) == 4
+    for first in sent:
+        # С запасом на точность таймеров event loop
+        in_window = [t for t in sent if first <= t < first + WINDOW - 0.05]
+        assert len(in_window) <= 2, [round(t - sent[0], 2) for t in sent]
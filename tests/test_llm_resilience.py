@@ -0,0 +1,196 @@
+"""
+Повторы, Retry-After, circuit breaker и переход на запасной провайдер
+против настоящего HTTP-сервера (aiohttp), который отдаёт заданные ошибки.
+"""
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from services.llm_limiter import LLMLimiter
+from services.llm_providers import LLMRouter, OllamaHTTPError, OllamaProvider
+from services.llm_resilience import CircuitBreaker, CircuitOpenError, Resilience
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+SAMPLING = {"temperature": 0.5, "top_p": 0.9, "max_tokens": 16}
+
+
+class FakeOllama:
+    """Отвечает по сценарию: очередь (status, headers); когда она пуста — 200."""
+
+    def __init__(self, script=(), delay: float = 0.0, reply: str = "ok"):
+        self.script = list(script)
+        self.delay = delay
+        self.reply = reply
+        self.hits = 0
+
+    async def chat(self, request):
+        self.hits += 1
+        await request.json()
+        status, headers = self.script.pop(0) if self.script else (200, {})
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if status != 200:
+            return web.Response(status=status, headers=headers, text="injected failure")
+        return web.json_response(
+            {"message": {"content": self.reply}, "prompt_eval_count": 3, "eval_count": 2}
+        )
+
+    async def start(self) -> TestServer:
+        app = web.Application()
+        app.router.add_post("/api/chat", self.chat)
+        server = TestServer(app)
+        await server.start_server()
+        return server
+
+
+def make_provider(server: TestServer, **resilience) -> OllamaProvider:
+    breaker = CircuitBreaker(
+        resilience.pop("threshold", 5), resilience.pop("reset", 30.0)
+    )
+    return OllamaProvider(
+        base_url=str(server.make_url("")),
+        model="test",
+        timeout=5,
+        limiter=LLMLimiter(max_concurrency=8, rpm=0, tpm=0),
+        resilience=Resilience(base_delay=0.01, max_delay=0.02, breaker=breaker, **resilience),
+        prior_latency=1.0,
+    )
+
+
+def run(fake: FakeOllama, scenario, **provider_kwargs):
+    """Поднять сервер, выполнить scenario(provider) и закрыть сервер и сессию."""
+
+    async def main():
+        server = await fake.start()
+        provider = make_provider(server, **provider_kwargs)
+        try:
+            return await scenario(provider)
+        finally:
+            await provider.close()
+            await server.close()
+
+    return asyncio.run(main())
+
+
+def test_server_errors_are_retried_until_success():
+    fake = FakeOllama(script=[(503, {}), (503, {})])
+
+    async def scenario(provider):
+        assert await provider.complete(MESSAGES, SAMPLING, 10) == "ok"
+        return provider.resilience.metrics
+
+    metrics = run(fake, scenario)
+    assert fake.hits == 3
+    assert metrics["retries"] == 2
+    assert metrics["successes"] == 1
+
+
+def test_retry_after_is_honoured():
+    fake = FakeOllama(script=[(429, {"Retry-After": "1"})])
+
+    async def scenario(provider):
+        started = time.monotonic()
+        assert await provider.complete(MESSAGES, SAMPLING, 10) == "ok"
+        return time.monotonic() - started, provider.resilience.metrics
+
+    elapsed, metrics = run(fake, scenario)
+    assert fake.hits == 2
+    assert elapsed >= 1.0
+    assert metrics["rate_limited"] == 1
+    assert metrics["retries"] == 1
+
+
+def test_client_error_is_not_retried():
+    fake = FakeOllama(script=[(400, {})])
+
+    async def scenario(provider):
+        with pytest.raises(OllamaHTTPError) as error:
+            await provider.complete(MESSAGES, SAMPLING, 10)
+        assert error.value.status_code == 400
+        return provider.resilience
+
+    resilience = run(fake, scenario)
+    assert fake.hits == 1
+    assert resilience.metrics["retries"] == 0
+    # Ошибка запроса — не отказ провайдера
+    assert resilience.breaker.consecutive_failures == 0
+
+
+def test_rate_limit_not_retried_when_fallback_exists():
+    fake = FakeOllama(script=[(429, {"Retry-After": "1"})])
+
+    async def scenario(provider):
+        with pytest.raises(OllamaHTTPError) as error:
+            await provider.complete(MESSAGES, SAMPLING, 10)
+        assert error.value.status_code == 429
+
+    run(fake, scenario, retry_rate_limited=False)
+    assert fake.hits == 1
+
+
+def test_breaker_opens_then_single_probe_closes_it():
+    fake = FakeOllama(script=[(503, {}), (503, {})], delay=0.05)
+
+    async def scenario(provider):
+        breaker = provider.resilience.breaker
+        for _ in range(2):
+            with pytest.raises(OllamaHTTPError):
+                await provider.complete(MESSAGES, SAMPLING, 10)
+        assert breaker.state == "open"
+
+        # Открытый breaker отвечает отказом, не трогая сервер
+        hits = fake.hits
+        with pytest.raises(CircuitOpenError):
+            await provider.complete(MESSAGES, SAMPLING, 10)
+        assert fake.hits == hits
+
+        # После reset_timeout из пяти одновременных запросов до сервера доходит один
+        await asyncio.sleep(0.25)
+        calls = [
+            asyncio.ensure_future(provider.complete(MESSAGES, SAMPLING, 10)) for _ in range(5)
+        ]
+        await asyncio.sleep(0.01)
+        assert breaker.state == "half_open"
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        assert fake.hits == hits + 1
+        assert results.count("ok") == 1
+        assert sum(isinstance(r, CircuitOpenError) for r in results) == 4
+        assert breaker.state == "closed"
+
+        assert await provider.complete(MESSAGES, SAMPLING, 10) == "ok"
+
+    run(fake, scenario, max_retries=0, threshold=2, reset=0.2)
+
+
+def test_router_falls_back_to_local_provider_on_rate_limit():
+    primary_fake = FakeOllama(script=[(429, {"Retry-After": "5"})], reply="primary")
+    local_fake = FakeOllama(reply="local")
+
+    async def main():
+        primary_server = await primary_fake.start()
+        local_server = await local_fake.start()
+        primary = make_provider(primary_server, retry_rate_limited=False)
+        primary.name = "primary"
+        local = make_provider(local_server)
+        local.prior_latency = 5.0
+        router = LLMRouter([primary, local])
+        try:
+            assert router.ordered(10) == [primary, local]
+            assert await router.complete(MESSAGES, SAMPLING, 10) == "local"
+            # 429 без повторов, провайдер отложен на Retry-After
+            assert primary_fake.hits == 1
+            assert not primary.is_healthy(time.monotonic())
+            assert router.ordered(10) == [local, primary]
+
+            assert await router.complete(MESSAGES, SAMPLING, 10) == "local"
+            assert primary_fake.hits == 1
+            assert router.fallbacks == 1
+        finally:
+            await router.close()
+            await primary_server.close()
+            await local_server.close()
+
+    asyncio.run(main())